@@ -0,0 +1,350 @@
+"""
+Micro-benchmarks of the hot paths of the system: building and loading the index, preprocessing the text,
+the ranking functions of the models, the clustering and the recommendations. They run offline over a
+synthetic corpus generated from a fixed seed, in a temporary folder with the layout of the data folder,
+so the indexes and models of the real corpora are never touched.
+
+Usage, from src/code:
+
+    python benchmark.py --output baseline.json
+    python benchmark.py --baseline baseline.json --threshold 0.2
+
+With --baseline it exits with status 1 if both the min and the median time of a benchmark are more than
+threshold slower than in the baseline. The fast operations are looped until a measure takes --min-time seconds,
+so the timer resolution and the noise of a single run don't decide the result.
+"""
+import argparse
+import json
+import math
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from corpus import TestCorpus
+from models import BooleanModel, DenseRetrievalModel, ExtendedBooleanModel, HashingEncoder, LSAModel, VectorModel
+
+STOPWORDS = ['the', 'of', 'and', 'a', 'in', 'to', 'is', 'for', 'with', 'on', 'by', 'at', 'from', 'that']
+SYLLABLES = ['ka', 'lo', 'mi', 'tra', 'ven', 'sor', 'pel', 'du', 'ri', 'gon', 'sta', 'fle', 'qui', 'bar', 'nes']
+
+
+class SyntheticCorpus:
+    """
+    Generator of a reproducible corpus of text files. The words follow a Zipf distribution over a vocabulary
+    of made up words, mixed with stopwords, like the words of a natural language.
+
+    Attributes:
+    - num_docs: the number of documents
+    - doc_length: the mean number of words of a document
+    - vocab_size: the number of different words
+    - seed: the seed of the random generator
+    """
+
+    def __init__(self, num_docs=1000, doc_length=120, vocab_size=3000, seed=0):
+        self.num_docs = num_docs
+        self.doc_length = doc_length
+        self.vocab_size = vocab_size
+        self.seed = seed
+        rng = random.Random(seed)
+        words = set()
+        while len(words) < vocab_size:
+            words.add(''.join(rng.choices(SYLLABLES, k=rng.randint(2, 4))))
+        self.vocabulary = sorted(words)
+        rng.shuffle(self.vocabulary)
+        self.weights = [1 / rank for rank in range(1, vocab_size + 1)]
+
+    def words(self, rng: random.Random, n: int) -> List[str]:
+        words = rng.choices(self.vocabulary, weights=self.weights, k=n)
+        return [rng.choice(STOPWORDS) if rng.random() < 0.3 else word for word in words]
+
+    def texts(self) -> List[str]:
+        rng = random.Random(self.seed + 1)
+        return [' '.join(self.words(rng, rng.randint(self.doc_length // 2, self.doc_length * 3 // 2)))
+                for _ in range(self.num_docs)]
+
+    def write(self, path: Path):
+        """Writes every document in a file, the name of the file is its title"""
+        path.mkdir(parents=True, exist_ok=True)
+        for i, text in enumerate(self.texts()):
+            (path / f'{i:06d}.txt').write_text(text)
+
+    def queries(self, n=50, length=3) -> List[str]:
+        rng = random.Random(self.seed + 2)
+        # the queries use the frequent words, like the queries of the users
+        return [' '.join(rng.choices(self.vocabulary[:300], k=length)) for _ in range(n)]
+
+    def boolean_queries(self, n=50) -> List[str]:
+        rng = random.Random(self.seed + 3)
+        return ['%s and (%s or not %s)' % tuple(rng.choices(self.vocabulary[:300], k=3)) for _ in range(n)]
+
+
+class BenchmarkFixture:
+    """
+    Folder with the layout of the data folder and the synthetic corpus, the process works inside it while
+    the benchmarks run, because the paths of the indexes and the models are relative.
+
+    Attributes:
+    - root: the temporary folder
+    - synthetic: the generator of the corpus
+    - corpus_path: the folder with the files of the corpus
+    """
+
+    def __init__(self, synthetic: SyntheticCorpus):
+        self.synthetic = synthetic
+        self.root = Path(tempfile.mkdtemp(prefix='ir-benchmark-'))
+        self.corpus_path = self.root / 'data' / 'corpus' / 'synthetic'
+        self._cwd = None
+        self._corpus = None
+        self._models = {}
+
+    def __enter__(self) -> "BenchmarkFixture":
+        for folder in ('indexed_corpus', 'cluster', 'ratings'):
+            (self.root / 'data' / folder).mkdir(parents=True, exist_ok=True)
+        self.synthetic.write(self.corpus_path)
+        work_dir = self.root / 'src' / 'code'
+        work_dir.mkdir(parents=True)
+        self._cwd = os.getcwd()
+        os.chdir(work_dir)
+        return self
+
+    def __exit__(self, *exc):
+        os.chdir(self._cwd)
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def remove_index(self):
+        shutil.rmtree(self.root / 'data' / 'indexed_corpus', ignore_errors=True)
+        (self.root / 'data' / 'indexed_corpus').mkdir()
+
+    def build_corpus(self) -> TestCorpus:
+        return TestCorpus(self.corpus_path, stemming=True, workers=1)
+
+    @property
+    def corpus(self) -> TestCorpus:
+        if self._corpus is None:
+            self._corpus = self.build_corpus()
+        return self._corpus
+
+    def model(self, name: str):
+        if name not in self._models:
+            self._models[name] = {
+                'vector': VectorModel,
+                'boolean': BooleanModel,
+                'extended': ExtendedBooleanModel,
+                'lsa': LSAModel,
+                # the dense models use the encoder that works offline
+                'dense': lambda corpus: DenseRetrievalModel(corpus, HashingEncoder()),
+                'dense_ivf': lambda corpus: DenseRetrievalModel(corpus, HashingEncoder(), n_lists=32, nprobe=4),
+            }[name](self.corpus)
+        return self._models[name]
+
+
+class Benchmark:
+    """
+    A measured operation.
+
+    Attributes:
+    - name: the name of the benchmark
+    - run: the function that is timed
+    - setup: function called before every run, it isn't timed
+    - operations: the number of operations of a run, the report has the time per operation too
+    """
+
+    def __init__(self, name: str, run: Callable[[], object], setup: Callable[[], object] = None, operations=1):
+        self.name = name
+        self.run = run
+        self.setup = setup
+        self.operations = operations
+
+    def measure(self, warmup: int, repeat: int, min_time: float = 0.0) -> dict:
+        """
+        Times the benchmark. Every measure loops the run enough times to take at least min_time seconds,
+        the number of loops is calibrated with the first warmup run.
+
+        Args:
+        - warmup: the number of runs before the measures, to fill the caches, there is always one to calibrate the loops
+        - repeat: the number of measures
+        - min_time: the minimum seconds of the timed runs of a measure
+
+        Returns:
+        - dict: the min, median, mean and standard deviation of the seconds of a run, the median seconds
+        of an operation, the runs of every measure and the peak of memory allocated by a run in bytes
+        """
+        elapsed = self._run()
+        for _ in range(warmup - 1):
+            self._run()
+        loops = max(1, math.ceil(min_time / elapsed)) if elapsed > 0 else 1
+        times = [sum(self._run() for _ in range(loops)) / loops for _ in range(repeat)]
+
+        # the memory is traced in its own run, tracing slows down the allocations
+        if self.setup is not None:
+            self.setup()
+        tracemalloc.start()
+        try:
+            self.run()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        median = statistics.median(times)
+        return {
+            'min': min(times),
+            'median': median,
+            'mean': statistics.mean(times),
+            'stdev': statistics.stdev(times) if len(times) > 1 else 0.0,
+            'per_operation': median / self.operations,
+            'peak_memory': peak,
+            'repeat': repeat,
+            'loops': loops,
+        }
+
+    def _run(self) -> float:
+        if self.setup is not None:
+            self.setup()
+        start = time.perf_counter()
+        self.run()
+        return time.perf_counter() - start
+
+
+def build_benchmarks(fixture: BenchmarkFixture) -> List[Benchmark]:
+    """Creates the benchmarks of the hot paths over the fixture"""
+    synthetic = fixture.synthetic
+    texts = synthetic.texts()[:200]
+    queries = synthetic.queries()
+    boolean_queries = synthetic.boolean_queries()
+
+    def ranking(name: str, model_queries: List[str]) -> Callable[[], None]:
+        def run():
+            model = fixture.model(name)
+            for query in model_queries:
+                model.rank(query, k=10)
+        return run
+
+    def fit_cluster():
+        fixture.model('vector').clusterer._fit_cluster(4)
+
+    def recommend():
+        recommender = fixture.model('vector').document_recommender
+        recommender.ratings = {doc_id: 1 for doc_id in range(0, fixture.corpus.live_docs.size, 50)}
+        recommender.recommend_documents(5)
+
+    return [
+        Benchmark('corpus_build', fixture.build_corpus, setup=fixture.remove_index),
+        Benchmark('corpus_load', fixture.build_corpus, setup=lambda: fixture.corpus),
+        Benchmark('preprocess_text', lambda: [fixture.corpus.preprocess_text(text) for text in texts],
+                  operations=len(texts)),
+        Benchmark('ranking_vector', ranking('vector', queries), setup=lambda: fixture.model('vector'),
+                  operations=len(queries)),
+        Benchmark('ranking_boolean', ranking('boolean', boolean_queries), setup=lambda: fixture.model('boolean'),
+                  operations=len(boolean_queries)),
+        Benchmark('ranking_extended', ranking('extended', boolean_queries + queries),
+                  setup=lambda: fixture.model('extended'), operations=len(boolean_queries) + len(queries)),
+        Benchmark('ranking_lsa', ranking('lsa', queries), setup=lambda: fixture.model('lsa'),
+                  operations=len(queries)),
+        Benchmark('fit_lsa', lambda: fixture.model('lsa').fit()),
+        Benchmark('ranking_dense', ranking('dense', queries), setup=lambda: fixture.model('dense'),
+                  operations=len(queries)),
+        Benchmark('ranking_dense_ivf', ranking('dense_ivf', queries), setup=lambda: fixture.model('dense_ivf'),
+                  operations=len(queries)),
+        Benchmark('encode_dense', lambda: fixture.model('dense').build_index()),
+        Benchmark('fit_cluster', fit_cluster),
+        Benchmark('recommend_documents', recommend),
+    ]
+
+
+def run_benchmarks(synthetic: SyntheticCorpus, warmup=1, repeat=15, only: List[str] = None,
+                   min_time=0.2) -> dict:
+    """
+    Runs the benchmarks over a synthetic corpus
+
+    Args:
+    - synthetic: the generator of the corpus
+    - warmup: the number of untimed runs of every benchmark
+    - repeat: the number of measures of every benchmark
+    - min_time: the minimum seconds of a measure, the fast benchmarks are run several times in a measure
+    - only: the names of the benchmarks to run, all of them if None
+
+    Returns:
+    - dict: the parameters of the corpus and the measures of every benchmark
+    """
+    results = {}
+    with BenchmarkFixture(synthetic) as fixture:
+        for benchmark in build_benchmarks(fixture):
+            if only is None or benchmark.name in only:
+                results[benchmark.name] = benchmark.measure(warmup, repeat, min_time)
+                print(f'{benchmark.name}: {results[benchmark.name]["median"] * 1000:.2f} ms', file=sys.stderr)
+    return {
+        'corpus': {'num_docs': synthetic.num_docs, 'doc_length': synthetic.doc_length,
+                   'vocab_size': synthetic.vocab_size, 'seed': synthetic.seed},
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'benchmarks': results,
+    }
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> Dict[str, Optional[float]]:
+    """
+    Compares the times of the benchmarks with a baseline. A benchmark regressed if both its min and its median
+    time are slower than the baseline, the min is the least noisy measure and the median confirms that the
+    slowdown isn't in a few measures.
+
+    Args:
+    - results: the report of run_benchmarks
+    - baseline: a report of run_benchmarks over the same corpus
+    - threshold: the allowed slowdown, 0.2 allows a benchmark to be 20% slower
+
+    Returns:
+    - dict: the smaller of the ratios between the min and median times and the ones of the baseline
+    for every benchmark that regressed
+    """
+    regressions = {}
+    for name, measures in results['benchmarks'].items():
+        if name not in baseline['benchmarks']:
+            continue
+        ratio = min(measures[stat] / baseline['benchmarks'][name][stat] for stat in ('min', 'median'))
+        if ratio > 1 + threshold:
+            regressions[name] = ratio
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Micro-benchmarks of the hot paths over a synthetic corpus')
+    parser.add_argument('--docs', type=int, default=1000, help='number of documents of the corpus')
+    parser.add_argument('--doc-length', type=int, default=120, help='mean number of words of a document')
+    parser.add_argument('--vocab', type=int, default=3000, help='number of different words')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--warmup', type=int, default=1, help='untimed runs of every benchmark')
+    parser.add_argument('--repeat', type=int, default=15, help='measures of every benchmark')
+    parser.add_argument('--min-time', type=float, default=0.2,
+                        help='minimum seconds of a measure, the fast benchmarks are looped to reach it')
+    parser.add_argument('--only', nargs='+', default=None, help='names of the benchmarks to run')
+    parser.add_argument('--output', type=Path, default=None, help='file for the json report')
+    parser.add_argument('--baseline', type=Path, default=None, help='report to compare with')
+    parser.add_argument('--threshold', type=float, default=0.2, help='allowed slowdown over the baseline')
+    args = parser.parse_args()
+
+    baseline = json.loads(args.baseline.read_text()) if args.baseline is not None else None
+    if baseline is not None and baseline['corpus'] != {'num_docs': args.docs, 'doc_length': args.doc_length,
+                                                       'vocab_size': args.vocab, 'seed': args.seed}:
+        parser.error('the baseline was measured over another corpus')
+
+    synthetic = SyntheticCorpus(args.docs, args.doc_length, args.vocab, args.seed)
+    results = run_benchmarks(synthetic, args.warmup, args.repeat, args.only, args.min_time)
+    if args.output is not None:
+        args.output.write_text(json.dumps(results, indent=2))
+    print(json.dumps(results, indent=2))
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.threshold)
+        for name, ratio in regressions.items():
+            print(f'{name} regressed: {ratio:.2f}x the baseline', file=sys.stderr)
+        if len(regressions) > 0:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
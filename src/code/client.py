@@ -1,13 +1,177 @@
-from functools import cache
+"""
+Search service. The corpus and the models are loaded once when the app is created and every request is
+answered with them, instead of building the model for each query. Run it from src/code with a WSGI server:
 
-from flask import Flask, jsonify
-from main import get_extended_boolean_model
+    gunicorn -c gunicorn.conf.py
 
-app = Flask(__name__)
+or with the development server of flask running this module. The instrumentation of the stages of the
+queries is exposed in /metrics, every worker of gunicorn has its own metrics.
+"""
+import io
+import pstats
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from flask import Flask, Response, jsonify, request
+
+from corpus import Corpus, CranCorpus
+from models import BooleanModel, ExtendedBooleanModel, IRModel, LSAModel, QueryResultCache, SearchResult, VectorModel
+from utils import download_cran_corpus_if_not_exist
+# the models raise the exception of the package src.code.query
+from src.code.query import InvalidQueryException
+from src.code.instrumentation import metrics
+
+MODELS = {
+    'extended': ExtendedBooleanModel,
+    'boolean': BooleanModel,
+    'vector': VectorModel,
+    'lsa': LSAModel,
+}
+
+
+class SearchService:
+    """
+    The corpus and the models that answer the searches, they are shared by all the requests of a worker.
+    The searches only read the index, they don't save the ratings of the recommender like the queries of the
+    console, because the threads and the workers of the server would write the same file at once.
+
+    Attributes:
+    - corpus: the indexed corpus
+    - models: the models by name
+    - result_cache: the cache of the rankings, shared by the models
+    - default_model: the name of the model used if the request doesn't choose one
+    - max_k: the maximum number of results of a page
+    """
+
+    def __init__(self, corpus: Corpus, models: Dict[str, IRModel], default_model='extended', max_k=100,
+                 result_cache: Optional[QueryResultCache] = None):
+        self.corpus = corpus
+        self.models = models
+        self.result_cache = result_cache if result_cache is not None else QueryResultCache()
+        for model in self.models.values():
+            model.result_cache = self.result_cache
+        self.default_model = default_model
+        self.max_k = max_k
+
+    @classmethod
+    def load(cls, model_names: List[str] = None, **kwargs) -> "SearchService":
+        """
+        Loads the cranfield corpus and builds the models
+
+        Args:
+        - model_names: the names of the models to build, all of them by default
+
+        Returns:
+        - SearchService: the service with the corpus and the models
+        """
+        download_cran_corpus_if_not_exist()
+        corpus = CranCorpus(Path('../../data/corpus/cranfield'), language='english', stemming=True)
+        models = {name: MODELS[name](corpus) for name in (model_names or MODELS)}
+        return cls(corpus, models, **kwargs)
+
+    def search(self, query: str, model_name: str = None, k: int = 10, offset: int = 0) -> SearchResult:
+        """
+        Gets a page of the ranking of a query
+
+        Args:
+        - query: the query of the user
+        - model_name: the name of the model, the default model if None
+        - k: the number of results of the page
+        - offset: the position in the ranking of the first result of the page
+
+        Returns:
+        - SearchResult: the ranked documents of the page and their scores
+
+        Raises:
+        - KeyError: if there's no model with that name
+        - InvalidQueryException: if the query is not valid for the model
+        """
+        return self.models[model_name or self.default_model].search(query, k, offset)
+
+
+def create_app(service: SearchService = None, instrumentation=True, profile_every=0) -> Flask:
+    """
+    Creates the flask app of the search service
+
+    Args:
+    - service: the service that answers the searches, it's loaded if None
+    - instrumentation: if True the stages of the queries are timed and exposed in /metrics
+    - profile_every: if it's positive one of every profile_every searches is profiled and logged
+
+    Returns:
+    - Flask: the app
+    """
+    service = service or SearchService.load()
+    app = Flask(__name__)
+    metrics.enabled = instrumentation
+    if profile_every > 0:
+        metrics.set_profiler(profile_every, lambda profile: app.logger.info(profile_summary(profile)))
+
+    @app.route('/search')
+    def search():
+        query = request.args.get('q', '')
+        model_name = request.args.get('model', service.default_model)
+        k = request.args.get('k', 10, type=int)
+        offset = request.args.get('offset', 0, type=int)
+        if model_name not in service.models:
+            return error(f'unknown model {model_name}, the models are {", ".join(service.models)}')
+        if not 0 < k <= service.max_k:
+            return error(k_error())
+        if offset < 0:
+            return error('offset must not be negative')
+        with metrics.trace() as spans:
+            try:
+                result = service.search(query, model_name, k, offset)
+            except InvalidQueryException:
+                metrics.increment('invalid_queries')
+                return error('invalid query')
+            response = result.to_dict()
+        if request.args.get('trace', 0, type=int) == 1:
+            response['trace'] = [{'stage': stage, 'seconds': seconds} for stage, seconds in spans]
+        return jsonify(model=model_name, k=k, **response)
+
+    @app.route('/cache')
+    def cache_stats():
+        return jsonify(service.result_cache.stats())
+
+    @app.route('/metrics')
+    def prometheus_metrics():
+        gauges = {f'result_cache_{name}': value for name, value in service.result_cache.stats().items()}
+        gauges.update({f'term_weight_cache_{name}': value
+                       for name, value in service.corpus.term_weights.stats().items()})
+        gauges['live_documents'] = int(service.corpus.live_docs.size)
+        gauges['index_version'] = service.corpus.index_version
+        return Response(metrics.render_prometheus(gauges), mimetype='text/plain; version=0.0.4')
+
+    @app.route('/search/<query>')
+    def get_results(query):
+        # the titles of the best k documents of the default model
+        k = request.args.get('k', 10, type=int)
+        if not 0 < k <= service.max_k:
+            return error(k_error())
+        try:
+            result = service.search(query, k=k)
+        except InvalidQueryException:
+            metrics.increment('invalid_queries')
+            return error('invalid query')
+        return jsonify(results=[doc.doc_title for doc in result.documents])
+
+    def k_error() -> str:
+        return f'k must be between 1 and {service.max_k}'
+
+    return app
+
+
+def error(message: str, status=400):
+    return jsonify(error=message), status
+
+
+def profile_summary(profile, limit=20) -> str:
+    """Formats the functions with the most cumulative time of a profile"""
+    stream = io.StringIO()
+    pstats.Stats(profile, stream=stream).sort_stats('cumulative').print_stats(limit)
+    return stream.getvalue()
 
-@app.route('/search/<query>')
-def get_results(query):
-    return jsonify(results = [doc.doc_title for doc in get_extended_boolean_model().query(query)])
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=8080)
\ No newline at end of file
+    create_app().run(host='0.0.0.0', port=8080, threaded=True)
@@ -1,38 +1,120 @@
 """Module to handle clustering of the corpus for better performance"""
 import pickle
+import threading
+import weakref
+from typing import Iterable
 
 import numpy as np
 import pandas as pd
-from sklearn.cluster import KMeans
+from scipy.sparse import csr_matrix, load_npz, save_npz, vstack
+from sklearn.cluster import KMeans, MiniBatchKMeans
+from sklearn.decomposition import TruncatedSVD
+from threadpoolctl import threadpool_limits
 from yellowbrick.cluster import KElbowVisualizer
 
-from utils import tf, idf
+# the clusterer of every corpus, shared by its models
+_shared_clusterers = weakref.WeakKeyDictionary()
+_shared_lock = threading.Lock()
 
 
 class ClusterManager:
-    def __init__(self, corpus: "Corpus"):
+    """
+    Clusters the documents of the corpus with k-means. The documents are the rows of the sparse tf-idf matrix
+    of the corpus, optionally reduced with a truncated SVD, and the big corpora are clustered with mini-batch
+    k-means, so the memory used is bounded by the non zero weights instead of the size of the vocabulary.
+
+    Attributes:
+    - X: the sparse tf-idf matrix of the documents, a row for every document ordinal
+    - svd: the TruncatedSVD that reduces the vectors before clustering them, None if they aren't reduced
+    - cluster_map: DataFrame with the cluster of every document ordinal
+    - cluster_docs: the ordinals of the documents grouped by cluster, the documents of the cluster c are
+    cluster_docs[cluster_offsets[c]:cluster_offsets[c + 1]], in the order of the cluster map
+    - cluster_offsets: the start of every cluster in cluster_docs
+    - centroid_norms: the norm of the centroid of every cluster
+    - index_version: the version of the corpus index the clusters were updated for
+    """
+
+    def __init__(self, corpus: "Corpus", n_components: int = None, minibatch_size=10000, batch_size=1024,
+                 n_threads: int = None):
+        """
+        Args:
+        - corpus: the corpus with the documents
+        - n_components: if given the vectors are reduced to n_components dimensions with a truncated SVD
+        - minibatch_size: the number of documents from which mini-batch k-means is used instead of k-means
+        - batch_size: the number of documents of every batch of mini-batch k-means
+        - n_threads: the number of threads used to fit, all the cores if None
+        """
         self.corpus = corpus
         self.name = corpus.corpus_type
+        self.n_components = n_components
+        self.minibatch_size = minibatch_size
+        self.batch_size = batch_size
+        self.n_threads = n_threads
+        self.index_version = -1
+        self._unsaved_changes = 0
+        self._lock = threading.RLock()
         # load is used to load a saved model, used for efficiency
         try:
             self.load_model()
-        except FileNotFoundError or FileExistsError:
+        except (FileNotFoundError, ValueError):
             self.X = self.create_doc_vectors()
+            self.svd = None
             self.cluster_map = pd.DataFrame()
             self.model = KMeans()
+            self._build_cluster_lists()
+
+    @classmethod
+    def shared(cls, corpus: "Corpus", k=4) -> "ClusterManager":
+        """
+        Gets the clusterer of a corpus, all the models of the corpus share it so they see the same clusters.
+        It is loaded, or fitted with k clusters if it wasn't saved, the first time.
+
+        Args:
+        - corpus: the corpus with the documents
+        - k: the number of clusters if it must be fitted
+
+        Returns:
+        - ClusterManager: the clusterer of the corpus
+        """
+        with _shared_lock:
+            clusterer = _shared_clusterers.get(corpus)
+            if clusterer is None:
+                clusterer = _shared_clusterers[corpus] = cls(corpus)
+                if not clusterer.is_fitted:
+                    clusterer.fit_cluster(k, load=False)
+        return clusterer
 
-    def create_doc_vectors(self):
+    @property
+    def is_fitted(self) -> bool:
+        return 'cluster' in self.cluster_map
+
+    def create_doc_vectors(self) -> csr_matrix:
         """
-        Creates the training examples of the clusterer creating vectors
-        of the documents in the set.
+        Creates the training examples of the clusterer, the tf-idf vectors of the documents of the corpus.
 
         Returns:
-        - np.array: the examples that will be used to train the model
+        - scipy.sparse.csr_matrix: the examples that will be used to train the model, a row for every document
+        """
+        return self.corpus.get_tfidf_matrix('csr').copy()
+
+    def get_doc_vectors(self, doc_ids: Iterable[int]) -> csr_matrix:
         """
-        examples = []
-        for doc_id in range(self.corpus.index.num_docs):
-            examples.append(self.get_doc_vector(doc_id))
-        return np.array(examples)
+        Gets the tf-idf vectors of some documents
+
+        Args:
+        - doc_ids: the ordinals of the documents
+
+        Returns:
+        - scipy.sparse.csr_matrix: the vectors of the documents, a row for every one
+        """
+        stats = self.corpus.stats
+        bows = [(doc_id, self.corpus.doc2bow(doc_id)) for doc_id in doc_ids]
+        indptr = np.cumsum([0] + [len(bow) for _, bow in bows])
+        term_ids = np.fromiter((ti for _, bow in bows for ti in bow.keys()), dtype=np.int64, count=indptr[-1])
+        freqs = np.fromiter((freq for _, bow in bows for freq in bow.values()), dtype=np.float64, count=indptr[-1])
+        max_tf = np.repeat(stats.max_tf[[doc_id for doc_id, _ in bows]], np.diff(indptr))
+        weights = freqs / max_tf * stats.idf[term_ids]
+        return csr_matrix((weights, term_ids, indptr), shape=(len(bows), len(self.corpus.index)))
 
     def get_doc_vector(self, doc_id: int):
         """Gets the vector of a single document
@@ -43,21 +125,29 @@ class ClusterManager:
         Returns:
         - np.array: the vector of the document
         """
-        bow = self.corpus.doc2bow(doc_id)
-        tf_idf_vectors = np.zeros(len(self.corpus.index))
-        for term_id, freq in bow.items():
-            tf_idf_vectors[term_id] = tf(self.corpus, term_id, doc_id) * idf(self.corpus, term_id)
-        return tf_idf_vectors
+        return self.get_doc_vectors([doc_id]).toarray()[0]
 
-    def elbow_method(self) -> int:
+    def elbow_method(self, sample_size=2000, random_state=42) -> int:
         """
         Gets the optimus k by the elbow method
 
+        Args:
+        - sample_size: the number of documents clustered if the vectors aren't reduced with the svd
+        - random_state: the seed of the sample
+
         Returns:
         - int: the optimal k
         """
         visualizer = KElbowVisualizer(self.model, k=(4, 20), metric='calinski_harabasz')
-        visualizer.fit(self.X)
+        # the calinski-harabasz score needs dense vectors, the reduced ones are small and the rest are sampled
+        if self.svd is not None:
+            features = self._model_features(self.X)
+        else:
+            rows = np.arange(self.X.shape[0])
+            if len(rows) > sample_size:
+                rows = np.sort(np.random.default_rng(random_state).choice(rows, sample_size, replace=False))
+            features = self.X[rows].toarray()
+        visualizer.fit(features)
         visualizer.show()
         return visualizer.elbow_value_
 
@@ -71,36 +161,200 @@ class ClusterManager:
         - load: if the model should be loaded
         """
         if not load:
-            self.fit_cluster(k)
+            self._fit_cluster(k)
             return
         try:
             self.load_model()
-        except FileNotFoundError or FileExistsError:
+        except (FileNotFoundError, ValueError):
             self._fit_cluster(k)
 
     def _fit_cluster(self, k: int):
-        self.model = KMeans(n_clusters=k)
-        km = self.model.fit(self.X)
-        self.cluster_map['doc_id'] = list(range(self.X.shape[0]))
+        index_version = self.corpus.index_version
+        self.X = self.create_doc_vectors()
+        # the deleted documents are empty rows that are kept so the rows are the ordinals
+        live_docs = np.flatnonzero(~self.corpus.deleted[:self.X.shape[0]])
+        with threadpool_limits(limits=self.n_threads):
+            self.svd = None
+            if self.n_components is not None:
+                self.svd = TruncatedSVD(n_components=min(self.n_components, min(self.X.shape) - 1)).fit(self.X)
+            if self.X.shape[0] >= self.minibatch_size:
+                self.model = MiniBatchKMeans(n_clusters=k, batch_size=self.batch_size, n_init=3)
+            else:
+                self.model = KMeans(n_clusters=k)
+            X = self.X[live_docs]
+            km = self.model.fit(self.svd.transform(X) if self.svd is not None else X)
+        self.cluster_map = pd.DataFrame()
+        self.cluster_map['doc_id'] = live_docs
         self.cluster_map['cluster'] = km.labels_
+        self._build_cluster_lists()
+        self.index_version = index_version
         self.save_model()
 
+    def sync(self):
+        """
+        Updates the clusters with the changes of the corpus since the last time. The new documents are assigned
+        to the existing clusters and the deleted ones are removed. The lookups call it, so the clusters follow
+        the changes made through any model or directly through the corpus. The model is saved once
+        corpus.flush_size documents changed, a model saved before is brought up to date when it's loaded.
+        """
+        if self.index_version == self.corpus.index_version or not self.is_fitted:
+            return
+        with self._lock:
+            index_version = self.corpus.index_version
+            if self.index_version == index_version:
+                return
+            deleted = self.corpus.deleted
+            clustered = self.cluster_map.doc_id.to_numpy(dtype=np.int64)
+            removed = clustered[deleted[clustered]]
+            missing = np.setdiff1d(np.flatnonzero(~deleted), clustered)
+            if len(removed) > 0:
+                self.remove_documents(removed)
+            if len(missing) > 0:
+                self.add_documents(missing)
+            self.index_version = index_version
+            if self._unsaved_changes >= self.corpus.flush_size:
+                self.save_model()
+
+    def _build_cluster_lists(self):
+        """Builds the inverted lists from the clusters to the documents, with the order of the cluster map"""
+        if 'cluster' in self.cluster_map:
+            clusters = self.cluster_map.cluster.to_numpy(dtype=np.int64)
+            doc_ids = self.cluster_map.doc_id.to_numpy(dtype=np.int64)
+        else:
+            clusters = doc_ids = np.zeros(0, dtype=np.int64)
+        centers = getattr(self.model, 'cluster_centers_', None)
+        num_clusters = len(centers) if centers is not None else int(clusters.max(initial=-1)) + 1
+        self.cluster_docs = doc_ids[np.argsort(clusters, kind='stable')]
+        self.cluster_offsets = np.zeros(num_clusters + 1, dtype=np.int64)
+        np.cumsum(np.bincount(clusters, minlength=num_clusters), out=self.cluster_offsets[1:])
+        self.centroid_norms = np.linalg.norm(centers, axis=1) if centers is not None else np.zeros(0)
+
+    def get_cluster_docs(self, clusters: Iterable[int]) -> np.ndarray:
+        """
+        Gets the documents of some clusters from the inverted lists, in time proportional to their size
+
+        Args:
+        - clusters: the clusters
+
+        Returns:
+        - np.array: the sorted ordinals of the documents
+        """
+        self.sync()
+        lists = [self.cluster_docs[self.cluster_offsets[c]:self.cluster_offsets[c + 1]] for c in clusters]
+        return np.sort(np.concatenate(lists + [np.zeros(0, dtype=np.int64)]))
+
+    def nearest_clusters(self, term_ids: np.ndarray, weights: np.ndarray, nprobe: int) -> np.ndarray:
+        """
+        Gets the clusters whose centroids have the highest cosine similarity with a query
+
+        Args:
+        - term_ids: the ids of the tokens of the query
+        - weights: the weights of the tokens in the query
+        - nprobe: the number of clusters
+
+        Returns:
+        - np.array: the clusters
+        """
+        self.sync()
+        centers = self.model.cluster_centers_
+        known = term_ids < self._num_features()
+        query = csr_matrix((weights[known], term_ids[known], [0, np.count_nonzero(known)]),
+                           shape=(1, self._num_features()))
+        dots = np.asarray(self._model_features(query) @ centers.T).ravel()
+        scores = np.divide(dots, self.centroid_norms, out=np.zeros(len(centers)), where=self.centroid_norms > 0)
+        nprobe = min(nprobe, len(centers))
+        return np.argpartition(scores, -nprobe)[-nprobe:]
+
     def predict_cluster(self, doc_id):
         """Predicts the cluster of a given doc_id"""
-        doc_vec = self.get_doc_vector(doc_id)
-        return self.model.predict(np.array([doc_vec]))[0]
+        return self.model.predict(self._model_features(self.get_doc_vectors([doc_id])))[0]
+
+    def _num_features(self) -> int:
+        return self.svd.n_features_in_ if self.svd is not None else self.model.n_features_in_
+
+    def _model_features(self, vectors: csr_matrix):
+        # the tokens added to the corpus after the training have the last ids, k-means ignores them
+        vectors = vectors[:, :self._num_features()]
+        return self.svd.transform(vectors) if self.svd is not None else vectors
+
+    def add_documents(self, doc_ids: Iterable[int]):
+        """
+        Assigns documents to the existing clusters with the trained k-means, without training it again.
+        The documents after the last row of X are added to it. The change is saved with save_model.
+
+        Args:
+        - doc_ids: the ordinals of the documents in the corpus, that aren't in the clusters
+        """
+        doc_ids = np.asarray(list(doc_ids), dtype=np.int64)
+        if len(doc_ids) == 0:
+            return
+        with self._lock:
+            num_rows = self.X.shape[0]
+            if doc_ids.max() >= num_rows:
+                vectors = self.get_doc_vectors(range(num_rows, int(doc_ids.max()) + 1))
+                # the training examples keep the tokens they were created with
+                self.X = vstack([self.X, vectors[:, :self.X.shape[1]]], format='csr')
+            clusters = self.model.predict(self._model_features(self.X[doc_ids]))
+            new_rows = pd.DataFrame({'doc_id': doc_ids, 'cluster': clusters})
+            self.cluster_map = pd.concat([self.cluster_map, new_rows], ignore_index=True)
+            self._build_cluster_lists()
+            self._unsaved_changes += len(doc_ids)
+
+    def remove_documents(self, doc_ids: Iterable[int]):
+        """
+        Removes deleted documents from the clusters. The change is saved with save_model.
+
+        Args:
+        - doc_ids: the ordinals of the deleted documents in the corpus
+        """
+        with self._lock:
+            removed = self.cluster_map.doc_id.isin(list(doc_ids))
+            self.cluster_map = self.cluster_map[~removed].reset_index(drop=True)
+            self._build_cluster_lists()
+            self._unsaved_changes += int(removed.sum())
 
     def get_cluster_samples(self, doc_id):
         """Gets of the samples that are in the same cluster as `doc_id`"""
+        self.sync()
         cluster = self.predict_cluster(doc_id)
-        return self.cluster_map[self.cluster_map.cluster == cluster].doc_id.array
+        return self.cluster_docs[self.cluster_offsets[cluster]:self.cluster_offsets[cluster + 1]]
 
     def save_model(self):
-        """Saves kmeans model and cluster map"""
-        pickle.dump(self.model, open(f'../../data/cluster/{self.name}_kmeans.pkl', 'wb'))
-        pickle.dump(self.cluster_map, open(f'../../data/cluster/{self.name}_cluster_map.pkl', 'wb'))
+        """Saves kmeans model, the svd, the cluster map and the document vectors"""
+        with self._lock:
+            pickle.dump(self.model, open(f'../../data/cluster/{self.name}_kmeans.pkl', 'wb'))
+            pickle.dump(self.svd, open(f'../../data/cluster/{self.name}_svd.pkl', 'wb'))
+            pickle.dump(self.cluster_map, open(f'../../data/cluster/{self.name}_cluster_map.pkl', 'wb'))
+            save_npz(f'../../data/cluster/{self.name}_doc_vectors.npz', self.X, compressed=False)
+            np.save(f'../../data/cluster/{self.name}_doc_ids.npy', self.corpus.doc_ids[:self.X.shape[0]])
+            self._unsaved_changes = 0
 
     def load_model(self):
-        """Loads kmeans model and cluster map"""
+        """
+        Loads kmeans model, the svd, the cluster map and the document vectors. The documents that changed in
+        the corpus after they were saved are updated by sync.
+
+        Raises:
+        - FileNotFoundError: if the model wasn't saved
+        - ValueError: if the model was saved for other documents
+        """
         self.model = pickle.load(open(f'../../data/cluster/{self.name}_kmeans.pkl', 'rb'))
         self.cluster_map = pickle.load(open(f'../../data/cluster/{self.name}_cluster_map.pkl', 'rb'))
+        # the models saved by older versions don't have the svd or the document vectors
+        try:
+            self.svd = pickle.load(open(f'../../data/cluster/{self.name}_svd.pkl', 'rb'))
+        except FileNotFoundError:
+            self.svd = None
+        try:
+            self.X = load_npz(f'../../data/cluster/{self.name}_doc_vectors.npz').tocsr()
+        except FileNotFoundError:
+            self.X = self.create_doc_vectors()
+        doc_ids = np.load(f'../../data/cluster/{self.name}_doc_ids.npy')
+        num_docs = min(len(doc_ids), len(self.corpus.doc_ids), self.X.shape[0])
+        if not np.array_equal(doc_ids[:num_docs], self.corpus.doc_ids[:num_docs]):
+            raise ValueError('The clusters were saved for other documents')
+        # the clusters can have documents added after the corpus was saved for the last time
+        self.X = self.X[:num_docs]
+        self.cluster_map = self.cluster_map[self.cluster_map.doc_id < num_docs].reset_index(drop=True)
+        self.index_version = -1
+        self._build_cluster_lists()
@@ -1,4 +1,9 @@
 from .corpus import Corpus
-from .document import Document
+from .document import Document, DocumentStore
+from .ingestion import RawDocument
+from .postings import ForwardIndex, PostingsIndex
+from .segments import MergePolicy, Segment
+from .statistics import CorpusStatistics
+from .term_weights import TermWeightCache, TermWeights
 from .cran_corpus import CranCorpus
 from .test_corpus import TestCorpus
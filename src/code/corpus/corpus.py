@@ -1,70 +1,145 @@
 """Corpus module to implement reading and processing of the documents."""
-import math
 import pickle
+import threading
 from abc import ABC, abstractmethod
+from collections import Counter
 from pathlib import Path
-from typing import List, Dict, Tuple
+from typing import List, Dict, Tuple, Iterable
 
-import nltk
+import numpy as np
 from gensim.corpora import Dictionary
+from scipy.sparse import csc_matrix, vstack
 
-from src.code.utils import remove_punctuation, to_lower, tokenize
+from src.code.instrumentation import metrics
 from .document import Document
+from .index_format import IndexFormatError, StringArray, read_index, write_index
+from .ingestion import TextPreprocessor, RawDocument, ingest_documents, read_raw_document
+from .segments import LiveSegment, MergePolicy, Segment, SegmentedDocuments, SegmentedPostings
+from .statistics import CorpusStatistics
+from .term_weights import TermWeightCache, TermWeights
 
 
-# TODO save tf and idf in data for improve efficiency
+class IndexSnapshot:
+    """
+    A version of the inverted index with the statistics computed from it. The corpus replaces its snapshot
+    with a single assignment, so the readers that take it once never mix the postings of a version with the
+    statistics of another one.
+
+    Attributes:
+    - postings: SegmentedPostings, the inverted index of the documents
+    - stats: CorpusStatistics of the postings
+    - tfidf_matrices: the tf-idf matrices materialized for the statistics by layout
+    """
+    __slots__ = ('postings', 'stats', 'tfidf_matrices')
+
+    def __init__(self, postings: SegmentedPostings, stats: CorpusStatistics, tfidf_matrices: dict = None):
+        self.postings = postings
+        self.stats = stats
+        self.tfidf_matrices = tfidf_matrices if tfidf_matrices is not None else {}
+
 
 class Corpus(ABC):
     """Class to represent a corpus of documents.
 
+    The indexed corpus is made of segments of consecutive documents, the saved segments are immutable and
+    the new documents are added to a live segment in memory. The queries go through all the segments.
+
     Attributes:
     - corpus_type: string
      Represents the type of the corpus ie. 'cran' or 'test'
     - language: string
-    - documents: list of Document objects
+    - documents: sequence of Document objects, a SegmentedDocuments once the corpus is indexed
+    - doc_ids: np.array with the id of every document, in the same order as documents
     - stopwords: set of string
     - index: gensim.corpora.Dictionary
     It is a mapping from words to their ids and the frequency of the words in the corpus
+    - vocabulary: list with the token of every token id
     - stemmer: nltk.stem.SnowballStemmer
-    - vectors: list of dictionaries that represents the bag of words of the documents
+    - segments: list of the saved segments, in the order of their documents
+    - live_segment: LiveSegment with the documents added after the last flush, or None
+    - snapshot: IndexSnapshot with the current postings and stats, replaced together when they change
+    - postings: SegmentedPostings
+    It is the inverted index of the documents, for each token the documents that contain it
+    - stats: CorpusStatistics
+    The idf of the tokens and the max frequency and norm of the documents, computed at index time
+    - deleted: np.array of bool, True for the ordinals of the deleted documents. They are tombstones,
+    the deleted documents keep their ordinal but they are removed from the inverted index and the mapping
+    - live_docs: np.array with the sorted ordinals of the documents that aren't deleted
+    - index_version: the number of times the documents of the indexed corpus have changed
+    - merge_policy: MergePolicy that chooses the segments merged in the background
+    - flush_size: the number of documents added, updated or deleted without saving that makes the corpus to be
+    saved, the changes are buffered in memory until then
+    - term_weights: TermWeightCache with the tf-idf weights of the most popular tokens of the queries
     """
 
-    def __init__(self, corpus_path: Path, stemming=False, corpus_type="", language="english"):
+    def __init__(self, corpus_path: Path, stemming=False, corpus_type="", language="english", workers: int = None,
+                 merge_policy: MergePolicy = None, flush_size=1000):
         self.corpus_type = corpus_type
         self.language = language
-        self.documents: List[Document] = []
-        self.stopwords = set(nltk.corpus.stopwords.words(self.language))
+        self.workers = workers
+        self.documents = []
+        self.preprocessor = TextPreprocessor(self.language, stemming)
+        self.stopwords = self.preprocessor.stopwords
         self.index: Dictionary = None
-        self.stemmer = nltk.SnowballStemmer(self.language) if stemming else None
+        self.stemmer = self.preprocessor.stemmer
+        self.merge_policy = merge_policy or MergePolicy()
+        self.flush_size = flush_size
+        self.mapping: Dict[int, int] = {}
+        self.index_version = 0
+        self.term_weights = TermWeightCache()
+        self.snapshot = IndexSnapshot(None, None)
+        self._lock = threading.RLock()
+        self._merge_thread: threading.Thread = None
+        self._obsolete_segments: List[str] = []
+        self._unsaved_changes = 0
         try:
             self.load_indexed_corpus()
-        except FileNotFoundError or FileExistsError:
+        except (FileNotFoundError, IndexFormatError):
             self.parse_documents(corpus_path)
             self.create_indexed_corpus()
-            self.vectors = self.docs2bows()
             self.save_indexed_corpus()
-        self.mapping = {doc.doc_id: i for i, doc in enumerate(self.documents)}
-        self.max_idf = self._get_max_idf()
 
-    @abstractmethod
     def parse_documents(self, path: Path):
-        """Parses the documents from the path and adds them to the documents list."""
+        """
+        Parses the documents from the path and adds them to the documents list. The sources are parsed
+        and preprocessed by a pool of `workers` processes, keeping the order given by iter_sources.
+        """
+        stemming = self.stemmer is not None
+        documents = ingest_documents(self.iter_sources(path), type(self).parse_source,
+                                     language=self.language, stemming=stemming, workers=self.workers)
+        self.documents.extend(documents)
+
+    @abstractmethod
+    def iter_sources(self, path: Path) -> Iterable:
+        """Gets the sources of the documents in the path (usually their files), always in the same order."""
+        raise NotImplementedError()
+
+    @staticmethod
+    @abstractmethod
+    def parse_source(source) -> Iterable[RawDocument]:
+        """Gets the raw documents (doc_id, title, text) of a source, it runs in the worker processes."""
         raise NotImplementedError()
 
     def preprocess_text(self, text: str) -> List[str]:
         """Cleans and tokenizes the text. It also removes the stopwords and stems the tokens if needed."""
-        text = remove_punctuation(text)
-        text = to_lower(text)
-        tokens = tokenize(text)
-        tokens = self.remove_stopwords(tokens)
-        if self.stemmer is not None:
-            tokens = self.stemming(tokens)
-        return tokens
+        return self.preprocessor(text)
 
     def stemming(self, tokens: List[str]) -> List[str]:
         """Stems the tokens"""
         return [self.stemmer.stem(tok) for tok in tokens]
 
+    @property
+    def postings(self) -> SegmentedPostings:
+        return self.snapshot.postings
+
+    @property
+    def stats(self) -> CorpusStatistics:
+        return self.snapshot.stats
+
+    @property
+    def max_idf(self) -> float:
+        return self.snapshot.stats.max_idf
+
     def _get_indexed_corpus_path(self):
         stemmed = '' if self.stemmer is None else '_stemmed'
         return Path(f'../../data/indexed_corpus/{self.corpus_type}{stemmed}/')
@@ -72,34 +147,398 @@ class Corpus(ABC):
     def load_indexed_corpus(self):
         """Loads the indexed corpus from the data folder.
 
-        The indexed corpus is loaded from the folder data/indexed_corpus/corpus_type/ as:
-        - index.idx: the index of the words
-        - docs.pkl: the documents
-        - docs_vect.pkl: the vectors of the documents
+        The file data/indexed_corpus/corpus_type/commit.bin has the names of the saved segments, the tombstones
+        and the statistics of the corpus. Every segment is in its own file and all of them are memory mapped,
+        so the arrays of the index are read from the files when they are used and shared with the other
+        processes that open them. The corpora saved by older versions are imported. The statistics are
+        computed again if they were saved by an older version.
+        """
+        indexed_corpus_path = self._get_indexed_corpus_path()
+        try:
+            sections, meta = read_index(indexed_corpus_path / 'commit.bin')
+        except FileNotFoundError:
+            self.import_indexed_corpus()
+            sections, meta = read_index(indexed_corpus_path / 'commit.bin')
+
+        segment_files = [Segment.read(indexed_corpus_path, name) for name in meta['segments']]
+        self.vocabulary = []
+        self.segments = []
+        base = 0
+        for name, (segment_sections, segment_meta) in zip(meta['segments'], segment_files):
+            segment = Segment.from_sections(name, base, segment_sections, segment_meta, self.vocabulary)
+            if segment.vocab_start != len(self.vocabulary):
+                raise IndexFormatError(f'The tokens of the segment {name} are not after the previous ones')
+            self.vocabulary.extend(segment.vocabulary)
+            self.segments.append(segment)
+            base += segment.num_docs
+        self.live_segment = None
+        self.doc_ids = np.concatenate([segment.documents.doc_ids for segment in self.segments]) \
+            if len(self.segments) > 0 else np.zeros(0, dtype=np.int64)
+        self.next_segment = meta['next_segment']
+        self.index_version = meta['index_version']
+        self.deleted = sections['deleted']
+        self._refresh_segments()
+        self.index = self._create_dictionary()
+        self.mapping = dict(zip(self.doc_ids[self.live_docs].tolist(), self.live_docs.tolist()))
+        stats = CorpusStatistics(len(self.doc_ids), sections['idf'], sections['max_tf'], sections['doc_norms'],
+                                 sections['max_weights'])
+        if meta['stats_version'] != CorpusStatistics.VERSION:
+            stats = self.create_statistics()
+            self._write_commit(stats)
+        self._doc_freqs = self.postings.doc_freqs()
+        self._max_tf = stats.max_tf
+        self._set_statistics(stats)
+
+    def import_indexed_corpus(self):
+        """
+        Imports a corpus indexed by an older version and saves it with segments. The corpus can be saved in the
+        folder data/indexed_corpus/corpus_type/ as:
+        - index.bin: a single memory mapped file with the whole index, it becomes the first segment
+        - index.idx, docs.pkl and docs_vect.pkl: the pickled index, documents and vectors, the documents
+        are indexed again
+
+        Raises:
+        - FileNotFoundError: if the corpus wasn't indexed
         """
         indexed_corpus_path = self._get_indexed_corpus_path()
-        self.index = Dictionary.load(f'{indexed_corpus_path}/index.idx')
-        self.vectors = pickle.load(open(indexed_corpus_path / 'docs_vect.pkl', 'rb'))
-        self.documents = pickle.load(open(indexed_corpus_path / 'docs.pkl', 'rb'))
+        if (indexed_corpus_path / 'index.bin').exists():
+            sections, meta = read_index(indexed_corpus_path / 'index.bin')
+            self.vocabulary = list(StringArray(sections['vocab_offsets'], sections['vocab']))
+            self.segments = [Segment.from_sections('index', 0, sections, meta, self.vocabulary)]
+            self.live_segment = None
+            self.next_segment = 0
+            self.index_version = meta.get('index_version', 0)
+            self.deleted = sections.get('deleted', np.zeros(len(sections['doc_ids']), dtype=bool))
+            self._refresh_segments()
+            self._write_commit(self.create_statistics())
+            return
+
+        # the vectors are computed again from the documents, so only the documents are read
+        with open(indexed_corpus_path / 'docs.pkl', 'rb') as file:
+            self.documents = pickle.load(file)
+        self.create_indexed_corpus()
+        self.save_indexed_corpus()
 
     def create_indexed_corpus(self):
-        """Creates the indexed corpus."""
-        docs = [d.doc_tokens for d in self.documents]
-        self.index = Dictionary(docs)
+        """Creates the indexed corpus, the parsed documents are added to the live segment."""
+        documents = list(self.documents)
+        self.index = Dictionary()
+        self.vocabulary = []
+        self.segments = []
+        self.live_segment = None
+        self.next_segment = 0
+        self.doc_ids = np.zeros(0, dtype=np.int64)
+        self.deleted = np.zeros(0, dtype=bool)
+        self.mapping = {}
+        self._doc_freqs = np.zeros(0, dtype=np.int64)
+        self._max_tf = np.zeros(0, dtype=np.int32)
+        self._append_documents(documents)
+        self._refresh_segments(update_statistics=True)
+
+    def create_statistics(self) -> CorpusStatistics:
+        """Computes the statistics of the corpus from the inverted indexes of the segments."""
+        return CorpusStatistics.from_segments(self.postings.parts(), len(self.deleted), len(self.vocabulary),
+                                              self.deleted)
 
     def save_indexed_corpus(self):
-        """Saves the indexed corpus in the data folder.
+        """Saves the indexed corpus in the folder data/indexed_corpus/corpus_type/.
+
+        The live segment is saved as a new segment in its own file, the saved segments never change. Then the
+        file commit.bin is replaced with the names of the segments and the following sections:
+        - deleted: the tombstones of the deleted documents
+        - idf, max_tf, doc_norms, max_weights: the statistics of the corpus
+        The files of the segments that were merged are removed after that, and the merges that are
+        needed start in the background.
+        """
+        with self._lock:
+            self.flush()
+            self._write_commit(self.stats)
+            self._unsaved_changes = 0
+            self._remove_obsolete_segments()
+        self.merge_segments()
+
+    def flush(self):
+        """Saves the live segment as a new segment, it is memory mapped from its file after that"""
+        with self._lock:
+            if self.live_segment is None:
+                return
+            indexed_corpus_path = self._get_indexed_corpus_path()
+            indexed_corpus_path.mkdir(parents=True, exist_ok=True)
+            # the arrays of the live segment are built once, when it is saved
+            segment = self.live_segment.build()
+            segment.save(indexed_corpus_path)
+            sections, meta = Segment.read(indexed_corpus_path, segment.name)
+            self.segments = self.segments + [Segment.from_sections(segment.name, segment.base, sections, meta,
+                                                                   self.vocabulary)]
+            self.live_segment = None
+            self._refresh_segments()
+
+    def _write_commit(self, stats: CorpusStatistics):
+        indexed_corpus_path = self._get_indexed_corpus_path()
+        indexed_corpus_path.mkdir(parents=True, exist_ok=True)
+        sections = {
+            'deleted': self.deleted,
+            'idf': stats.idf,
+            'max_tf': stats.max_tf,
+            'doc_norms': stats.doc_norms,
+            'max_weights': stats.max_weights,
+        }
+        meta = {
+            'segments': [segment.name for segment in self.segments],
+            'next_segment': self.next_segment,
+            'stats_version': CorpusStatistics.VERSION,
+            'index_version': self.index_version,
+        }
+        write_index(indexed_corpus_path / 'commit.bin', sections, meta)
+
+    def _remove_obsolete_segments(self):
+        indexed_corpus_path = self._get_indexed_corpus_path()
+        for name in self._obsolete_segments:
+            # the processes that have the file mapped keep reading it until they close it
+            (indexed_corpus_path / f'{name}.bin').unlink(missing_ok=True)
+        self._obsolete_segments = []
 
-        The indexed corpus is saved in the folder data/indexed_corpus/corpus_type/ as:
-        - index.idx: the index of the words
-        - docs.pkl: the documents
-        - docs_vect.pkl: the vectors of the documents
+    def merge_segments(self):
         """
+        Starts merging the segments chosen by the merge policy in a background thread, if it isn't already
+        running. The queries keep using the old segments until the merged one replaces them.
+        """
+        with self._lock:
+            if self._merge_thread is not None and self._merge_thread.is_alive():
+                return
+            if self.merge_policy.find_merge(self.segments) is None:
+                return
+            self._merge_thread = threading.Thread(target=self._merge_segments, name='segment-merger', daemon=True)
+            self._merge_thread.start()
+
+    def wait_for_merges(self):
+        """Waits until the merges running in the background finish"""
+        thread = self._merge_thread
+        if thread is not None:
+            thread.join()
+
+    def _merge_segments(self):
         indexed_corpus_path = self._get_indexed_corpus_path()
-        indexed_corpus_path.mkdir(exist_ok=True)
-        self.index.save(f'{indexed_corpus_path}/index.idx')
-        pickle.dump(self.vectors, open(indexed_corpus_path / 'docs_vect.pkl', 'wb'))
-        pickle.dump(self.documents, open(indexed_corpus_path / 'docs.pkl', 'wb'))
+        while True:
+            with self._lock:
+                positions = self.merge_policy.find_merge(self.segments)
+                if positions is None:
+                    return
+                segments = self.segments[positions]
+                name = self._new_segment_name()
+                deleted = self.deleted.copy()
+
+            # the segments are immutable, so they are merged without the lock and the queries aren't blocked
+            with metrics.timer('segment_merge'):
+                merged = Segment.merge(name, segments, deleted, self.vocabulary)
+                merged.save(indexed_corpus_path)
+            sections, meta = Segment.read(indexed_corpus_path, name)
+            merged = Segment.from_sections(name, merged.base, sections, meta, self.vocabulary)
+
+            with self._lock:
+                # only this thread removes segments, so the merged ones are still in the same positions
+                self.segments = self.segments[:positions.start] + [merged] + self.segments[positions.stop:]
+                self._obsolete_segments.extend(segment.name for segment in segments)
+                self._refresh_segments()
+                # the merge is saved with the next commit if there are changes that weren't saved yet
+                if not self._unsaved_changes and self.live_segment is None:
+                    self._write_commit(self.stats)
+                    self._remove_obsolete_segments()
+
+    def _new_segment_name(self) -> str:
+        name = f'segment_{self.next_segment:06d}'
+        self.next_segment += 1
+        return name
+
+    def _refresh_segments(self, update_statistics=False):
+        """
+        Updates the views of the corpus over the segments after they change. The inverted index is replaced
+        at the end, so a query that is running meanwhile doesn't see documents without the rest of their data.
+
+        Args:
+        - update_statistics: if True the statistics are updated with the document frequencies and replaced with
+        the inverted index, otherwise the segments have the same documents as before and the statistics are kept
+        """
+        # the snapshot sees the live segment with the documents that it has now
+        segments = self.segments + ([self.live_segment.view(len(self.vocabulary))]
+                                    if self.live_segment is not None else [])
+        self.documents = SegmentedDocuments(segments)
+        self.live_docs = np.flatnonzero(~self.deleted)
+        postings = SegmentedPostings(segments, len(self.vocabulary), self.deleted)
+        if update_statistics:
+            stats = CorpusStatistics.from_frequencies(postings, self._doc_freqs, self._max_tf, len(self.live_docs))
+            self.snapshot = IndexSnapshot(postings, stats)
+        else:
+            self.snapshot = IndexSnapshot(postings, self.snapshot.stats, self.snapshot.tfidf_matrices)
+
+    def _set_statistics(self, stats: CorpusStatistics):
+        self.snapshot = IndexSnapshot(self.snapshot.postings, stats)
+
+    def _create_dictionary(self) -> Dictionary:
+        """Creates the gensim dictionary of the tokens from the vocabulary and the inverted index"""
+        index = Dictionary()
+        index.token2id = {token: ti for ti, token in enumerate(self.vocabulary)}
+        index.id2token = dict(enumerate(self.vocabulary))
+        index.dfs = dict(enumerate(self.postings.doc_freqs().tolist()))
+        cfs = self.postings.collection_freqs()
+        index.cfs = dict(enumerate(cfs.tolist()))
+        index.num_docs = len(self.live_docs)
+        index.num_pos = int(cfs.sum())
+        index.num_nnz = self.postings.num_postings()
+        return index
+
+    def add_documents(self, documents: Iterable[RawDocument], save=False) -> np.ndarray:
+        """
+        Adds new documents to the indexed corpus without indexing it again. Only the new documents are parsed,
+        their tokens are added to the dictionary and they are indexed in the live segment.
+
+        Args:
+        - documents: the raw documents (doc_id, title, text), the documents without id get the next free ids
+        - save: if True the corpus is saved, otherwise the new documents are only in memory until flush_size
+        documents change or the corpus is saved
+
+        Returns:
+        - np.array: the ordinals of the new documents
+
+        Raises:
+        - ValueError: if a document is already in the corpus, update_document must be used instead
+        """
+        with metrics.timer('ingestion'):
+            new_documents = self._preprocess_documents(documents)
+        with self._lock:
+            doc_ids = [doc.doc_id for doc in new_documents]
+            repeated = [doc_id for doc_id in doc_ids if doc_id in self.mapping] + \
+                       [doc_id for doc_id, count in Counter(doc_ids).items() if count > 1]
+            if len(repeated) > 0:
+                raise ValueError(f'The documents {repeated} are already in the corpus')
+            ordinals = self._append_documents(new_documents)
+            self._update_indexed_corpus(len(ordinals), save)
+        return ordinals
+
+    def update_document(self, document: RawDocument, save=False) -> int:
+        """
+        Replaces a document of the indexed corpus. The old version is deleted and the new one is added
+        to the live segment with a new ordinal.
+
+        Args:
+        - document: the raw document (doc_id, title, text), with the id of the document to replace
+        - save: if True the corpus is saved, otherwise the change is only in memory until flush_size
+        documents change or the corpus is saved
+
+        Returns:
+        - int: the ordinal of the new version of the document
+
+        Raises:
+        - KeyError: if the document isn't in the corpus
+        """
+        if document[0] not in self.mapping:
+            raise KeyError(f'The document {document[0]} is not in the corpus')
+        with metrics.timer('ingestion'):
+            new_documents = self._preprocess_documents([document])
+        with self._lock:
+            self._delete_documents([document[0]])
+            ordinal = int(self._append_documents(new_documents)[0])
+            self._update_indexed_corpus(1, save)
+        return ordinal
+
+    def delete_documents(self, doc_ids: Iterable[int], save=False) -> np.ndarray:
+        """
+        Deletes documents from the indexed corpus. The documents are marked as deleted and the queries skip
+        their postings, but they keep their ordinal. They are dropped from the segments when they are merged.
+
+        Args:
+        - doc_ids: the ids of the documents
+        - save: if True the corpus is saved, otherwise the change is only in memory until flush_size
+        documents change or the corpus is saved
+
+        Returns:
+        - np.array: the ordinals of the deleted documents
+
+        Raises:
+        - KeyError: if a document isn't in the corpus
+        """
+        with self._lock:
+            ordinals = self._delete_documents(doc_ids)
+            self._update_indexed_corpus(len(ordinals), save)
+        return ordinals
+
+    def _preprocess_documents(self, documents: Iterable[RawDocument]) -> List[Document]:
+        documents = list(documents)
+        stemming = self.stemmer is not None
+        # the process pool is only worth it for big batches
+        workers = self.workers if len(documents) > 32 else 1
+        new_documents = list(ingest_documents(documents, read_raw_document, language=self.language,
+                                              stemming=stemming, workers=workers))
+        next_id = max([int(self.doc_ids.max()) if len(self.doc_ids) > 0 else 0] +
+                      [doc.doc_id for doc in new_documents if doc.doc_id is not None]) + 1
+        for doc in new_documents:
+            if doc.doc_id is None:
+                doc.doc_id = next_id
+                next_id += 1
+        return new_documents
+
+    def _append_documents(self, documents: List[Document]) -> np.ndarray:
+        first = len(self.deleted)
+        if self.live_segment is None:
+            self.live_segment = LiveSegment(self._new_segment_name(), first, len(self.vocabulary),
+                                            self.index.token2id, self.vocabulary)
+        new_tokens = {token for doc in documents for token in doc.doc_tokens if token not in self.index.token2id}
+        self.index.add_documents([doc.doc_tokens for doc in documents], prune_at=None)
+        self.vocabulary.extend(sorted(new_tokens, key=self.index.token2id.get))
+        bows = self.live_segment.add(documents)
+
+        # only the frequencies of the tokens of the new documents change
+        self._doc_freqs = np.concatenate([self._doc_freqs,
+                                          np.zeros(len(self.vocabulary) - len(self._doc_freqs), dtype=np.int64)])
+        np.add.at(self._doc_freqs, np.array([ti for bow in bows for ti in bow], dtype=np.int64), 1)
+        self._max_tf = np.concatenate([self._max_tf, np.array([max(bow.values(), default=0) for bow in bows],
+                                                              dtype=np.int32)])
+        self.doc_ids = np.concatenate([self.doc_ids, np.array([doc.doc_id for doc in documents], dtype=np.int64)])
+        self.deleted = np.concatenate([self.deleted, np.zeros(len(documents), dtype=bool)])
+        ordinals = np.arange(first, first + len(documents))
+        self.mapping.update(zip((doc.doc_id for doc in documents), ordinals.tolist()))
+        return ordinals
+
+    def _delete_documents(self, doc_ids: Iterable[int]) -> np.ndarray:
+        doc_ids = list(dict.fromkeys(doc_ids))
+        missing = [doc_id for doc_id in doc_ids if doc_id not in self.mapping]
+        if len(missing) > 0:
+            raise KeyError(f'The documents {missing} are not in the corpus')
+        ordinals = np.array([self.mapping.pop(doc_id) for doc_id in doc_ids], dtype=np.int64)
+
+        # the tokens of the deleted documents no longer count in the dictionary
+        for dj in ordinals.tolist():
+            for ti, freq in self.doc2bow(dj).items():
+                self._doc_freqs[ti] -= 1
+                self.index.dfs[ti] -= 1
+                self.index.cfs[ti] -= freq
+                self.index.num_nnz -= 1
+                self.index.num_pos -= freq
+        self.index.num_docs -= len(ordinals)
+
+        # the tombstones and the max frequencies may be a read only view of the saved file, and the old
+        # snapshots keep them
+        self.deleted = self.deleted.copy()
+        self.deleted[ordinals] = True
+        self._max_tf = self._max_tf.copy()
+        self._max_tf[ordinals] = 0
+        return ordinals
+
+    def _update_indexed_corpus(self, num_changes: int, save: bool):
+        """
+        Updates what depends on the whole inverted index after the documents change, and saves the corpus
+        if it's asked or if flush_size documents changed since it was saved. The document frequencies were
+        updated with the tokens of the changed documents, so the idf is a single pass over the vocabulary.
+        The tombstones are applied and the norms of the documents are computed by the first query after the
+        changes, once for all of them, and only the segments with new tombstones are filtered again.
+        """
+        metrics.increment('index_updates')
+        with metrics.timer('index_update'):
+            self._refresh_segments(update_statistics=True)
+            self.index_version += 1
+            self._unsaved_changes += num_changes
+            if save or self._unsaved_changes >= self.flush_size:
+                self.save_indexed_corpus()
 
     def remove_stopwords(self, tokens: List[str]) -> List[str]:
         return [token for token in tokens if token not in self.stopwords]
@@ -108,19 +547,15 @@ class Corpus(ABC):
         """Gets the document matching the id"""
         return self.documents[self.mapping[doc_id]]
 
-    def docs2bows(self) -> List[Dict[int, int]]:
-        """
-        Converts all the document (the list of words) into the bag-of-words representation
-        format = list of (token_id, token_count) 2-tuples.
-        """
-        return [dict(self.index.doc2bow(doc.doc_tokens)) for doc in self.documents]
-
     def doc2bow(self, doc_id: int) -> Dict[int, int]:
         """
         Converts the document matching the id into the bag-of-words representation
         format = list of (token_id, token_count) 2-tuples.
         """
-        return self.vectors[doc_id]
+        if self.deleted[doc_id]:
+            return {}
+        segment = self.documents.segment(doc_id)
+        return segment.bow(doc_id - segment.base)
 
     def token2id(self, token: str):
         """Gets the id of a token"""
@@ -128,11 +563,10 @@ class Corpus(ABC):
 
     def get_frequency(self, tok_id: int, doc_id: int) -> int:
         """Gets the frequency of a token in certain document"""
-        vector = self.doc2bow(doc_id)
-        try:
-            return vector[tok_id]
-        except KeyError:
+        if self.deleted[doc_id]:
             return 0
+        segment = self.documents.segment(doc_id)
+        return segment.frequency(tok_id, doc_id - segment.base)
 
     def get_token_frequency(self, token: str, doc_id: int):
         """Gets the frequency of a token in certain document"""
@@ -142,6 +576,66 @@ class Corpus(ABC):
         except KeyError:
             return 0
 
+    def get_postings(self, tok_id: int):
+        """Gets the ordinals of the documents that contain the token and the frequency of the token in them"""
+        return self.postings.postings(tok_id)
+
+    def get_term_weights(self, tok_id: int) -> TermWeights:
+        """
+        Gets the tf-idf weights of a token in the documents that contain it, tf(ti, dj) / max_tf * idf(ti).
+        The weights of the popular tokens are cached.
+        """
+        snapshot = self.snapshot
+        return self.term_weights.get(tok_id, snapshot.postings, snapshot.stats)
+
+    def get_candidate_docs(self, tok_ids: Iterable[int], conjunctive=False):
+        """
+        Gets the ordinals of the documents that must be scored for a query, using the inverted index
+
+        Args:
+        - tok_ids: the ids of the tokens of the query
+        - conjunctive: if True, the documents must contain all the tokens, otherwise at least one of them
+
+        Returns:
+        - np.array: the sorted ordinals of the documents
+        """
+        if conjunctive:
+            return self.postings.intersection(tok_ids)
+        return self.postings.union(tok_ids)
+
+    def get_tfidf_matrix(self, layout='csr'):
+        """
+        Gets the document-term matrix of the corpus weighted with tf-idf, the rows are the ordinals
+        of the documents and the columns the ids of the tokens. It is materialized the first time it is used.
+
+        Args:
+        - layout: 'csr' to get the rows (documents) compressed or 'csc' to get the columns (tokens) compressed,
+        the second one is used to select the weights of a few tokens in every document
+
+        Returns:
+        - scipy.sparse matrix: the tf-idf matrix of shape (number of documents, number of tokens)
+        """
+        snapshot = self.snapshot
+        matrices = snapshot.tfidf_matrices
+        if layout not in matrices:
+            if layout == 'csc':
+                num_terms = len(snapshot.stats.idf)
+                blocks = [csc_matrix((0, num_terms))]
+                for segment, (postings, _) in zip(snapshot.postings.segments, snapshot.postings.parts()):
+                    weights = postings.freqs / snapshot.stats.max_tf[postings.docs + segment.base] * \
+                        snapshot.stats.idf[postings.posting_terms()]
+                    # the postings are the columns of the matrix of the segment, so they are already in the
+                    # compressed column layout
+                    blocks.append(csc_matrix((weights, postings.docs, postings.padded_offsets(num_terms)),
+                                             shape=(segment.num_docs, num_terms)))
+                matrix = blocks[-1] if len(blocks) == 2 else vstack(blocks, format='csc')
+                matrices[layout] = matrix
+            elif layout == 'csr':
+                matrices[layout] = self.get_tfidf_matrix('csc').tocsr()
+            else:
+                raise ValueError(f'Unknown layout {layout}')
+        return matrices[layout]
+
     def get_max_frequency(self, doc_id: int) -> Tuple[str, int]:
         """Gets the term of the max frequency and its frequency in a certain document"""
         vector = self.doc2bow(doc_id)
@@ -151,13 +645,3 @@ class Corpus(ABC):
 
         max_freq_id = max(vector.items(), key=lambda x: x[1])
         return self.index[max_freq_id[0]], max_freq_id[1]
-
-    def _get_max_idf(self):
-        """Gets the maximum inverse document frequency of the corpus"""
-        N = len(self.documents)
-        idfs = [math.log2(N / ni) if ni > 0 else 0 for ni in self.index.dfs]
-
-        if len(idfs) == 0:
-            return 0
-
-        return max(idfs)
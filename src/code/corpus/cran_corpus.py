@@ -1,9 +1,12 @@
 import re
 from pathlib import Path
-from typing import List
+from typing import List, Iterator
 
-from corpus import Corpus, Document
+from corpus import Corpus
+from .ingestion import RawDocument
+from .segments import MergePolicy
 
+DOC_ID_PATTERN = re.compile(r'\.I (\d+)')
 
 # TODO: Add cran documents for more specific searches and recommendations like based on author
 
@@ -19,44 +22,49 @@ class CranCorpus(Corpus):
         the first line is the title
     """
 
-    def __init__(self, path: Path, language='english', stemming=False):
-        super().__init__(corpus_path=path, corpus_type='cran', language=language, stemming=stemming)
+    def __init__(self, path: Path, language='english', stemming=False, workers: int = None,
+                 merge_policy: MergePolicy = None, flush_size=1000):
+        super().__init__(corpus_path=path, corpus_type='cran', language=language, stemming=stemming, workers=workers,
+                         merge_policy=merge_policy, flush_size=flush_size)
 
-    def parse_documents(self, path: Path):
-        for file in path.glob('*.txt'):
-            self.parse_document(file)
+    def iter_sources(self, path: Path) -> Iterator[Path]:
+        return iter(sorted(path.glob('*.txt')))
 
-    def parse_document(self, corpus_path):
-        corpus_fd = open(corpus_path, 'r')
+    @staticmethod
+    def parse_source(corpus_path: Path) -> Iterator[RawDocument]:
         current_id: int = None
         current_lines: List[str] = []
         getting_words = False
         current_title: list = []
         getting_title = False
 
-        for i, line in enumerate(corpus_fd.readlines()):
-            m = re.compile(r'\.I (\d+)').match(line)
-            if m is not None:
-                current_id = int(m.group(1))
-                current_lines = []
-                getting_words = False
-                current_title = []
-            if line.startswith('.T'):
-                getting_title = True
-                current_title.append(line[2:-1])
-            elif line.startswith('.W'):
-                getting_words = True
-                current_lines.append(line[2:-1])
-            elif line.startswith('.A'):
-                getting_title = False
-            elif line.startswith('.X'):
-                getting_words = False
-            elif getting_words:
-                current_lines.append(line[:-1])
-            elif getting_title:
-                current_title.append(line[:-1])
+        with open(corpus_path, 'r') as corpus_fd:
+            for line in corpus_fd:
+                line = line.rstrip('\n')
+                m = DOC_ID_PATTERN.match(line)
+                if m is not None:
+                    # a file can have more than one document
+                    if len(current_lines) > 0:
+                        yield current_id, " ".join(current_title), " ".join(current_lines)
+                    current_id = int(m.group(1))
+                    current_lines = []
+                    getting_words = False
+                    current_title = []
+                    getting_title = False
+                elif line.startswith('.T'):
+                    getting_title = True
+                    current_title.append(line[2:])
+                elif line.startswith('.W'):
+                    getting_words = True
+                    current_lines.append(line[2:])
+                elif line.startswith('.A'):
+                    getting_title = False
+                elif line.startswith('.X'):
+                    getting_words = False
+                elif getting_words:
+                    current_lines.append(line)
+                elif getting_title:
+                    current_title.append(line)
 
         if len(current_lines) > 0:
-            tokens = self.preprocess_text(" ".join(current_lines))
-            title = self.preprocess_text(" ".join(current_title))
-            self.documents.append(Document(current_id, tokens, " ".join(current_title)))
+            yield current_id, " ".join(current_title), " ".join(current_lines)
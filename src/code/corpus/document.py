@@ -1,4 +1,10 @@
-from typing import List
+from collections.abc import Sequence
+from functools import lru_cache
+from typing import Dict, List
+
+import numpy as np
+
+from .index_format import StringArray
 
 
 class Document:
@@ -33,3 +39,94 @@ class Document:
 
     def __repr__(self):
         return repr(self.to_dict())
+
+
+class DocumentStore(Sequence):
+    """
+    Read only sequence of the documents of an indexed corpus. The documents are stored in flat arrays
+    (usually memory mapped) and the Document objects are only created when they are accessed.
+
+    Attributes:
+    - doc_ids: np.array with the id of every document
+    - titles: StringArray with the title of every document
+    - token_offsets: the tokens of the document with ordinal dj are in
+    token_ids[token_offsets[dj]:token_offsets[dj + 1]]
+    - token_ids: np.array with the ids of the tokens of all the documents, in the order of the text
+    - vocabulary: sequence with the token of every token id
+    """
+
+    def __init__(self, doc_ids: np.ndarray, titles: StringArray, token_offsets: np.ndarray, token_ids: np.ndarray,
+                 vocabulary: Sequence, cache_size=4096):
+        """
+        Args:
+        - cache_size: the number of documents that are kept in the LRU cache once they are created
+        """
+        self.doc_ids = doc_ids
+        self.titles = titles
+        self.token_offsets = token_offsets
+        self.token_ids = token_ids
+        self.vocabulary = vocabulary
+        self.load_document = lru_cache(maxsize=cache_size)(self._load_document)
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    def __getitem__(self, dj):
+        if isinstance(dj, slice):
+            return [self[i] for i in range(*dj.indices(len(self)))]
+        if dj < 0:
+            dj += len(self)
+        if dj < 0 or dj >= len(self):
+            raise IndexError('document index out of range')
+        return self.load_document(dj)
+
+    @classmethod
+    def from_documents(cls, documents: List[Document], token2id: Dict[str, int], vocabulary: Sequence,
+                       cache_size=4096) -> "DocumentStore":
+        """
+        Stores documents in flat arrays
+
+        Args:
+        - documents: the documents
+        - token2id: the id of every token of the documents
+        - vocabulary: the token of every token id
+
+        Returns:
+        - DocumentStore: the store with the documents
+        """
+        doc_ids = np.array([doc.doc_id for doc in documents], dtype=np.int64)
+        token_offsets = np.zeros(len(documents) + 1, dtype=np.int64)
+        np.cumsum([len(doc.doc_tokens) for doc in documents], out=token_offsets[1:])
+        token_ids = np.fromiter((token2id[token] for doc in documents for token in doc.doc_tokens),
+                                dtype=np.int32, count=int(token_offsets[-1]))
+        titles = StringArray.encode(doc.doc_title for doc in documents)
+        return cls(doc_ids, titles, token_offsets, token_ids, vocabulary, cache_size)
+
+    @classmethod
+    def concatenate(cls, stores: List["DocumentStore"], deleted: np.ndarray, vocabulary: Sequence,
+                    cache_size=4096) -> "DocumentStore":
+        """
+        Joins stores of consecutive documents, the tokens of the deleted documents are dropped
+
+        Args:
+        - stores: the stores in the order of their documents
+        - deleted: np.array of bool, True for the deleted documents of all the stores
+        - vocabulary: the token of every token id
+
+        Returns:
+        - DocumentStore: the store with all the documents, the deleted ones without tokens
+        """
+        doc_ids = np.concatenate([store.doc_ids for store in stores])
+        lengths = np.concatenate([np.diff(store.token_offsets) for store in stores])
+        token_ids = np.concatenate([store.token_ids for store in stores])
+        token_ids = token_ids[np.repeat(~deleted, lengths)]
+        lengths[deleted] = 0
+        token_offsets = np.zeros(len(doc_ids) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=token_offsets[1:])
+        titles = StringArray.concatenate([store.titles for store in stores])
+        return cls(doc_ids, titles, token_offsets, token_ids, vocabulary, cache_size)
+
+    def _load_document(self, dj: int) -> Document:
+        start, end = self.token_offsets[dj], self.token_offsets[dj + 1]
+        tokens = [self.vocabulary[ti] for ti in self.token_ids[start:end].tolist()]
+        return Document(int(self.doc_ids[dj]), tokens, self.titles[dj])
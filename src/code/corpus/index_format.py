@@ -0,0 +1,145 @@
+"""
+Binary format of the indexed corpus. The whole index is a single file that is opened with numpy.memmap,
+so loading it doesn't copy the arrays and the processes that open the same file share its pages.
+
+Layout of the file (little endian):
+- header: magic (8 bytes), format version (uint32), number of sections (uint32)
+- section table: for every section its name (32 bytes), dtype (8 bytes), offset (uint64) and length (uint64)
+- sections: flat arrays, each one aligned to ALIGNMENT bytes from the start of the file
+"""
+import json
+import os
+import struct
+from collections.abc import Sequence
+from pathlib import Path
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+
+MAGIC = b'IRINDEX\0'
+# bumped when the sections or their meaning change, the files written by an older version are indexed again
+FORMAT_VERSION = 1
+ALIGNMENT = 64
+
+_HEADER = struct.Struct('<8sII')
+_SECTION = struct.Struct('<32s8sQQ')
+MAX_NAME_LENGTH = 32
+
+
+class IndexFormatError(Exception):
+    pass
+
+
+class StringArray(Sequence):
+    """
+    Sequence of strings stored as a blob with the utf-8 bytes of all of them, the string i
+    is in the positions offsets[i]:offsets[i + 1]. The strings are decoded when they are accessed.
+    """
+
+    def __init__(self, offsets: np.ndarray, blob: np.ndarray):
+        self.offsets = offsets
+        self.blob = blob
+
+    @classmethod
+    def encode(cls, strings: Iterable[str]) -> "StringArray":
+        encoded = [string.encode('utf-8') for string in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(data) for data in encoded], out=offsets[1:])
+        return cls(offsets, np.frombuffer(b''.join(encoded), dtype=np.uint8))
+
+    @classmethod
+    def concatenate(cls, arrays: List["StringArray"]) -> "StringArray":
+        """Joins arrays of strings, keeping their order"""
+        starts = np.cumsum([0] + [len(array.blob) for array in arrays[:-1]])
+        offsets = np.concatenate([[0]] + [array.offsets[1:] + start for array, start in zip(arrays, starts)])
+        return cls(offsets.astype(np.int64), np.concatenate([array.blob for array in arrays]))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if i < 0 or i >= len(self):
+            raise IndexError('string index out of range')
+        return self.blob[self.offsets[i]:self.offsets[i + 1]].tobytes().decode('utf-8')
+
+
+def write_index(path: Path, sections: Dict[str, np.ndarray], meta: dict = None):
+    """
+    Writes the sections of the index into a file. The file is written aside and then renamed,
+    so the processes that are reading the old file never see a half written one.
+
+    Args:
+    - path: the path of the file
+    - sections: the arrays of the index by name
+    - meta: values of the index that aren't arrays, they are saved as json in the 'meta' section
+
+    Raises:
+    - ValueError: if the name of a section has more than MAX_NAME_LENGTH bytes
+    """
+    for name in sections:
+        if len(name.encode('ascii')) > MAX_NAME_LENGTH:
+            raise ValueError(f'The name of the section {name!r} has more than {MAX_NAME_LENGTH} bytes')
+    sections = {name: np.ascontiguousarray(array) for name, array in sections.items()}
+    sections['meta'] = np.frombuffer(json.dumps(meta or {}).encode('utf-8'), dtype=np.uint8)
+
+    offset = _align(_HEADER.size + _SECTION.size * len(sections))
+    table = []
+    for name, array in sections.items():
+        table.append(_SECTION.pack(name.encode('ascii'), array.dtype.str.encode('ascii'), offset, len(array)))
+        offset = _align(offset + array.nbytes)
+
+    tmp_path = path.with_name(path.name + '.tmp')
+    with open(tmp_path, 'wb') as file:
+        file.write(_HEADER.pack(MAGIC, FORMAT_VERSION, len(sections)))
+        for entry in table:
+            file.write(entry)
+        for array in sections.values():
+            file.seek(_align(file.tell()))
+            file.write(array.tobytes())
+        file.truncate(offset)
+    os.replace(tmp_path, path)
+
+
+def read_index(path: Path) -> Tuple[Dict[str, np.ndarray], dict]:
+    """
+    Opens an index file written by write_index, the arrays are read only views of the memory mapped file.
+
+    Args:
+    - path: the path of the file
+
+    Returns:
+    - tuple: the arrays of the index by name and the values of the 'meta' section
+
+    Raises:
+    - FileNotFoundError: if the file doesn't exist
+    - IndexFormatError: if the file isn't an index or was written by another version of the format
+    """
+    with open(path, 'rb') as file:
+        header = file.read(_HEADER.size)
+        if len(header) < _HEADER.size:
+            raise IndexFormatError(f'{path} is truncated')
+        magic, version, num_sections = _HEADER.unpack(header)
+        if magic != MAGIC:
+            raise IndexFormatError(f'{path} is not an index file')
+        if version != FORMAT_VERSION:
+            raise IndexFormatError(f'{path} has version {version} of the format, expected {FORMAT_VERSION}')
+        table = [_SECTION.unpack(file.read(_SECTION.size)) for _ in range(num_sections)]
+
+    buffer = np.memmap(path, dtype=np.uint8, mode='r')
+    sections = {}
+    for name, dtype, offset, length in table:
+        dtype = np.dtype(dtype.rstrip(b'\0').decode('ascii'))
+        end = offset + length * dtype.itemsize
+        if end > len(buffer):
+            raise IndexFormatError(f'{path} is truncated')
+        sections[name.rstrip(b'\0').decode('ascii')] = buffer[offset:end].view(dtype)
+    meta = json.loads(sections.pop('meta').tobytes().decode('utf-8'))
+    return sections, meta
+
+
+def _align(offset: int) -> int:
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
@@ -0,0 +1,102 @@
+"""Pipeline to parse and preprocess the documents of a corpus in parallel"""
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from typing import Callable, Iterable, Iterator, List, Tuple
+
+import nltk
+
+from src.code.utils import remove_punctuation, to_lower, tokenize
+from .document import Document
+
+RawDocument = Tuple[int, str, str]  # (doc_id, title, text)
+
+
+class TextPreprocessor:
+    """
+    Cleans and tokenizes texts. It also removes the stopwords and stems the tokens if needed.
+
+    Attributes:
+    - stopwords: set of string
+    - stemmer: nltk.stem.SnowballStemmer, None if the tokens are not stemmed
+    """
+
+    def __init__(self, language="english", stemming=False):
+        self.stopwords = set(nltk.corpus.stopwords.words(language))
+        self.stemmer = nltk.SnowballStemmer(language) if stemming else None
+
+    def __call__(self, text: str) -> List[str]:
+        text = remove_punctuation(text)
+        text = to_lower(text)
+        tokens = tokenize(text)
+        tokens = [token for token in tokens if token not in self.stopwords]
+        if self.stemmer is not None:
+            tokens = [self.stemmer.stem(token) for token in tokens]
+        return tokens
+
+
+# the preprocessor of every worker process, created once by _init_worker
+_worker_preprocessor: TextPreprocessor = None
+
+
+def _init_worker(language: str, stemming: bool):
+    global _worker_preprocessor
+    _worker_preprocessor = TextPreprocessor(language, stemming)
+
+
+def _process_sources(parse_source: Callable, sources: list, preprocessor: TextPreprocessor = None) -> List[Document]:
+    preprocessor = preprocessor or _worker_preprocessor
+    return [Document(doc_id, preprocessor(text), title)
+            for source in sources for doc_id, title, text in parse_source(source)]
+
+
+def read_raw_document(document: RawDocument) -> List[RawDocument]:
+    """Source of a document that is already in memory, to preprocess new documents with ingest_documents"""
+    return [document]
+
+
+def _chunks(iterable: Iterable, size: int) -> Iterator[list]:
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if len(chunk) == 0:
+            return
+        yield chunk
+
+
+def ingest_documents(sources: Iterable, parse_source: Callable[[object], Iterable[RawDocument]],
+                     language="english", stemming=False, workers: int = None, chunk_size=32) -> Iterator[Document]:
+    """
+    Parses and preprocesses the documents of a corpus. The sources are consumed lazily and sent in chunks
+    to a pool of processes, only a few chunks per process are in flight at the same time. The documents
+    are yielded in the same order as their sources, so the result doesn't depend on the number of workers.
+
+    Args:
+    - sources: the sources of the documents, usually their files
+    - parse_source: function (it must be picklable) that gets the raw documents (doc_id, title, text) of a source
+    - language: the language of the documents
+    - stemming: if True, the tokens are stemmed
+    - workers: the number of processes, by default the number of cores. With 1 everything runs in this process
+    - chunk_size: the number of sources sent to a process at once
+
+    Returns:
+    - iterator of Document: the preprocessed documents
+    """
+    workers = workers or os.cpu_count() or 1
+    chunks = _chunks(sources, chunk_size)
+
+    if workers == 1:
+        preprocessor = TextPreprocessor(language, stemming)
+        for chunk in chunks:
+            yield from _process_sources(parse_source, chunk, preprocessor)
+        return
+
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(language, stemming)) as executor:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(executor.submit(_process_sources, parse_source, chunk))
+            if len(pending) >= 2 * workers:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
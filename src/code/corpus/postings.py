@@ -0,0 +1,192 @@
+"""Inverted index of the corpus, used to only visit the documents that contain the query terms."""
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+
+
+class PostingsIndex:
+    """
+    Maps every token id to its postings list, that is, the sorted ordinals of the documents
+    that contain the token and the frequency of the token in each one of them.
+
+    The postings of all the tokens are stored in flat arrays:
+    - offsets: the postings of the token ti are in the positions offsets[ti]:offsets[ti + 1]
+    - docs: the ordinals of the documents (the position of the document in corpus.documents)
+    - freqs: the frequency of the token in the document
+    """
+
+    def __init__(self, offsets: np.ndarray, docs: np.ndarray, freqs: np.ndarray):
+        self.offsets = offsets
+        self.docs = docs
+        self.freqs = freqs
+
+    @classmethod
+    def from_bows(cls, vectors: List[Dict[int, int]], num_terms: int) -> "PostingsIndex":
+        """
+        Builds the inverted index from the bag of words of the documents
+
+        Args:
+        - vectors: the bag of words of each document, in the same order as corpus.documents
+        - num_terms: the number of tokens in the dictionary
+
+        Returns:
+        - PostingsIndex: the inverted index of the documents
+        """
+        lengths = [len(vector) for vector in vectors]
+        total = sum(lengths)
+        terms = np.fromiter((ti for vector in vectors for ti in vector.keys()), dtype=np.int32, count=total)
+        freqs = np.fromiter((f for vector in vectors for f in vector.values()), dtype=np.int32, count=total)
+        docs = np.repeat(np.arange(len(vectors), dtype=np.int32), lengths)
+        return cls._from_entries(terms, docs, freqs, num_terms)
+
+    @classmethod
+    def _from_entries(cls, terms: np.ndarray, docs: np.ndarray, freqs: np.ndarray, num_terms: int) -> "PostingsIndex":
+        # a stable sort by term keeps the documents of every postings list sorted by ordinal
+        order = np.argsort(terms, kind='stable')
+        offsets = np.zeros(num_terms + 1, dtype=np.int64)
+        np.cumsum(np.bincount(terms, minlength=num_terms), out=offsets[1:])
+        return cls(offsets, docs[order], freqs[order])
+
+    @classmethod
+    def concatenate(cls, parts: List[Tuple["PostingsIndex", int]], num_terms: int) -> "PostingsIndex":
+        """
+        Joins the inverted indexes of consecutive ranges of documents
+
+        Args:
+        - parts: for every inverted index, the ordinal of its first document, sorted by it
+        - num_terms: the number of tokens of the joined index, the parts can have fewer tokens
+
+        Returns:
+        - PostingsIndex: the inverted index of all the documents
+        """
+        terms = np.concatenate([postings.posting_terms() for postings, _ in parts])
+        docs = np.concatenate([postings.docs.astype(np.int32) + first_doc for postings, first_doc in parts])
+        freqs = np.concatenate([postings.freqs for postings, _ in parts])
+        # the parts are sorted by document, so sorting by term keeps every postings list sorted
+        return cls._from_entries(terms, docs, freqs, num_terms)
+
+    def remove_docs(self, deleted: np.ndarray) -> "PostingsIndex":
+        """
+        Removes the postings of some documents, the ordinals of the rest don't change
+
+        Args:
+        - deleted: np.array of bool, True for the ordinals of the documents to remove
+
+        Returns:
+        - PostingsIndex: the inverted index without the documents
+        """
+        keep = ~deleted[self.docs]
+        offsets = np.zeros(self.num_terms + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.posting_terms()[keep], minlength=self.num_terms), out=offsets[1:])
+        return PostingsIndex(offsets, self.docs[keep], self.freqs[keep])
+
+    @property
+    def num_terms(self) -> int:
+        return len(self.offsets) - 1
+
+    def padded_offsets(self, num_terms: int) -> np.ndarray:
+        """Gets the offsets of the postings lists with the tokens after num_terms having empty lists"""
+        if num_terms <= self.num_terms:
+            return self.offsets
+        return np.concatenate([self.offsets, np.full(num_terms - self.num_terms, self.offsets[-1])])
+
+    def doc_freqs(self, num_terms: int) -> np.ndarray:
+        """Gets the number of documents that contain every token"""
+        return np.diff(self.padded_offsets(num_terms))
+
+    def collection_freqs(self, num_terms: int) -> np.ndarray:
+        """Gets the number of times that every token appears in the documents"""
+        return np.bincount(self.posting_terms(), weights=self.freqs, minlength=num_terms).astype(np.int64)
+
+    def posting_terms(self) -> np.ndarray:
+        """Gets the token id of every posting, aligned with the docs and freqs arrays"""
+        return np.repeat(np.arange(self.num_terms, dtype=np.int32), np.diff(self.offsets))
+
+    def postings(self, ti: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Gets the postings list of a token
+
+        Args:
+        - ti: the id of the token
+
+        Returns:
+        - tuple of np.array: the ordinals of the documents that contain the token and its frequencies
+        """
+        if ti < 0 or ti >= self.num_terms:
+            return self.docs[:0], self.freqs[:0]
+        start, end = self.offsets[ti], self.offsets[ti + 1]
+        return self.docs[start:end], self.freqs[start:end]
+
+    def doc_freq(self, ti: int) -> int:
+        """Gets the number of documents that contain the token"""
+        if ti < 0 or ti >= self.num_terms:
+            return 0
+        return int(self.offsets[ti + 1] - self.offsets[ti])
+
+    def union(self, term_ids: Iterable[int]) -> np.ndarray:
+        """Gets the sorted ordinals of the documents that contain at least one of the tokens"""
+        lists = [self.postings(ti)[0] for ti in term_ids]
+        if len(lists) == 0:
+            return np.zeros(0, dtype=np.int32)
+        return np.unique(np.concatenate(lists))
+
+    def intersection(self, term_ids: Iterable[int]) -> np.ndarray:
+        """Gets the sorted ordinals of the documents that contain all the tokens"""
+        lists = sorted((self.postings(ti)[0] for ti in set(term_ids)), key=len)
+        if len(lists) == 0:
+            return np.zeros(0, dtype=np.int32)
+        # the smallest list goes first so every intersection is bounded by it
+        result = lists[0]
+        for docs in lists[1:]:
+            if len(result) == 0:
+                break
+            result = np.intersect1d(result, docs, assume_unique=True)
+        return result
+
+
+class ForwardIndex:
+    """
+    Maps every document to its bag of words, the transpose of the inverted index. The tokens of the
+    document with ordinal dj are in the positions offsets[dj]:offsets[dj + 1] of the flat arrays
+    terms and freqs, sorted by token id.
+    """
+
+    def __init__(self, offsets: np.ndarray, terms: np.ndarray, freqs: np.ndarray):
+        self.offsets = offsets
+        self.terms = terms
+        self.freqs = freqs
+
+    @classmethod
+    def from_postings(cls, postings: PostingsIndex, num_docs: int) -> "ForwardIndex":
+        """
+        Builds the forward index from the inverted index
+
+        Args:
+        - postings: the inverted index of the corpus
+        - num_docs: the number of documents of the corpus
+
+        Returns:
+        - ForwardIndex: the bag of words of every document
+        """
+        # a stable sort by document keeps the tokens of every document sorted by id
+        order = np.argsort(postings.docs, kind='stable')
+        offsets = np.zeros(num_docs + 1, dtype=np.int64)
+        np.cumsum(np.bincount(postings.docs, minlength=num_docs), out=offsets[1:])
+        return cls(offsets, postings.posting_terms()[order], postings.freqs[order])
+
+    @property
+    def num_docs(self) -> int:
+        return len(self.offsets) - 1
+
+    def bow(self, dj: int) -> Dict[int, int]:
+        """Gets the bag of words of a document as a dictionary from token id to frequency"""
+        start, end = self.offsets[dj], self.offsets[dj + 1]
+        return dict(zip(self.terms[start:end].tolist(), self.freqs[start:end].tolist()))
+
+    def frequency(self, ti: int, dj: int) -> int:
+        """Gets the frequency of a token in a document, 0 if the document doesn't contain it"""
+        start, end = self.offsets[dj], self.offsets[dj + 1]
+        position = start + np.searchsorted(self.terms[start:end], ti)
+        if position < end and self.terms[position] == ti:
+            return int(self.freqs[position])
+        return 0
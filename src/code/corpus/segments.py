@@ -0,0 +1,451 @@
+"""
+Segments of the index. The documents of the corpus are split in segments of consecutive ordinals, every segment
+is immutable once it is saved and the queries go through all of them. New documents go to a live segment in
+memory that is saved as a new segment, and the small segments are merged in the background.
+"""
+import math
+import threading
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from collections.abc import Sequence
+from itertools import chain
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from .document import Document, DocumentStore
+from .index_format import StringArray, read_index, write_index
+from .postings import ForwardIndex, PostingsIndex
+
+
+class Segment:
+    """
+    Immutable part of the index with the documents of the ordinals base:base + num_docs.
+
+    Attributes:
+    - name: the name of the segment, it is saved in the file name.bin
+    - base: the ordinal of the first document of the segment
+    - vocab_start: the id of the first token that appeared in the segment, the tokens of the corpus get
+    their ids in the order of the segments, so the segment adds the tokens vocab_start:vocab_start + len(vocabulary)
+    - vocabulary: StringArray with the tokens added by the segment
+    - postings: PostingsIndex with the ordinals of the documents relative to base
+    - forward_index: ForwardIndex with the bag of words of the documents of the segment
+    - documents: DocumentStore with the documents of the segment
+    - persisted: if the segment is saved, the live segment is only in memory until it is flushed
+    """
+
+    def __init__(self, name: str, base: int, vocab_start: int, vocabulary: StringArray, postings: PostingsIndex,
+                 forward_index: ForwardIndex, documents: DocumentStore, persisted=False):
+        self.name = name
+        self.base = base
+        self.vocab_start = vocab_start
+        self.vocabulary = vocabulary
+        self.postings = postings
+        # the postings without the deleted documents and the number of tombstones they were filtered with
+        self._live_postings = (0, postings)
+        self.forward_index = forward_index
+        self.documents = documents
+        self.persisted = persisted
+
+    @classmethod
+    def from_sections(cls, name: str, base: int, sections: Dict[str, np.ndarray], meta: dict,
+                      vocabulary: List[str]) -> "Segment":
+        """
+        Opens a saved segment from the sections of its file
+
+        Args:
+        - name: the name of the segment
+        - base: the ordinal of the first document
+        - sections: the arrays of the file, as returned by read_index
+        - meta: the values of the file, as returned by read_index
+        - vocabulary: the token of every token id of the corpus, it is shared with the other segments
+
+        Returns:
+        - Segment: the segment
+        """
+        postings = PostingsIndex(sections['postings_offsets'], sections['postings_docs'], sections['postings_freqs'])
+        forward_index = ForwardIndex(sections['forward_offsets'], sections['forward_terms'],
+                                     sections['forward_freqs'])
+        documents = DocumentStore(sections['doc_ids'], StringArray(sections['title_offsets'], sections['titles']),
+                                  sections['token_offsets'], sections['token_ids'], vocabulary)
+        vocab = StringArray(sections['vocab_offsets'], sections['vocab'])
+        # the corpora saved as a single file before the segments are a segment with all the tokens
+        vocab_start = meta.get('vocab_start', 0)
+        return cls(name, base, vocab_start, vocab, postings, forward_index, documents, persisted=True)
+
+    @classmethod
+    def merge(cls, name: str, segments: List["Segment"], deleted: np.ndarray, vocabulary: List[str]) -> "Segment":
+        """
+        Merges consecutive segments into a new one in memory. The deleted documents keep their ordinals,
+        but their postings and tokens are dropped.
+
+        Args:
+        - name: the name of the new segment
+        - segments: the segments, in the order of their documents
+        - deleted: np.array of bool, True for the deleted documents of the corpus
+        - vocabulary: the token of every token id of the corpus
+
+        Returns:
+        - Segment: the merged segment
+        """
+        base = segments[0].base
+        num_docs = sum(segment.num_docs for segment in segments)
+        vocab_end = segments[-1].vocab_start + len(segments[-1].vocabulary)
+        parts = [(segment.postings.remove_docs(deleted[segment.base:segment.base + segment.num_docs]),
+                  segment.base - base) for segment in segments]
+        postings = PostingsIndex.concatenate(parts, vocab_end)
+        forward_index = ForwardIndex.from_postings(postings, num_docs)
+        documents = DocumentStore.concatenate([segment.documents for segment in segments],
+                                              deleted[base:base + num_docs], vocabulary)
+        vocab = StringArray.concatenate([segment.vocabulary for segment in segments])
+        return cls(name, base, segments[0].vocab_start, vocab, postings, forward_index, documents)
+
+    @property
+    def num_docs(self) -> int:
+        return len(self.documents)
+
+    def bow(self, dj: int) -> Dict[int, int]:
+        """Gets the bag of words of the document dj of the segment, relative to base"""
+        return self.forward_index.bow(dj)
+
+    def frequency(self, ti: int, dj: int) -> int:
+        """Gets the frequency of a token in the document dj of the segment, relative to base"""
+        return self.forward_index.frequency(ti, dj)
+
+    def live_postings(self, deleted: np.ndarray) -> PostingsIndex:
+        """
+        Gets the postings used by the queries, without the deleted documents. The documents are only deleted,
+        so the postings are filtered again only when the segment has new tombstones, and the segments without
+        them keep their postings.
+
+        Args:
+        - deleted: np.array of bool, True for the deleted documents of the segment
+
+        Returns:
+        - PostingsIndex: the postings of the documents that aren't deleted
+        """
+        num_deleted = int(np.count_nonzero(deleted))
+        live_postings = self._live_postings
+        if live_postings[0] != num_deleted:
+            live_postings = (num_deleted, self.postings.remove_docs(deleted))
+            self._live_postings = live_postings
+        return live_postings[1]
+
+    def save(self, folder: Path):
+        """Saves the segment in the file folder/name.bin, the file is never changed after that"""
+        documents = self.documents
+        sections = {
+            'vocab_offsets': self.vocabulary.offsets,
+            'vocab': self.vocabulary.blob,
+            'postings_offsets': self.postings.offsets,
+            'postings_docs': self.postings.docs,
+            'postings_freqs': self.postings.freqs,
+            'forward_offsets': self.forward_index.offsets,
+            'forward_terms': self.forward_index.terms,
+            'forward_freqs': self.forward_index.freqs,
+            'doc_ids': documents.doc_ids,
+            'title_offsets': documents.titles.offsets,
+            'titles': documents.titles.blob,
+            'token_offsets': documents.token_offsets,
+            'token_ids': documents.token_ids,
+        }
+        write_index(folder / f'{self.name}.bin', sections, {'vocab_start': self.vocab_start})
+
+    @staticmethod
+    def read(folder: Path, name: str) -> Tuple[Dict[str, np.ndarray], dict]:
+        """Reads the sections of the file of a saved segment"""
+        return read_index(folder / f'{name}.bin')
+
+
+class LiveSegment:
+    """
+    Segment in memory with the documents added since the last flush. The documents are indexed as they are
+    added, their postings are appended to a list per token, so adding a document costs its number of tokens
+    and not the size of the segment. The arrays of the index are built from the lists once, when the segment
+    is flushed or queried after the documents change.
+
+    Attributes:
+    - name: the name of the segment, it is saved in the file name.bin
+    - base: the ordinal of the first document of the segment
+    - vocab_start: the id of the first token that appeared in the segment
+    - documents: list with the documents of the segment
+    """
+
+    def __init__(self, name: str, base: int, vocab_start: int, token2id: Dict[str, int], vocabulary: List[str]):
+        """
+        Args:
+        - name, base, vocab_start: as in the attributes
+        - token2id: the id of every token of the corpus
+        - vocabulary: the token of every token id of the corpus, it is shared with the other segments
+        """
+        self.name = name
+        self.base = base
+        self.vocab_start = vocab_start
+        self.documents: List[Document] = []
+        self._token2id = token2id
+        self._vocabulary = vocabulary
+        # the ordinals of the documents that contain every token and its frequencies in them
+        self._postings: Dict[int, Tuple[List[int], List[int]]] = {}
+        self._bows: List[Dict[int, int]] = []
+        # the last segment built, with its number of documents and tokens
+        self._segment: Optional[Tuple[int, int, Segment]] = None
+        self._lock = threading.Lock()
+
+    @property
+    def num_docs(self) -> int:
+        return len(self.documents)
+
+    def add(self, documents: List[Document]) -> List[Dict[int, int]]:
+        """
+        Indexes new documents at the end of the segment, their tokens must be in token2id
+
+        Args:
+        - documents: the documents
+
+        Returns:
+        - list of dict: the bag of words of every document
+        """
+        bows = [dict(sorted(Counter(self._token2id[token] for token in doc.doc_tokens).items()))
+                for doc in documents]
+        with self._lock:
+            for doc, bow in zip(documents, bows):
+                dj = len(self.documents)
+                for ti, freq in bow.items():
+                    docs, freqs = self._postings.setdefault(ti, ([], []))
+                    docs.append(dj)
+                    freqs.append(freq)
+                self._bows.append(bow)
+                self.documents.append(doc)
+        return bows
+
+    def bow(self, dj: int) -> Dict[int, int]:
+        """Gets the bag of words of the document dj of the segment, relative to base"""
+        return dict(self._bows[dj])
+
+    def frequency(self, ti: int, dj: int) -> int:
+        """Gets the frequency of a token in the document dj of the segment, relative to base"""
+        return self._bows[dj].get(ti, 0)
+
+    def view(self, num_terms: int) -> "LiveSegmentView":
+        """Gets the segment with the documents that it has now, for a snapshot of the corpus with num_terms tokens"""
+        return LiveSegmentView(self, self.num_docs, num_terms)
+
+    def build(self, num_docs: int = None, num_terms: int = None) -> Segment:
+        """
+        Builds the arrays of the index of the first documents of the segment. The last segment built is kept
+        until more documents are added.
+
+        Args:
+        - num_docs: the number of documents, all of them by default
+        - num_terms: the number of tokens of the corpus after the documents were added, all of them by default
+
+        Returns:
+        - Segment: the segment with the documents
+        """
+        with self._lock:
+            num_docs = self.num_docs if num_docs is None else num_docs
+            num_terms = len(self._vocabulary) if num_terms is None else num_terms
+            if self._segment is not None and self._segment[:2] == (num_docs, num_terms):
+                return self._segment[2]
+
+            # the postings lists are sorted by ordinal, so the ones of the first documents are a prefix
+            terms = sorted(ti for ti in self._postings if ti < num_terms)
+            lists = []
+            for ti in terms:
+                docs, freqs = self._postings[ti]
+                length = len(docs) if docs[-1] < num_docs else bisect_left(docs, num_docs)
+                lists.append((docs[:length], freqs[:length]))
+            lengths = np.zeros(num_terms, dtype=np.int64)
+            lengths[terms] = [len(docs) for docs, _ in lists]
+            offsets = np.zeros(num_terms + 1, dtype=np.int64)
+            np.cumsum(lengths, out=offsets[1:])
+            total = int(offsets[-1])
+            postings = PostingsIndex(offsets,
+                                     np.fromiter(chain.from_iterable(docs for docs, _ in lists), np.int32, total),
+                                     np.fromiter(chain.from_iterable(freqs for _, freqs in lists), np.int32, total))
+
+            bows = self._bows[:num_docs]
+            forward_offsets = np.zeros(num_docs + 1, dtype=np.int64)
+            np.cumsum([len(bow) for bow in bows], out=forward_offsets[1:])
+            forward_index = ForwardIndex(forward_offsets,
+                                         np.fromiter(chain.from_iterable(bows), np.int32, total),
+                                         np.fromiter(chain.from_iterable(bow.values() for bow in bows), np.int32,
+                                                     total))
+            store = DocumentStore.from_documents(self.documents[:num_docs], self._token2id, self._vocabulary)
+            segment = Segment(self.name, self.base, self.vocab_start,
+                              StringArray.encode(self._vocabulary[self.vocab_start:num_terms]), postings,
+                              forward_index, store)
+            self._segment = (num_docs, num_terms, segment)
+            return segment
+
+
+class LiveSegmentView:
+    """
+    The live segment with the documents that it had when a snapshot of the corpus was taken, the documents
+    added after that aren't seen by the snapshot. It has the same methods as Segment, and the arrays of the
+    index are built the first time that they are used.
+    """
+
+    def __init__(self, live_segment: LiveSegment, num_docs: int, num_terms: int):
+        self.live_segment = live_segment
+        self.name = live_segment.name
+        self.base = live_segment.base
+        self.vocab_start = live_segment.vocab_start
+        self.documents = live_segment.documents
+        self.num_docs = num_docs
+        self.num_terms = num_terms
+
+    def bow(self, dj: int) -> Dict[int, int]:
+        return self.live_segment.bow(dj)
+
+    def frequency(self, ti: int, dj: int) -> int:
+        return self.live_segment.frequency(ti, dj)
+
+    def build(self) -> Segment:
+        """Gets the segment with the arrays of the index of the documents"""
+        return self.live_segment.build(self.num_docs, self.num_terms)
+
+    def live_postings(self, deleted: np.ndarray) -> PostingsIndex:
+        return self.build().live_postings(deleted)
+
+
+class SegmentedPostings:
+    """
+    Inverted index of the corpus made of the inverted indexes of its segments. The postings list of a token
+    is gathered from every segment, the segments have consecutive ordinals so the list is still sorted.
+    It has the same methods to look up the postings as PostingsIndex.
+
+    Attributes:
+    - segments: the segments, in the order of their documents
+    - deleted: np.array of bool, True for the deleted documents of the corpus. The tombstones are applied to the
+    segments the first time the postings are used, so a batch of changes filters the postings once
+    """
+
+    def __init__(self, segments: Iterable[Segment], num_terms: int, deleted: np.ndarray):
+        self.segments = tuple(segments)
+        self._num_terms = num_terms
+        self.deleted = deleted
+        self._parts = None
+
+    @property
+    def num_terms(self) -> int:
+        return self._num_terms
+
+    def parts(self) -> List[Tuple[PostingsIndex, int]]:
+        """Gets the inverted index of every segment without the deleted documents, and its first ordinal"""
+        parts = self._parts
+        if parts is None:
+            parts = [(segment.live_postings(self.deleted[segment.base:segment.base + segment.num_docs]), segment.base)
+                     for segment in self.segments]
+            self._parts = parts
+        return parts
+
+    def postings(self, ti: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Gets the postings list of a token
+
+        Args:
+        - ti: the id of the token
+
+        Returns:
+        - tuple of np.array: the ordinals of the documents that contain the token and its frequencies
+        """
+        lists = [(postings.postings(ti), base) for postings, base in self.parts()]
+        lists = [((docs + base) if base > 0 else docs, freqs) for (docs, freqs), base in lists if len(docs) > 0]
+        if len(lists) == 1:
+            return lists[0]
+        if len(lists) == 0:
+            return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32)
+        return np.concatenate([docs for docs, _ in lists]), np.concatenate([freqs for _, freqs in lists])
+
+    def doc_freq(self, ti: int) -> int:
+        """Gets the number of documents that contain the token"""
+        return sum(postings.doc_freq(ti) for postings, _ in self.parts())
+
+    def doc_freqs(self) -> np.ndarray:
+        """Gets the number of documents that contain every token"""
+        return sum((postings.doc_freqs(self.num_terms) for postings, _ in self.parts()),
+                   np.zeros(self.num_terms, dtype=np.int64))
+
+    def collection_freqs(self) -> np.ndarray:
+        """Gets the number of times that every token appears in the documents"""
+        return sum((postings.collection_freqs(self.num_terms) for postings, _ in self.parts()),
+                   np.zeros(self.num_terms, dtype=np.int64))
+
+    def num_postings(self) -> int:
+        return sum(len(postings.docs) for postings, _ in self.parts())
+
+    # the lists of the union and the intersection come from postings, so they are the same as in PostingsIndex
+    union = PostingsIndex.union
+    intersection = PostingsIndex.intersection
+
+
+class SegmentedDocuments(Sequence):
+    """Read only sequence of the documents of all the segments, indexed by their ordinal"""
+
+    def __init__(self, segments: Iterable[Segment]):
+        self.segments = tuple(segments)
+        self.bases = [segment.base for segment in self.segments]
+        self._length = sum(segment.num_docs for segment in self.segments)
+
+    def segment(self, dj: int) -> Segment:
+        """Gets the segment of the document with ordinal dj"""
+        if dj < 0 or dj >= self._length:
+            raise IndexError('document index out of range')
+        return self.segments[bisect_right(self.bases, dj) - 1]
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, dj):
+        if isinstance(dj, slice):
+            return [self[i] for i in range(*dj.indices(len(self)))]
+        if dj < 0:
+            dj += len(self)
+        segment = self.segment(dj)
+        return segment.documents[dj - segment.base]
+
+
+class MergePolicy:
+    """
+    Chooses the segments that are merged. The segments are grouped in levels by their number of documents,
+    a segment with n documents has level 1 + floor(log(n / min_docs) / log(merge_factor)), or 0 if it has at
+    most min_docs. When there are merge_factor consecutive segments of the same level they are merged into one
+    of the next level, so the corpus has a logarithmic number of segments and every document is merged a
+    logarithmic number of times. The segments of a level over 0 are less than merge_factor times bigger than
+    the others of their level, and the ones of the level 0 are small, so a big segment is never rewritten to
+    merge it with a few small ones.
+    """
+
+    def __init__(self, merge_factor=4, min_docs=1000):
+        """
+        Args:
+        - merge_factor: the number of segments merged at once
+        - min_docs: the number of documents of the segments of the lowest level
+        """
+        self.merge_factor = merge_factor
+        self.min_docs = min_docs
+
+    def level(self, num_docs: int) -> int:
+        if num_docs <= self.min_docs:
+            return 0
+        return 1 + int(math.log(num_docs / self.min_docs) / math.log(self.merge_factor))
+
+    def find_merge(self, segments: Sequence) -> Optional[slice]:
+        """
+        Gets the consecutive segments that must be merged, the ones of the lowest level first
+
+        Args:
+        - segments: the saved segments of the corpus, in the order of their documents
+
+        Returns:
+        - slice: the positions of the segments to merge, None if there's nothing to merge
+        """
+        levels = [self.level(segment.num_docs) for segment in segments]
+        best = None
+        for start in range(len(segments) - self.merge_factor + 1):
+            window = levels[start:start + self.merge_factor]
+            if min(window) == max(window) and (best is None or window[0] < levels[best]):
+                best = start
+        return None if best is None else slice(best, best + self.merge_factor)
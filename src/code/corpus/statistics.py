@@ -0,0 +1,175 @@
+"""Statistics of the corpus that are used by the models, they are updated when the documents change."""
+import threading
+from typing import List, Tuple
+
+import numpy as np
+
+from .postings import PostingsIndex
+
+
+class CorpusStatistics:
+    """
+    Precomputed statistics of the corpus, the token arrays are indexed by the token id
+    and the document arrays by the ordinal of the document.
+
+    Attributes:
+    - num_docs: the number of documents of the corpus, including the deleted ones
+    - idf: np.array with the inverse document frequency log2(N / ni) of every token
+    - normalized_idf: np.array with the idf of every token divided by the max idf
+    - max_idf: the maximum inverse document frequency of the corpus
+    - max_tf: np.array with the frequency of the most frequent token of every document
+    - doc_norms: np.array with the norm of the tf-idf vector of every document
+    - max_weights: np.array with the max tf-idf weight of every token divided by the norm of the document,
+    that is the upper bound of the contribution of the token to the cosine similarity of any document
+    """
+    # bumped when the statistics change, so the ones saved by an older version are computed again
+    VERSION = 2
+
+    def __init__(self, num_docs: int, idf: np.ndarray, max_tf: np.ndarray, doc_norms: np.ndarray = None,
+                 max_weights: np.ndarray = None, postings=None):
+        """
+        Args:
+        - num_docs, idf, max_tf, doc_norms, max_weights: the statistics
+        - postings: the inverted index of the corpus without the deleted documents, with a parts method like
+        SegmentedPostings. If doc_norms and max_weights aren't given they are computed from it the first time
+        that they are used
+        """
+        self.version = CorpusStatistics.VERSION
+        self.num_docs = num_docs
+        self.idf = idf
+        self.max_idf = float(idf.max()) if len(idf) > 0 else 0
+        self.normalized_idf = idf / self.max_idf if self.max_idf > 0 else np.zeros_like(idf)
+        self.max_tf = max_tf
+        self._doc_norms = doc_norms
+        self._max_weights = max_weights
+        self._postings = postings
+        self._lock = threading.Lock()
+
+    @property
+    def doc_norms(self) -> np.ndarray:
+        if self._doc_norms is None:
+            self._compute_norms()
+        return self._doc_norms
+
+    @property
+    def max_weights(self) -> np.ndarray:
+        if self._doc_norms is None:
+            self._compute_norms()
+        return self._max_weights
+
+    def _compute_norms(self):
+        with self._lock:
+            if self._doc_norms is not None:
+                return
+            max_weights, doc_norms = self.norms(self._postings.parts(), self.idf, self.max_tf)
+            # doc_norms is set last, the readers only check it
+            self._max_weights = max_weights
+            self._doc_norms = doc_norms
+            self._postings = None
+
+    @classmethod
+    def from_frequencies(cls, postings, doc_freqs: np.ndarray, max_tf: np.ndarray,
+                         num_live_docs: int) -> "CorpusStatistics":
+        """
+        Gets the statistics of the corpus from the document frequencies of its tokens, that the corpus keeps
+        up to date as the documents change. The norms of the documents and the max weights of the tokens depend
+        on the weights of all the postings, so they are computed the first time that they are used, once for
+        all the changes made before it.
+
+        Args:
+        - postings: the inverted index of the corpus without the deleted documents, with a parts method like
+        SegmentedPostings
+        - doc_freqs: np.array with the number of live documents that contain every token
+        - max_tf: np.array with the frequency of the most frequent token of every document, 0 for the deleted
+        documents
+        - num_live_docs: the number of documents that aren't deleted
+
+        Returns:
+        - CorpusStatistics: the statistics of the corpus
+        """
+        return cls(len(max_tf), cls.inverse_document_frequencies(doc_freqs, num_live_docs), max_tf,
+                   postings=postings)
+
+    @staticmethod
+    def inverse_document_frequencies(doc_freqs: np.ndarray, num_live_docs: int) -> np.ndarray:
+        """Gets the idf of every token, the tokens that are only in deleted documents have df 0 and idf 0"""
+        return np.log2(np.divide(num_live_docs, doc_freqs, out=np.ones(len(doc_freqs)), where=doc_freqs > 0))
+
+    @classmethod
+    def from_postings(cls, postings: PostingsIndex, num_docs: int, deleted: np.ndarray = None) -> "CorpusStatistics":
+        """
+        Computes the statistics of the corpus from its inverted index
+
+        Args:
+        - postings: the inverted index of the corpus, without the deleted documents
+        - num_docs: the number of documents of the corpus, including the deleted ones
+        - deleted: np.array of bool, True for the ordinals of the deleted documents
+
+        Returns:
+        - CorpusStatistics: the statistics of the corpus
+        """
+        return cls.from_segments([(postings, 0)], num_docs, postings.num_terms, deleted)
+
+    @classmethod
+    def from_segments(cls, parts: List[Tuple[PostingsIndex, int]], num_docs: int, num_terms: int,
+                      deleted: np.ndarray = None) -> "CorpusStatistics":
+        """
+        Computes the statistics of the corpus from the inverted indexes of its segments, without joining them
+
+        Args:
+        - parts: for every segment, its inverted index without the deleted documents and the ordinal of its
+        first document
+        - num_docs: the number of documents of the corpus, including the deleted ones
+        - num_terms: the number of tokens of the corpus
+        - deleted: np.array of bool, True for the ordinals of the deleted documents
+
+        Returns:
+        - CorpusStatistics: the statistics of the corpus
+        """
+        # the deleted documents keep their ordinal, but they don't count for the idf
+        num_live_docs = num_docs if deleted is None else num_docs - int(np.count_nonzero(deleted))
+        dfs = np.zeros(num_terms, dtype=np.int64)
+        for postings, _ in parts:
+            dfs += postings.doc_freqs(num_terms)
+        idf = cls.inverse_document_frequencies(dfs, num_live_docs)
+
+        max_tf = np.zeros(num_docs, dtype=np.int32)
+        for postings, first_doc in parts:
+            np.maximum.at(max_tf, postings.docs + first_doc, postings.freqs)
+        max_weights, doc_norms = cls.norms(parts, idf, max_tf)
+        return cls(num_docs, idf, max_tf, doc_norms, max_weights)
+
+    @staticmethod
+    def norms(parts: List[Tuple[PostingsIndex, int]], idf: np.ndarray,
+              max_tf: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Computes the max weights of the tokens and the norms of the documents, with a few vectorized passes
+        over the postings
+
+        Args:
+        - parts: for every segment, its inverted index without the deleted documents and the ordinal of its
+        first document
+        - idf: np.array with the idf of every token
+        - max_tf: np.array with the frequency of the most frequent token of every document
+
+        Returns:
+        - tuple of np.array: the max weights of the tokens and the norms of the documents
+        """
+        num_docs = len(max_tf)
+        doc_norms = np.zeros(num_docs, dtype=np.float64)
+        max_weights = np.zeros(len(idf), dtype=np.float64)
+        for postings, first_doc in parts:
+            docs = postings.docs + first_doc
+            terms = postings.posting_terms()
+            weights = postings.freqs / max_tf[docs] * idf[terms]
+            doc_norms += np.bincount(docs, weights=weights ** 2, minlength=num_docs)
+        doc_norms = np.sqrt(doc_norms)
+
+        for postings, first_doc in parts:
+            docs = postings.docs + first_doc
+            terms = postings.posting_terms()
+            weights = postings.freqs / max_tf[docs] * idf[terms]
+            norms = doc_norms[docs]
+            contributions = np.divide(weights, norms, out=np.zeros_like(weights), where=norms > 0)
+            np.maximum.at(max_weights, terms, contributions)
+        return max_weights, doc_norms
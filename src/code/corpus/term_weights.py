@@ -0,0 +1,168 @@
+"""
+Cache of the tf-idf weights of the tokens in the documents. The queries that share tokens reuse their weights,
+so scoring a query is combining the cached vectors of its tokens.
+"""
+import threading
+from typing import Dict
+
+import numpy as np
+
+from .statistics import CorpusStatistics
+
+
+class TermWeights:
+    """
+    The tf-idf weights of a token in the documents that contain it. The tokens that appear in a big part of
+    the corpus also keep the weights in a dense vector with a position for every document, so adding them to
+    the scores of all the documents doesn't scatter them.
+
+    Attributes:
+    - docs: np.array with the sorted ordinals of the documents that contain the token
+    - dense: np.array with the weight in every document, 0 if it doesn't contain the token, or None
+    """
+
+    def __init__(self, docs: np.ndarray, weights: np.ndarray, num_docs: int, dense=False):
+        self.docs = docs
+        self._weights = weights
+        self.dense = None
+        if dense:
+            self.dense = np.zeros(num_docs)
+            self.dense[docs] = weights
+            self._weights = None
+
+    @property
+    def weights(self) -> np.ndarray:
+        """The weights in the documents of docs"""
+        return self._weights if self.dense is None else self.dense[self.docs]
+
+    @property
+    def nbytes(self) -> int:
+        return self.docs.nbytes + (self._weights.nbytes if self.dense is None else self.dense.nbytes)
+
+    def add_to(self, scores: np.ndarray, factor: float):
+        """Adds the weights multiplied by factor to the scores of the documents, scores has every ordinal"""
+        if self.dense is not None:
+            # the corpus can have more documents than when the weights were computed, they don't contain the token
+            scores[:len(self.dense)] += self.dense * factor
+        else:
+            scores[self.docs] += self._weights * factor
+
+    def at(self, docs: np.ndarray) -> np.ndarray:
+        """Gets the weights in some documents, 0 in the ones that don't contain the token"""
+        if self.dense is not None:
+            return self.dense[docs]
+        weights = np.zeros(len(docs))
+        if len(self.docs) > 0:
+            positions = np.minimum(np.searchsorted(self.docs, docs), len(self.docs) - 1)
+            found = self.docs[positions] == docs
+            weights[found] = self._weights[positions[found]]
+        return weights
+
+
+class TermWeightCache:
+    """
+    Cache of TermWeights bounded by their size in bytes. Every lookup counts to the popularity of the token,
+    and when there's no room the least popular tokens are evicted. A token is only cached if it's at least as
+    popular as the tokens that it evicts, so the hot tokens stay in the cache and a burst of rare ones doesn't
+    push them out. The popularity is halved every aging_period lookups, so it follows the recent queries.
+    The weights depend on the statistics of the corpus, the cache is emptied when they change.
+
+    Attributes:
+    - max_bytes: the maximum number of bytes of the cached weights
+    - dense_ratio: the tokens that appear in at least this fraction of the documents are kept dense
+    - aging_period: the number of lookups between two halvings of the popularity
+    - popularity: the number of recent lookups of every token
+    - hits, misses: the number of lookups that found and didn't find the token
+    """
+
+    def __init__(self, max_bytes=32 * 1024 * 1024, dense_ratio=0.25, aging_period=10000):
+        self.max_bytes = max_bytes
+        self.dense_ratio = dense_ratio
+        self.aging_period = aging_period
+        self.entries: Dict[int, TermWeights] = {}
+        self.nbytes = 0
+        self.popularity: Dict[int, int] = {}
+        self.hits = 0
+        self.misses = 0
+        self._stats: CorpusStatistics = None
+        self._lookups = 0
+        self._lock = threading.Lock()
+
+    def get(self, ti: int, postings, stats: CorpusStatistics) -> TermWeights:
+        """
+        Gets the weights of a token, they are computed from its postings if it isn't in the cache
+
+        Args:
+        - ti: the id of the token
+        - postings: the inverted index of the corpus
+        - stats: the statistics of the corpus
+
+        Returns:
+        - TermWeights: the weights of the token
+        """
+        with self._lock:
+            self._check_statistics(stats)
+            self._count(ti)
+            entry = self.entries.get(ti)
+            if entry is not None:
+                self.hits += 1
+                return entry
+            self.misses += 1
+
+        docs, freqs = postings.postings(ti)
+        num_docs = len(stats.max_tf)
+        weights = TermWeights(docs, freqs / stats.max_tf[docs] * stats.idf[ti], num_docs,
+                              dense=len(docs) >= self.dense_ratio * num_docs > 0)
+
+        with self._lock:
+            if stats is self._stats and ti not in self.entries and self._make_room(ti, weights.nbytes):
+                self.entries[ti] = weights
+                self.nbytes += weights.nbytes
+        return weights
+
+    def clear(self):
+        with self._lock:
+            self.entries = {}
+            self.nbytes = 0
+
+    def stats(self) -> dict:
+        """Gets the counters and the size of the cache"""
+        with self._lock:
+            return {'entries': len(self.entries), 'bytes': self.nbytes, 'max_bytes': self.max_bytes,
+                    'hits': self.hits, 'misses': self.misses}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _check_statistics(self, stats: CorpusStatistics):
+        # the popularity of the tokens is kept, the same tokens are still hot after the corpus changes
+        if stats is not self._stats:
+            self.entries = {}
+            self.nbytes = 0
+            self._stats = stats
+
+    def _count(self, ti: int):
+        self.popularity[ti] = self.popularity.get(ti, 0) + 1
+        self._lookups += 1
+        if self._lookups >= self.aging_period:
+            self._lookups = 0
+            self.popularity = {tj: count // 2 for tj, count in self.popularity.items() if count > 1}
+
+    def _make_room(self, ti: int, nbytes: int) -> bool:
+        if nbytes > self.max_bytes:
+            return False
+        if self.nbytes + nbytes <= self.max_bytes:
+            return True
+        popularity = self.popularity.get(ti, 0)
+        victims = []
+        freed = 0
+        for tj in sorted(self.entries, key=lambda tj: self.popularity.get(tj, 0)):
+            if self.nbytes - freed + nbytes <= self.max_bytes:
+                break
+            if self.popularity.get(tj, 0) > popularity:
+                return False
+            victims.append(tj)
+            freed += self.entries[tj].nbytes
+        for tj in victims:
+            self.nbytes -= self.entries.pop(tj).nbytes
+        return True
@@ -1,22 +1,31 @@
 from pathlib import Path
+from typing import Iterator
 
 from corpus import Corpus
-from .document import Document
+from .ingestion import RawDocument
+from .segments import MergePolicy
 
 
 class TestCorpus(Corpus):
-    def __init__(self, path: Path, stemming=False, language='english'):
-        super().__init__(corpus_path=path, corpus_type='test', language=language, stemming=stemming)
+    # it isn't a test class, even if pytest collects the classes whose name starts with Test
+    __test__ = False
+
+    def __init__(self, path: Path, stemming=False, language='english', workers: int = None,
+                 merge_policy: MergePolicy = None, flush_size=1000):
+        super().__init__(corpus_path=path, corpus_type='test', language=language, stemming=stemming, workers=workers,
+                         merge_policy=merge_policy, flush_size=flush_size)
 
     def parse_documents(self, path: Path):
-        doc_id = 0
-        for file in path.glob('*.txt'):
-            if not file.is_file():
-                continue
-            with open(file, 'r') as f:
-                text = f.read()
-                tokens = self.preprocess_text(text)
-                if not tokens:
-                    continue
-                doc_id += 1
-                self.documents.append(Document(doc_id=doc_id, doc_tokens=tokens, doc_title=file.stem))
+        super().parse_documents(path)
+        # the documents without tokens are skipped and the rest are numbered in order
+        self.documents = [doc for doc in self.documents if doc.doc_tokens]
+        for doc_id, doc in enumerate(self.documents, start=1):
+            doc.doc_id = doc_id
+
+    def iter_sources(self, path: Path) -> Iterator[Path]:
+        return (file for file in sorted(path.glob('*.txt')) if file.is_file())
+
+    @staticmethod
+    def parse_source(file: Path) -> Iterator[RawDocument]:
+        with open(file, 'r') as f:
+            yield None, file.stem, f.read()
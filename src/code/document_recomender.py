@@ -5,6 +5,7 @@ from typing import Dict
 import numpy as np
 
 from clustering import ClusterManager
+from src.code.instrumentation import metrics
 
 
 class DocumentRecommender:
@@ -77,8 +78,9 @@ class DocumentRecommender:
         - doc_id: the id of the document
         - rating: the rating of the document
         """
-        self.ratings[doc_id] = rating
-        self.save_ratings()
+        with metrics.timer('recommender_update'):
+            self.ratings[doc_id] = rating
+            self.save_ratings()
 
     def add_ratings(self, ratings: Dict[int, int]):
         """
@@ -87,8 +89,9 @@ class DocumentRecommender:
         Args:
         - ratings: the ratings of the documents consisting in: [doc_id, rating]
         """
-        self.ratings.update(ratings)
-        self.save_ratings()
+        with metrics.timer('recommender_update'):
+            self.ratings.update(ratings)
+            self.save_ratings()
 
     def doc_deviation(self, doc_id: int):
         """
@@ -130,7 +133,7 @@ class DocumentRecommender:
         if self.clusterer is not None:
             documents = self.clusterer.get_cluster_samples(doc_id)
         else:
-            documents = [doc_id for doc_id in range(len(self.corpus.documents))]
+            documents = self.corpus.live_docs.tolist()
         rated_documents = [doc_id for doc_id in documents if doc_id in self.ratings]
         num = sum(map(lambda d: self.similarity(doc_id, d) * (self.ratings[d] + self.predictor_baseline(d)), rated_documents))
         den = sum(map(lambda d: self.similarity(doc_id, d), rated_documents))
@@ -149,12 +152,13 @@ class DocumentRecommender:
         Returns:
         - List[int]: the list of the best `k` recommendations
         """
-        doc_ratings = {}
-        for doc_id in range(len(self.corpus.documents)):
-            if doc_id not in self.ratings:
-                predicted_rating = self.expected_rating(doc_id)
-                doc_ratings[doc_id] = predicted_rating
-        return sorted(doc_ratings, key=lambda x: doc_ratings[x])[:k]
+        with metrics.timer('recommendation'):
+            doc_ratings = {}
+            for doc_id in self.corpus.live_docs.tolist():
+                if doc_id not in self.ratings:
+                    predicted_rating = self.expected_rating(doc_id)
+                    doc_ratings[doc_id] = predicted_rating
+            return sorted(doc_ratings, key=lambda x: doc_ratings[x])[:k]
 
     def load_ratings(self):
         try:
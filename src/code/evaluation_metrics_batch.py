@@ -0,0 +1,282 @@
+"""
+Module to implement the evaluation metrics over a batch of runs. The relevance of the retrieved documents of
+all the queries is computed once in a matrix with a row for every query and a column for every rank, and
+every metric is computed for all the queries and cutoffs with array operations over it.
+"""
+from typing import Dict, List, Sequence
+
+import numpy as np
+
+
+class RelevanceMatrix:
+    """
+    Relevance of the documents retrieved for a batch of queries.
+
+    Attributes:
+    - grades: np.array of shape (number of queries, depth) with the relevance grade of the document retrieved
+    at every rank, 0 if it's not relevant or the run has less documents than the rank
+    - lengths: np.array with the number of documents retrieved for every query
+    - num_relevant: np.array with the number of relevant documents of every query
+    - ideal_grades: np.array of shape (number of queries, depth) with the grades of the relevant documents of
+    every query sorted from the highest, the best possible ranking
+    - total_documents: the number of documents of the collection
+    """
+
+    def __init__(self, grades: np.ndarray, lengths: np.ndarray, num_relevant: np.ndarray, ideal_grades: np.ndarray,
+                 total_documents: int):
+        self.grades = grades
+        self.lengths = lengths
+        self.num_relevant = num_relevant
+        self.ideal_grades = ideal_grades
+        self.total_documents = total_documents
+
+    @classmethod
+    def from_runs(cls, runs: Sequence[Sequence], relevant: Sequence[Sequence], total_documents: int,
+                  depth: int = None) -> "RelevanceMatrix":
+        """
+        Builds the matrix of a batch of runs
+
+        Args:
+        - runs: the ids of the documents retrieved for every query, in the order of the ranking
+        - relevant: the relevant documents of every query, in the same order as runs. They are lists of qrels
+        with doc_id and relevance, as returned by get_sorted_relevant_documents_group_by_query, or lists of ids
+        if the relevance isn't graded
+        - total_documents: the number of documents of the collection
+        - depth: the number of ranks of the matrix, the longest run by default
+
+        Returns:
+        - RelevanceMatrix: the matrix of the runs
+        """
+        num_queries = len(runs)
+        lengths = np.array([len(run) for run in runs], dtype=np.int64)
+        depth = int(lengths.max(initial=0)) if depth is None else depth
+        lengths = np.minimum(lengths, depth)
+
+        rel_ids = [[getattr(doc, 'doc_id', doc) for doc in docs] for docs in relevant]
+        rel_grades = np.array([getattr(doc, 'relevance', 1) for docs in relevant for doc in docs], dtype=np.float64)
+        num_relevant = np.array([len(docs) for docs in rel_ids], dtype=np.int64)
+
+        # the ids are mapped to integers together, so the pair (query, document) is a single integer key
+        run_ids = [doc_id for run, length in zip(runs, lengths.tolist()) for doc_id in run[:length]]
+        all_ids = np.array([str(doc_id) for doc_id in run_ids] + [str(doc_id) for ids in rel_ids for doc_id in ids])
+        _, codes = np.unique(all_ids, return_inverse=True)
+        num_codes = int(codes.max(initial=-1)) + 1
+        run_codes, rel_codes = codes[:len(run_ids)], codes[len(run_ids):]
+        run_keys = np.repeat(np.arange(num_queries), lengths) * num_codes + run_codes
+        rel_keys = np.repeat(np.arange(num_queries), num_relevant) * num_codes + rel_codes
+
+        order = np.argsort(rel_keys, kind='stable')
+        rel_keys, sorted_grades = rel_keys[order], rel_grades[order]
+        positions = np.minimum(np.searchsorted(rel_keys, run_keys), max(len(rel_keys) - 1, 0))
+        found = rel_keys[positions] == run_keys if len(rel_keys) > 0 else np.zeros(len(run_keys), dtype=bool)
+
+        grades = np.zeros((num_queries, depth))
+        rows = np.repeat(np.arange(num_queries), lengths)
+        cols = np.arange(len(run_keys)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        grades[rows[found], cols[found]] = sorted_grades[positions[found]]
+
+        ideal_grades = np.zeros((num_queries, depth))
+        rel_rows = np.repeat(np.arange(num_queries), num_relevant)
+        # the grades of every query from the highest, the sort is by query and then by decreasing grade
+        ideal_order = np.lexsort((-rel_grades, rel_rows))
+        rel_cols = np.arange(len(rel_grades)) - np.repeat(np.cumsum(num_relevant) - num_relevant, num_relevant)
+        in_depth = rel_cols < depth
+        ideal_grades[rel_rows[in_depth], rel_cols[in_depth]] = rel_grades[ideal_order][in_depth]
+        return cls(grades, lengths, num_relevant, ideal_grades, total_documents)
+
+    @property
+    def depth(self) -> int:
+        return self.grades.shape[1]
+
+    def cutoff_columns(self, cutoffs: Sequence[int]) -> np.ndarray:
+        # None is the whole run
+        return np.array([self.depth if cutoff is None else min(cutoff, self.depth) for cutoff in cutoffs],
+                        dtype=np.int64)
+
+    def hits(self, cutoffs: Sequence[int]) -> np.ndarray:
+        """Gets the number of relevant documents retrieved in the first ranks, shape (queries, cutoffs)"""
+        cumulative = np.concatenate([np.zeros((len(self.grades), 1)), np.cumsum(self.grades > 0, axis=1)], axis=1)
+        return cumulative[:, self.cutoff_columns(cutoffs)]
+
+    def retrieved(self, cutoffs: Sequence[int]) -> np.ndarray:
+        """Gets the number of documents retrieved in the first ranks, shape (queries, cutoffs)"""
+        return np.minimum(self.lengths[:, None], self.cutoff_columns(cutoffs)[None, :])
+
+
+def _divide(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    a, b = np.broadcast_arrays(np.asarray(a, dtype=np.float64), np.asarray(b, dtype=np.float64))
+    return np.divide(a, b, out=np.zeros(a.shape), where=b > 0)
+
+
+def precision(matrix: RelevanceMatrix, cutoffs: Sequence[int] = (None,)) -> np.ndarray:
+    """
+    Calculate the precision of every query at every cutoff, the proportion of the documents retrieved
+    in the first ranks that are relevant.
+
+    Args:
+      - matrix (RelevanceMatrix): The relevance of the runs.
+      - cutoffs (list): Ranking positions to apply the cutoff, None for the whole run.
+
+    Returns:
+      np.array: Values between 0 and 1, of shape (queries, cutoffs).
+    """
+    return _divide(matrix.hits(cutoffs), matrix.retrieved(cutoffs))
+
+
+def recall(matrix: RelevanceMatrix, cutoffs: Sequence[int] = (None,)) -> np.ndarray:
+    """
+    Calculate the recall of every query at every cutoff, the proportion of the relevant documents that
+    are retrieved in the first ranks.
+
+    Args:
+      - matrix (RelevanceMatrix): The relevance of the runs.
+      - cutoffs (list): Ranking positions to apply the cutoff, None for the whole run.
+
+    Returns:
+      np.array: Values between 0 and 1, of shape (queries, cutoffs).
+    """
+    return _divide(matrix.hits(cutoffs), matrix.num_relevant[:, None])
+
+
+def f_beta(matrix: RelevanceMatrix, beta: float = 1, cutoffs: Sequence[int] = (None,)) -> np.ndarray:
+    """
+    Calculate the f measure of every query at every cutoff, the weighted harmonic mean of precision and recall.
+
+    Args:
+      - matrix (RelevanceMatrix): The relevance of the runs.
+      - beta (double): Weight of the recall measure.
+      - cutoffs (list): Ranking positions to apply the cutoff, None for the whole run.
+
+    Returns:
+      np.array: Values between 0 and 1, of shape (queries, cutoffs).
+    """
+    p = precision(matrix, cutoffs)
+    r = recall(matrix, cutoffs)
+    return _divide((1 + beta ** 2) * p * r, beta ** 2 * p + r)
+
+
+def fallout(matrix: RelevanceMatrix, cutoffs: Sequence[int] = (None,)) -> np.ndarray:
+    """
+    Calculate the fallout of every query at every cutoff, the proportion of the non-relevant documents
+    that are retrieved in the first ranks.
+
+    Args:
+      - matrix (RelevanceMatrix): The relevance of the runs.
+      - cutoffs (list): Ranking positions to apply the cutoff, None for the whole run.
+
+    Returns:
+      np.array: Values between 0 and 1, of shape (queries, cutoffs).
+    """
+    irrelevant = matrix.total_documents - matrix.num_relevant[:, None]
+    return _divide(matrix.retrieved(cutoffs) - matrix.hits(cutoffs), irrelevant)
+
+
+def average_precision(matrix: RelevanceMatrix) -> np.ndarray:
+    """
+    Calculate the average precision of every query, the mean of the precision at the ranks of the relevant
+    documents. The relevant documents that aren't retrieved add a precision of 0.
+
+    Args:
+      - matrix (RelevanceMatrix): The relevance of the runs.
+
+    Returns:
+      np.array: Values between 0 and 1, one for every query.
+    """
+    relevant = matrix.grades > 0
+    precisions = np.cumsum(relevant, axis=1) / np.arange(1, matrix.depth + 1)
+    return _divide((precisions * relevant).sum(axis=1), matrix.num_relevant)
+
+
+def reciprocal_rank(matrix: RelevanceMatrix) -> np.ndarray:
+    """
+    Calculate the reciprocal rank of every query, the inverse of the rank of the first relevant document.
+
+    Args:
+      - matrix (RelevanceMatrix): The relevance of the runs.
+
+    Returns:
+      np.array: Values between 0 and 1, one for every query, 0 if no relevant document is retrieved.
+    """
+    if matrix.depth == 0:
+        # every run is empty
+        return np.zeros(len(matrix.grades))
+    relevant = matrix.grades > 0
+    first = relevant.argmax(axis=1)
+    return np.where(relevant.any(axis=1), 1 / (first + 1), 0.0)
+
+
+def ndcg(matrix: RelevanceMatrix, cutoffs: Sequence[int] = (None,)) -> np.ndarray:
+    """
+    Calculate the normalized discounted cumulative gain of every query at every cutoff. The gain of a document
+    is 2 ** grade - 1, discounted by the logarithm of its rank, and it's divided by the gain of the best ranking.
+
+    Args:
+      - matrix (RelevanceMatrix): The relevance of the runs.
+      - cutoffs (list): Ranking positions to apply the cutoff, None for the whole run.
+
+    Returns:
+      np.array: Values between 0 and 1, of shape (queries, cutoffs).
+    """
+    discounts = 1 / np.log2(np.arange(2, matrix.depth + 2))
+    columns = matrix.cutoff_columns(cutoffs)
+
+    def cumulative_gain(grades):
+        gains = np.cumsum((2 ** grades - 1) * discounts, axis=1)
+        return np.concatenate([np.zeros((len(grades), 1)), gains], axis=1)[:, columns]
+
+    return _divide(cumulative_gain(matrix.grades), cumulative_gain(matrix.ideal_grades))
+
+
+def evaluate(runs: Sequence[Sequence], relevant: Sequence[Sequence], total_documents: int,
+             cutoffs: Sequence[int] = (5, 10, 20, None), beta: float = 1) -> Dict[str, float]:
+    """
+    Calculate the mean of every metric over a batch of runs, at every cutoff
+
+    Args:
+      - runs (list): The ids of the documents retrieved for every query, in the order of the ranking.
+      - relevant (list): The relevant documents of every query, qrels or ids.
+      - total_documents (int): Total number of documents in the collection.
+      - cutoffs (list): Ranking positions to apply the cutoff, None for the whole run.
+      - beta (double): Weight of the recall measure in the f measure.
+
+    Returns:
+      dict: The mean value of every metric, the metrics at a cutoff are named metric@cutoff.
+    """
+    matrix = RelevanceMatrix.from_runs(runs, relevant, total_documents)
+    names = ['' if cutoff is None else f'@{cutoff}' for cutoff in cutoffs]
+    results = {}
+    for metric, values in [('precision', precision(matrix, cutoffs)), ('recall', recall(matrix, cutoffs)),
+                           ('f', f_beta(matrix, beta, cutoffs)), ('fallout', fallout(matrix, cutoffs)),
+                           ('ndcg', ndcg(matrix, cutoffs))]:
+        means = values.mean(axis=0) if len(values) > 0 else np.zeros(len(cutoffs))
+        results.update({f'{metric}{name}': float(mean) for name, mean in zip(names, means)})
+    results['map'] = float(average_precision(matrix).mean()) if len(runs) > 0 else 0.0
+    results['mrr'] = float(reciprocal_rank(matrix).mean()) if len(runs) > 0 else 0.0
+    return results
+
+
+def per_query(runs: Sequence[Sequence], relevant: Sequence[Sequence], total_documents: int,
+              r: int = 5) -> List[Dict[str, float]]:
+    """
+    Calculate the metrics of every query of a batch, the ones of evaluation_metrics for the whole run and
+    for the first r documents, plus the average precision, the reciprocal rank and the nDCG at r.
+
+    Args:
+      - runs (list): The ids of the documents retrieved for every query, in the order of the ranking.
+      - relevant (list): The relevant documents of every query, qrels or ids.
+      - total_documents (int): Total number of documents in the collection.
+      - r (int): Ranking position to apply the cutoff.
+
+    Returns:
+      list of dict: The metrics of every query.
+    """
+    matrix = RelevanceMatrix.from_runs(runs, relevant, total_documents)
+    cutoffs = (None, r)
+    p, rec, f = precision(matrix, cutoffs), recall(matrix, cutoffs), f_beta(matrix, 1, cutoffs)
+    metrics = {
+        'precision': p[:, 0], 'recall': rec[:, 0], 'f1': f[:, 0], 'fallout': fallout(matrix, (None,))[:, 0],
+        'r_precision': p[:, 1], 'r_recall': rec[:, 1], 'average_precision': average_precision(matrix),
+        'reciprocal_rank': reciprocal_rank(matrix), 'ndcg': ndcg(matrix, (r,))[:, 0],
+    }
+    metrics = {name: values.tolist() for name, values in metrics.items()}
+    return [{name: values[i] for name, values in metrics.items()} for i in range(len(runs))]
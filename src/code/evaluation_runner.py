@@ -0,0 +1,291 @@
+"""
+Evaluation of the models over the queries of the cranfield collection. The index is loaded once and the
+queries are run by a pool of processes forked from the one that loaded it, so they share the models and the
+pages of the memory mapped index. It reports the quality metrics and the latency of every model as json.
+With --nprobe it also reports the trade-off between recall and latency of the cluster pruned search of the
+models that support it.
+
+Usage, from src/code:
+
+    python evaluation_runner.py --models vector extended --workers 4 --output report.json
+    python evaluation_runner.py --models vector --nprobe 1 2 3
+"""
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from corpus import Corpus, CranCorpus
+from evaluation_metrics_batch import per_query
+from models import BooleanModel, ExtendedBooleanModel, IRModel, LSAModel, VectorModel
+from utils import get_cran_queries, download_cran_corpus_if_not_exist, get_sorted_relevant_documents_group_by_query
+# the models raise the exception of the package src.code.query
+from src.code.query import InvalidQueryException
+
+MODELS = {
+    'boolean': BooleanModel,
+    'vector': VectorModel,
+    'extended': ExtendedBooleanModel,
+    'lsa': LSAModel,
+}
+
+# the name in the report of the mean of every metric of the queries
+METRICS = {
+    'precision': 'precision',
+    'recall': 'recall',
+    'f1': 'f1',
+    'r_precision': 'r_precision',
+    'r_recall': 'r_recall',
+    'fallout': 'fallout',
+    'average_precision': 'map',
+    'reciprocal_rank': 'mrr',
+    'ndcg': 'ndcg',
+}
+
+# the runner of the evaluation, the processes of the pool get it with the models when they are forked
+_runner: Optional["EvaluationRunner"] = None
+
+
+class EvaluationRunner:
+    """
+    Runs the queries of a test collection with several models and measures their quality and latency.
+
+    Attributes:
+    - corpus: the indexed corpus
+    - models: the models to evaluate by name
+    - queries: list of tuples (query_id, text) with the queries that have relevant documents
+    - relevant_documents: the qrels of the relevant documents of every query, sorted by relevance
+    - workers: the number of processes that run the queries, 1 to run them in this process. The processes are
+    forked, where fork isn't available the queries run in this process
+    - r: the cutoff of the r-precision, the r-recall and the nDCG
+    - nprobes: the numbers of clusters searched in the report of the cluster pruned search, the models with
+    an nprobe attribute are evaluated with every one of them. If None there's no report of the pruning
+    - pruning_k: the number of documents retrieved in the report of the cluster pruned search
+    """
+
+    def __init__(self, corpus: Corpus, models: Dict[str, IRModel], queries, qrels, workers: int = None, r=5,
+                 nprobes: List[int] = None, pruning_k=10):
+        self.corpus = corpus
+        self.models = models
+        doc_set = set(str(doc_id) for doc_id in corpus.doc_ids[corpus.live_docs].tolist())
+        relevant = get_sorted_relevant_documents_group_by_query(queries, qrels, doc_set)
+        self.queries = [(query.query_id, query.text) for query in queries if query.query_id in relevant]
+        self.relevant_documents = relevant
+        self.num_docs = len(doc_set)
+        self.workers = workers or os.cpu_count()
+        self.r = r
+        self.nprobes = nprobes
+        self.pruning_k = pruning_k
+
+    def run(self) -> dict:
+        """
+        Evaluates all the models
+
+        Returns:
+        - dict: the report, with the quality metrics, the latency percentiles and the throughput of every model
+        """
+        # the processes are forked once the runner is set, so all of them have every model
+        global _runner
+        _runner = self
+        pool = None
+        if self.workers > 1 and 'fork' in multiprocessing.get_all_start_methods():
+            pool = multiprocessing.get_context('fork').Pool(self.workers)
+        try:
+            results = {name: self.evaluate(name, pool) for name in self.models}
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+        report = {
+            'corpus': self.corpus.corpus_type,
+            'num_docs': self.num_docs,
+            'num_queries': len(self.queries),
+            'workers': self.workers if pool is not None else 1,
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'models': results,
+        }
+        if self.nprobes is not None:
+            report['pruning'] = {name: self.pruning_tradeoff(name, self.nprobes)
+                                 for name, model in self.models.items() if hasattr(model, 'nprobe')}
+        return report
+
+    def evaluate(self, name: str, pool=None) -> dict:
+        """
+        Runs the queries with a model and measures it
+
+        Args:
+        - name: the name of the model
+        - pool: the pool of processes that run the queries, if None they run in this process
+
+        Returns:
+        - dict: the quality metrics, the latency percentiles in milliseconds and the throughput in queries per second
+        """
+        start = time.perf_counter()
+        runs = self.run_queries(name, pool)
+        elapsed = time.perf_counter() - start
+
+        latencies = [latency for metrics, latency in runs if metrics is not None]
+        return {
+            'evaluated': len(latencies),
+            'failed': len(runs) - len(latencies),
+            'quality': quality_summary([metrics for metrics, _ in runs if metrics is not None]),
+            'latency_ms': latency_summary(latencies),
+            'throughput_qps': len(self.queries) / elapsed if elapsed > 0 else None,
+        }
+
+    def pruning_tradeoff(self, name: str, nprobes: List[int]) -> dict:
+        """
+        Measures the cluster pruned search of a model against its exhaustive search. The queries run in this
+        process, one configuration after the other, so the latencies are comparable.
+
+        Args:
+        - name: the name of a model with an nprobe attribute, None is its exhaustive search
+        - nprobes: the numbers of clusters to search
+
+        Returns:
+        - dict: the latency of the exhaustive search and, for every nprobe, the fraction of the best pruning_k
+        documents of the exhaustive search that are retrieved, the quality metrics, the latency and the speedup
+        """
+        model = self.models[name]
+        original = model.nprobe
+        try:
+            model.nprobe = None
+            exhaustive, exhaustive_latencies = self._timed_runs(model)
+            report = {'exhaustive': {'latency_ms': latency_summary(exhaustive_latencies),
+                                     'quality': self._run_quality(exhaustive)}}
+            for nprobe in nprobes:
+                model.nprobe = nprobe
+                pruned, latencies = self._timed_runs(model)
+                overlaps = [len(set(run) & set(reference)) / len(reference)
+                            for run, reference in zip(pruned, exhaustive)
+                            if run is not None and reference is not None and len(reference) > 0]
+                report[f'nprobe={nprobe}'] = {
+                    'recall_of_exhaustive': float(np.mean(overlaps)) if len(overlaps) > 0 else None,
+                    'quality': self._run_quality(pruned),
+                    'latency_ms': latency_summary(latencies),
+                    'speedup': float(np.mean(exhaustive_latencies) / np.mean(latencies)) if latencies else None,
+                }
+        finally:
+            model.nprobe = original
+        return report
+
+    def _timed_runs(self, model: IRModel) -> Tuple[List[Optional[List[str]]], List[float]]:
+        runs = []
+        latencies = []
+        for _, text in self.queries:
+            start = time.perf_counter()
+            try:
+                result = model.search(text, self.pruning_k)
+            except InvalidQueryException:
+                runs.append(None)
+                continue
+            latencies.append(time.perf_counter() - start)
+            runs.append([str(doc_id) for doc_id in result.doc_ids])
+        return runs, latencies
+
+    def _run_quality(self, runs: List[Optional[List[str]]]) -> dict:
+        valid = [(query_id, run) for (query_id, _), run in zip(self.queries, runs) if run is not None]
+        return quality_summary(self.measure([query_id for query_id, _ in valid], [run for _, run in valid]))
+
+    def run_queries(self, name: str, pool=None) -> List[Tuple[Optional[Dict[str, float]], float]]:
+        """
+        Runs the queries with a model. The queries are run in chunks and the metrics of a chunk are computed
+        together where it runs, so the processes only send back a few numbers instead of the rankings.
+
+        Args:
+        - name: the name of the model
+        - pool: the pool of processes that run the queries, if None they run in this process
+
+        Returns:
+        - list with the quality metrics and the seconds spent for every query,
+        the metrics are None if the query is not valid for the model
+        """
+        workers = self.workers if pool is not None else 1
+        chunk_size = max(1, math.ceil(len(self.queries) / (workers * 4)))
+        tasks = [(name, self.queries[start:start + chunk_size]) for start in range(0, len(self.queries), chunk_size)]
+        chunks = map(_run_queries, tasks) if pool is None else pool.imap(_run_queries, tasks)
+        return [run for chunk in chunks for run in chunk]
+
+    def measure(self, query_ids: List[str], runs: List[List[str]]) -> List[Dict[str, float]]:
+        """
+        Computes the quality metrics of the documents retrieved for some queries, an empty run is a valid run
+        that retrieved nothing
+        """
+        if len(query_ids) == 0:
+            return []
+        relevant = [self.relevant_documents[query_id] for query_id in query_ids]
+        return per_query(runs, relevant, self.num_docs, self.r)
+
+
+def _run_queries(task: Tuple[str, List[Tuple[str, str]]]) -> List[Tuple[Optional[Dict[str, float]], float]]:
+    name, queries = task
+    model = _runner.models[name]
+    runs = []
+    for query_id, text in queries:
+        start = time.perf_counter()
+        try:
+            result = model.search(text)
+        except InvalidQueryException:
+            runs.append((query_id, None, time.perf_counter() - start))
+            continue
+        runs.append((query_id, [str(doc_id) for doc_id in result.doc_ids], time.perf_counter() - start))
+
+    valid = [(query_id, retrieved) for query_id, retrieved, _ in runs if retrieved is not None]
+    metrics = iter(_runner.measure([query_id for query_id, _ in valid], [retrieved for _, retrieved in valid]))
+    return [(next(metrics) if retrieved is not None else None, latency) for _, retrieved, latency in runs]
+
+
+def quality_summary(metrics: List[Dict[str, float]]) -> dict:
+    """Gets the mean of every quality metric of the queries, with the names of the report"""
+    return {METRICS[metric]: float(np.mean([values[metric] for values in metrics])) if len(metrics) > 0 else None
+            for metric in METRICS}
+
+
+def latency_summary(latencies: List[float]) -> dict:
+    """
+    Summarizes the latencies of the queries
+
+    Args:
+    - latencies: the seconds spent by every query
+
+    Returns:
+    - dict: the mean, the percentiles 50, 95 and 99 and the max, in milliseconds
+    """
+    if len(latencies) == 0:
+        return {'mean': None, 'p50': None, 'p95': None, 'p99': None, 'max': None}
+    latencies = np.array(latencies) * 1000
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]).tolist()
+    return {'mean': float(latencies.mean()), 'p50': p50, 'p95': p95, 'p99': p99, 'max': float(latencies.max())}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Evaluates the models over the cranfield queries')
+    parser.add_argument('--models', nargs='+', choices=list(MODELS), default=list(MODELS))
+    parser.add_argument('--workers', type=int, default=None, help='processes that run the queries')
+    parser.add_argument('-r', type=int, default=5, help='cutoff of the r-precision and the r-recall')
+    parser.add_argument('--output', type=Path, default=None, help='file for the json report')
+    parser.add_argument('--nprobe', type=int, nargs='+', default=None,
+                        help='numbers of clusters of the report of the cluster pruned search')
+    parser.add_argument('--pruning-k', type=int, default=10, help='documents retrieved in the pruning report')
+    args = parser.parse_args()
+
+    download_cran_corpus_if_not_exist()
+    corpus = CranCorpus(Path('../../data/corpus/cranfield'), language='english', stemming=True)
+    models = {name: MODELS[name](corpus) for name in args.models}
+    queries, qrels = get_cran_queries()
+    report = EvaluationRunner(corpus, models, queries, qrels, workers=args.workers, r=args.r,
+                              nprobes=args.nprobe, pruning_k=args.pruning_k).run()
+
+    if args.output is not None:
+        args.output.write_text(json.dumps(report, indent=2))
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
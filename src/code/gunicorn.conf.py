@@ -0,0 +1,13 @@
+"""Configuration of gunicorn for the search service, run it from src/code with `gunicorn -c gunicorn.conf.py`"""
+import multiprocessing
+import os
+
+wsgi_app = 'client:create_app()'
+bind = os.environ.get('SEARCH_BIND', '0.0.0.0:8080')
+workers = int(os.environ.get('SEARCH_WORKERS', multiprocessing.cpu_count()))
+# the requests of a worker share its models, the numpy operations release the gil
+worker_class = 'gthread'
+threads = int(os.environ.get('SEARCH_THREADS', 4))
+# the app is loaded before forking the workers, so they share the corpus and the pages of the memory mapped index
+preload_app = True
+timeout = 60
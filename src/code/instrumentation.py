@@ -0,0 +1,263 @@
+"""
+Instrumentation of the hot paths. The stages of a query are timed with `metrics.timer(stage)` and aggregated
+in histograms, the events are counted with `metrics.increment(name)`, and everything is exposed in the text
+format of Prometheus. It's disabled by default and then a timer is a shared object that does nothing, so the
+instrumented code only pays a method call.
+
+The stages nest, the time of a stage includes the time of the stages timed inside it: for example 'search'
+includes 'analysis' and 'scoring', and 'scoring' includes 'sorting'. So the durations of the stages of a query
+don't add up to the duration of the query.
+
+Import it always as src.code.instrumentation, so there's a single registry in the process.
+"""
+import bisect
+import cProfile
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+# upper bounds of the buckets of the histograms, in seconds
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Histogram:
+    """
+    Histogram of durations with fixed buckets.
+
+    Attributes:
+    - counts: the number of observations of every bucket, the last one is for the values over all the bounds
+    - total: the sum of the observations
+    - count: the number of observations
+    """
+
+    def __init__(self, buckets: Tuple[float, ...] = BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def cumulative_counts(self) -> List[int]:
+        counts = []
+        accumulated = 0
+        for count in self.counts:
+            accumulated += count
+            counts.append(accumulated)
+        return counts
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _Timer:
+    __slots__ = ('instrumentation', 'stage', 'start')
+
+    def __init__(self, instrumentation: "Instrumentation", stage: str):
+        self.instrumentation = instrumentation
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.instrumentation.observe(self.stage, time.perf_counter() - self.start)
+        return False
+
+
+class _Profile:
+    __slots__ = ('instrumentation', 'hook', 'profile', 'enabled')
+
+    def __init__(self, instrumentation: "Instrumentation", hook: Callable[[cProfile.Profile], None]):
+        self.instrumentation = instrumentation
+        self.hook = hook
+        self.profile = cProfile.Profile()
+        self.enabled = False
+
+    def __enter__(self):
+        try:
+            self.profile.enable()
+            self.enabled = True
+        except ValueError:
+            # another profiler is active in the process, like one started by the user, the block isn't profiled
+            pass
+        return self
+
+    def __exit__(self, *exc):
+        try:
+            if self.enabled:
+                self.profile.disable()
+                self.hook(self.profile)
+        finally:
+            with self.instrumentation._lock:
+                self.instrumentation._profiling = False
+        return False
+
+
+class Instrumentation:
+    """
+    Registry of the histograms of the stages and the counters of the events.
+
+    Attributes:
+    - enabled: if False the timers and the counters do nothing, unless a trace is active in the thread
+    - stages: the histogram of the durations of every stage
+    - counters: the value of every counter
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.stages: Dict[str, Histogram] = {}
+        self.counters: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._active_traces = 0
+        self._profile_every = 0
+        self._profile_hook: Optional[Callable[[cProfile.Profile], None]] = None
+        self._profiled_calls = 0
+        self._profiling = False
+
+    def timer(self, stage: str):
+        """
+        Gets a context manager that times its block as a stage. The stages timed inside the block are
+        recorded too, so the duration of the stage includes theirs.
+
+        Args:
+        - stage: the name of the stage
+
+        Returns:
+        - the context manager
+        """
+        if not self.enabled and self._active_traces == 0:
+            return _NULL_TIMER
+        return _Timer(self, stage)
+
+    def observe(self, stage: str, seconds: float):
+        """Adds a duration of a stage to its histogram and to the trace of the thread if there's one"""
+        trace = getattr(self._local, 'trace', None)
+        if trace is not None:
+            trace.append((stage, seconds))
+        if not self.enabled:
+            return
+        with self._lock:
+            histogram = self.stages.get(stage)
+            if histogram is None:
+                histogram = self.stages[stage] = Histogram()
+            histogram.observe(seconds)
+
+    def increment(self, name: str, value: float = 1):
+        """Adds a value to a counter"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def trace(self) -> "_Trace":
+        """
+        Gets a context manager that records the stages of its block in the current thread, even if the
+        instrumentation is disabled. It returns the list of tuples (stage, seconds) in the order they ended.
+        """
+        return _Trace(self)
+
+    def set_profiler(self, every: int, hook: Callable[[cProfile.Profile], None] = None):
+        """
+        Profiles one of every `every` profiled blocks with cProfile and passes the profile to the hook
+
+        Args:
+        - every: the sampling period, 0 to stop profiling
+        - hook: the function that gets the profile of the sampled blocks
+        """
+        self._profile_every = every
+        self._profile_hook = hook
+        self._profiled_calls = 0
+
+    def profile(self):
+        """
+        Gets a context manager that profiles its block if it's sampled. Only a block is profiled at a time,
+        cProfile can't profile several threads at once, so the blocks sampled while there's a profile
+        running aren't profiled.
+        """
+        hook = self._profile_hook
+        if self._profile_every <= 0 or hook is None:
+            return _NULL_TIMER
+        with self._lock:
+            self._profiled_calls += 1
+            if self._profiled_calls % self._profile_every != 0 or self._profiling:
+                return _NULL_TIMER
+            self._profiling = True
+        return _Profile(self, hook)
+
+    def reset(self):
+        with self._lock:
+            self.stages = {}
+            self.counters = {}
+
+    def render_prometheus(self, gauges: Dict[str, float] = None, prefix='ir') -> str:
+        """
+        Renders the metrics in the text format of Prometheus
+
+        Args:
+        - gauges: values measured by the caller when the metrics are rendered, like the sizes of the caches
+        - prefix: the prefix of the names of the metrics
+
+        Returns:
+        - str: the metrics
+        """
+        with self._lock:
+            stages = {stage: (histogram.buckets, histogram.cumulative_counts(), histogram.total, histogram.count)
+                      for stage, histogram in self.stages.items()}
+            counters = dict(self.counters)
+
+        lines = [f'# HELP {prefix}_stage_duration_seconds Duration of the stages of the queries, '
+                 f'including the stages nested in them',
+                 f'# TYPE {prefix}_stage_duration_seconds histogram']
+        for stage, (buckets, counts, total, count) in sorted(stages.items()):
+            for bound, accumulated in zip(list(buckets) + ['+Inf'], counts):
+                lines.append(f'{prefix}_stage_duration_seconds_bucket{{stage="{stage}",le="{bound}"}} {accumulated}')
+            lines.append(f'{prefix}_stage_duration_seconds_sum{{stage="{stage}"}} {total}')
+            lines.append(f'{prefix}_stage_duration_seconds_count{{stage="{stage}"}} {count}')
+        for name, value in sorted(counters.items()):
+            lines.append(f'# TYPE {prefix}_{name}_total counter')
+            lines.append(f'{prefix}_{name}_total {value}')
+        for name, value in sorted((gauges or {}).items()):
+            lines.append(f'# TYPE {prefix}_{name} gauge')
+            lines.append(f'{prefix}_{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+class _Trace:
+    def __init__(self, instrumentation: Instrumentation):
+        self.instrumentation = instrumentation
+        self.spans: List[Tuple[str, float]] = []
+        self._previous = None
+
+    def __enter__(self) -> List[Tuple[str, float]]:
+        local = self.instrumentation._local
+        self._previous = getattr(local, 'trace', None)
+        local.trace = self.spans
+        with self.instrumentation._lock:
+            self.instrumentation._active_traces += 1
+        return self.spans
+
+    def __exit__(self, *exc):
+        self.instrumentation._local.trace = self._previous
+        with self.instrumentation._lock:
+            self.instrumentation._active_traces -= 1
+        return False
+
+
+# the registry of the process
+metrics = Instrumentation()
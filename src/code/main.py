@@ -1,20 +1,20 @@
 from pathlib import Path
 
 from corpus import CranCorpus
-from models import ExtendedBooleanModel, IRModel
+from models import ExtendedBooleanModel, IRModel, QueryResultCache
 from utils import download_cran_corpus_if_not_exist
 from query import InvalidQueryException
 
 
 def response_query(query: str, model: IRModel):
-    docs = model.query(query)
-    print('First 30 results for the query:')
-    for doc in docs[:30]:
+    # the documents are ranked once, the same result is shown and used for the feedback
+    result = model.search(query, k=30)
+    print(f'First 30 results for the query ({result.elapsed * 1000:.1f} ms):')
+    for doc in result.documents:
         print(doc)
     print("Doing pseudo-feedback")
-    similarity = model.ranking_function(query)
     # save the first 5 relevant documents as rated by the user if not feedback is received
-    model.pseudo_feedback(query, similarity, 5)
+    model.pseudo_feedback(query, result.ranking, 5)
     print('Getting recommended documents for you, based on your searches and likes:')
     docs = model.get_recommended_documents()
     for doc in docs:
@@ -34,6 +34,7 @@ def terminal_main():
     print('Corpus Built')
 
     extended_boolean_model = ExtendedBooleanModel(corpus)
+    extended_boolean_model.result_cache = QueryResultCache()
 
     while True:
         print()
@@ -42,7 +43,7 @@ def terminal_main():
         try:
             response_query(query, extended_boolean_model)
         except InvalidQueryException:
-            print("Your query contains invalid tokens for our sympyfy function :(")
+            print("Your query is not a valid boolean query :(")
             continue
         except:
             print("Something went wrong :(")
@@ -50,7 +51,8 @@ def terminal_main():
 
 
 def web_main():
-    raise NotImplementedError()
+    from client import create_app
+    create_app().run(host='0.0.0.0', port=8080, threaded=True)
 
 
 if __name__ == '__main__':
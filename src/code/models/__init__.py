@@ -1,5 +1,9 @@
 from .boolean_model import BooleanModel
 from .extended_boolean_model import ExtendedBooleanModel
 from .model import IRModel
+from .query_cache import QueryResultCache
+from .search_result import SearchResult
 from .vector_model import VectorModel
-from .latent_semantic_analysis import latent_query
+from .latent_semantic_analysis import LSAModel, latent_query
+from .embedding_store import EmbeddingStore, IVFIndex
+from .semantic_transformer_model import DenseRetrievalModel, Encoder, HashingEncoder, SentenceTransformerEncoder
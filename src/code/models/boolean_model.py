@@ -1,7 +1,8 @@
-from typing import Tuple, List, Dict
+from functools import lru_cache
+from typing import Tuple, List
 
 from src.code.corpus import Corpus, Document
-from src.code.query import BooleanQueryProcessor
+from src.code.query import BooleanQueryProcessor, BooleanQueryPlan
 from .model import IRModel
 
 
@@ -11,26 +12,39 @@ class BooleanModel(IRModel):
         stemming = self.corpus.stemmer is not None
         language = self.corpus.language
         self.query_processor = BooleanQueryProcessor(language=language, stemming=stemming)
-
-    def query(self, query: str) -> List[Document]:
-        doc_ranking = self.ranking_function(query)
-        docs = self.get_similarity_docs(doc_ranking)
-        return docs
-
-    def ranking_function(self, query: str) -> List[Tuple[int, float]]:
-        # transforms the query into a DNF and use the substitution method to get the ranking
-        dnf_query = self.query_processor.query_to_dnf(query)
-        tokens = self.query_processor.parse(query, self.query_processor.stopwords)
-        ranking = []
-        for i, doc in enumerate(self.corpus.documents):
-            vector: Dict = {}
-
-            for ti in tokens:
-                vector[ti] = self.corpus.get_token_frequency(ti, i) > 0
-
-            sim = dnf_query.subs(vector)
-
-            if sim:
-                ranking.append((doc.doc_id, 1))
-        ranking.sort(key=lambda x: x[1], reverse=True)
-        return ranking
+        self.compile_normalized_query = lru_cache(maxsize=1024)(self._compile_normalized_query)
+
+    def query(self, query: str, k: int = None, offset: int = 0) -> List[Document]:
+        return self.search(query, k, offset).documents
+
+    def ranking_function(self, query: str, k: int = None) -> List[Tuple[int, float]]:
+        return self.analyzed_ranking(self.analyze_query(query), k)
+
+    def analyze_query(self, query: str) -> str:
+        return self.query_processor.normalize_query(query)
+
+    def analyzed_ranking(self, normalized_query: str, k: int = None) -> List[Tuple[int, float]]:
+        # transforms the query into a DNF and evaluates it with set operations over the postings
+        plan = self.compile_normalized_query(normalized_query, self.corpus.index_version)
+        docs = plan.execute(self.corpus)
+        if k is not None:
+            # every match has the same similarity, so the first k matches are the best k
+            docs = docs[:k]
+        return [(doc_id, 1) for doc_id in self.corpus.doc_ids[docs].tolist()]
+
+    def compile_query(self, query: str) -> BooleanQueryPlan:
+        """
+        Builds the execution plan of a query, the plans of the last normalized queries are cached.
+
+        Args:
+        - query: the query of the user
+
+        Returns:
+        - BooleanQueryPlan: the plan to evaluate the query over the postings
+        """
+        return self.compile_normalized_query(self.analyze_query(query), self.corpus.index_version)
+
+    def _compile_normalized_query(self, normalized_query: str, index_version: int) -> BooleanQueryPlan:
+        # the version of the index is part of the key of the cache, the plans depend on the tokens of the corpus
+        clauses = self.query_processor.get_query_clauses(normalized_query)
+        return BooleanQueryPlan.compile(clauses, self.corpus)
@@ -0,0 +1,242 @@
+"""
+Storage and search of the embeddings of the documents for the dense retrieval. The embeddings are normalized
+and quantized to float16, or to int8 with a scale per vector, and they are memory mapped from the indexed
+corpus. They are searched exactly with blocked matrix products, or approximately with an inverted file index
+(IVF) that only scores the documents of the clusters nearest to the query.
+"""
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+import numpy as np
+from sklearn.cluster import KMeans
+
+DTYPES = ('float32', 'float16', 'int8')
+# the float32 value of every float16, numpy converts them one by one with branches that are slow when the
+# zeros and the other values are mixed, as in the embeddings, while a lookup in the table has a fixed cost
+_FLOAT16_TABLE = np.arange(2 ** 16, dtype=np.uint32).astype(np.uint16).view(np.float16).astype(np.float32)
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    """Divides the rows of a matrix by their norms, the rows of zeros are kept"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms > 0)
+
+
+def chunks(items: Iterable, size: int) -> Iterator[List]:
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if len(chunk) > 0:
+        yield chunk
+
+
+class EmbeddingStore:
+    """
+    Matrix of quantized embeddings, a row for every document ordinal.
+
+    Attributes:
+    - vectors: matrix of shape (number of vectors, dimension) with the quantized vectors
+    - scales: the scale of every vector, its value is the int8 code times its scale (only for int8)
+    - dtype: 'float32', 'float16' or 'int8'
+    """
+
+    def __init__(self, vectors: np.ndarray, scales: np.ndarray = None):
+        self.vectors = vectors
+        self.dtype = vectors.dtype.name
+        if self.dtype not in DTYPES:
+            raise ValueError(f'Unknown dtype {self.dtype}')
+        self.scales = scales
+
+    @classmethod
+    def empty(cls, dimension: int, dtype='float16') -> "EmbeddingStore":
+        if dtype not in DTYPES:
+            raise ValueError(f'Unknown dtype {dtype}')
+        scales = np.zeros(0, dtype=np.float32) if dtype == 'int8' else None
+        return cls(np.zeros((0, dimension), dtype=dtype), scales)
+
+    @classmethod
+    def build(cls, encode, texts: Iterable[str], num_texts: int, dimension: int, dtype='float16',
+              chunk_size=256) -> "EmbeddingStore":
+        """
+        Encodes texts in chunks, every chunk is quantized into the preallocated matrix as soon as it's encoded,
+        so only the quantized embeddings of all the texts are in memory
+
+        Args:
+        - encode: function that gets the embeddings of a list of texts as a float matrix
+        - texts: the texts, a row of the store for every one
+        - num_texts: the number of texts
+        - dimension: the dimension of the embeddings
+        - dtype: the type of the quantized vectors
+        - chunk_size: the number of texts encoded at once
+
+        Returns:
+        - EmbeddingStore: the embeddings of the texts
+        """
+        store = cls.empty(dimension, dtype)
+        store.vectors = np.zeros((num_texts, dimension), dtype=dtype)
+        if store.scales is not None:
+            store.scales = np.zeros(num_texts, dtype=np.float32)
+        start = 0
+        for chunk in chunks(texts, chunk_size):
+            codes, scales = store.quantize(encode(chunk))
+            store.vectors[start:start + len(chunk)] = codes
+            if scales is not None:
+                store.scales[start:start + len(chunk)] = scales
+            start += len(chunk)
+        return store
+
+    def quantize(self, vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Normalizes and quantizes vectors to the type of the store
+
+        Args:
+        - vectors: matrix with a vector in every row
+
+        Returns:
+        - tuple: the quantized vectors and their scales, the scales are None if the type isn't int8
+        """
+        vectors = normalize(vectors)
+        if self.dtype != 'int8':
+            return vectors.astype(self.dtype), None
+        scales = np.abs(vectors).max(axis=1) / 127
+        codes = np.divide(vectors, scales[:, None], out=np.zeros_like(vectors), where=scales[:, None] > 0)
+        return np.rint(codes).astype(np.int8), scales.astype(np.float32)
+
+    def append(self, vectors: np.ndarray) -> "EmbeddingStore":
+        """
+        Gets a new store with vectors added at the end, in memory. This store doesn't change, so the readers
+        that have it never see the vectors without their scales.
+        """
+        codes, scales = self.quantize(vectors)
+        return EmbeddingStore(np.concatenate([self.vectors, codes]),
+                              None if scales is None else np.concatenate([self.scales, scales]))
+
+    def dequantize(self, rows=None) -> np.ndarray:
+        """Gets vectors of the store as float32, rows can be an array of positions or a slice"""
+        vectors = self.vectors if rows is None else self.vectors[rows]
+        if self.dtype == 'float16':
+            vectors = _FLOAT16_TABLE.take(vectors.view(np.uint16))
+        else:
+            vectors = vectors.astype(np.float32)
+        if self.scales is not None:
+            vectors *= (self.scales if rows is None else self.scales[rows])[:, None]
+        return vectors
+
+    def scores(self, queries: np.ndarray, rows: np.ndarray = None, block_size=65536) -> np.ndarray:
+        """
+        Computes the dot products between queries and vectors of the store. The vectors are converted to
+        float32 in blocks, so the store is never copied whole.
+
+        Args:
+        - queries: matrix of shape (number of queries, dimension) with the normalized queries
+        - rows: the positions of the vectors, all of them if None
+        - block_size: the number of vectors converted at once
+
+        Returns:
+        - np.array: matrix of shape (number of queries, number of rows) with the dot products
+        """
+        num_rows = len(self.vectors) if rows is None else len(rows)
+        scores = np.zeros((len(queries), num_rows), dtype=np.float32)
+        queries = np.asarray(queries, dtype=np.float32)
+        for start in range(0, num_rows, block_size):
+            block = slice(start, start + block_size)
+            vectors = self.dequantize(block if rows is None else rows[block])
+            scores[:, block] = queries @ vectors.T
+        return scores
+
+    def sections(self) -> Dict[str, np.ndarray]:
+        sections = {'vectors': self.vectors.ravel()}
+        if self.scales is not None:
+            sections['scales'] = self.scales
+        return sections
+
+    @classmethod
+    def from_sections(cls, sections: Dict[str, np.ndarray], num_vectors: int, dimension: int) -> "EmbeddingStore":
+        return cls(sections['vectors'].reshape(num_vectors, dimension), sections.get('scales'))
+
+    def __len__(self):
+        return len(self.vectors)
+
+    @property
+    def nbytes(self) -> int:
+        return self.vectors.nbytes + (0 if self.scales is None else self.scales.nbytes)
+
+
+class IVFIndex:
+    """
+    Inverted file index over an embedding store. The vectors are clustered with k-means and every cluster
+    keeps the positions of its vectors, a query only scores the vectors of the nprobe clusters whose
+    centroids are the most similar to it.
+
+    Attributes:
+    - centroids: matrix of shape (number of lists, dimension) with the normalized centroids
+    - list_offsets: the positions of the vectors of the list i are list_rows[list_offsets[i]:list_offsets[i + 1]]
+    - list_rows: the positions of the vectors in the store, grouped by list
+    - num_indexed: the number of vectors of the store when the index was trained, the next ones aren't indexed
+    """
+
+    def __init__(self, centroids: np.ndarray, list_offsets: np.ndarray, list_rows: np.ndarray):
+        self.centroids = centroids
+        self.list_offsets = list_offsets
+        self.list_rows = list_rows
+        self.num_indexed = len(list_rows)
+
+    @classmethod
+    def train(cls, store: EmbeddingStore, n_lists: int, sample_size=50000, random_state=42,
+              block_size=65536) -> "IVFIndex":
+        """
+        Clusters the vectors of a store
+
+        Args:
+        - store: the embeddings
+        - n_lists: the number of clusters
+        - sample_size: the maximum number of vectors used to find the centroids
+        - random_state: the seed of the sample and of k-means
+
+        Returns:
+        - IVFIndex: the index of the vectors of the store
+        """
+        rng = np.random.default_rng(random_state)
+        sample = np.arange(len(store))
+        if len(sample) > sample_size:
+            sample = np.sort(rng.choice(len(store), sample_size, replace=False))
+        kmeans = KMeans(n_clusters=n_lists, n_init=1, random_state=random_state)
+        kmeans.fit(store.dequantize(sample))
+        centroids = normalize(kmeans.cluster_centers_)
+
+        # the vectors are normalized, so the nearest centroid is the one with the highest dot product
+        assignments = np.zeros(len(store), dtype=np.int64)
+        for start in range(0, len(store), block_size):
+            block = np.arange(start, min(start + block_size, len(store)))
+            assignments[block] = np.argmax(store.scores(centroids, block), axis=0)
+        list_rows = np.argsort(assignments, kind='stable').astype(np.int64)
+        list_offsets = np.zeros(n_lists + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assignments, minlength=n_lists), out=list_offsets[1:])
+        return cls(centroids, list_offsets, list_rows)
+
+    def candidates(self, query: np.ndarray, nprobe: int) -> np.ndarray:
+        """
+        Gets the positions of the vectors of the lists nearest to a query
+
+        Args:
+        - query: the normalized query
+        - nprobe: the number of lists to search
+
+        Returns:
+        - np.array: the sorted positions of the vectors of the lists
+        """
+        centroid_scores = self.centroids @ query
+        nprobe = min(nprobe, len(self.centroids))
+        probes = np.argpartition(centroid_scores, -nprobe)[-nprobe:]
+        rows = [self.list_rows[self.list_offsets[i]:self.list_offsets[i + 1]] for i in probes]
+        return np.sort(np.concatenate(rows))
+
+    def sections(self) -> Dict[str, np.ndarray]:
+        return {'centroids': self.centroids.ravel(), 'list_offsets': self.list_offsets, 'list_rows': self.list_rows}
+
+    @classmethod
+    def from_sections(cls, sections: Dict[str, np.ndarray], dimension: int) -> "IVFIndex":
+        return cls(sections['centroids'].reshape(-1, dimension), sections['list_offsets'], sections['list_rows'])
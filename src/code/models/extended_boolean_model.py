@@ -1,9 +1,10 @@
-import math
+from functools import lru_cache
 from typing import Tuple, List
 
+import numpy as np
+
 from src.code.corpus import Corpus, Document
-from src.code.query import BooleanQueryProcessor
-from src.code.utils import tf, normalized_idf
+from src.code.query import BooleanQueryProcessor, PNormQueryPlan
 from .model import IRModel
 
 
@@ -14,113 +15,79 @@ class ExtendedBooleanModel(IRModel):
         language = self.corpus.language
         self.query_processor = BooleanQueryProcessor(language=language, stemming=stemming)
         self.a = 0.4  # 0.5
+        self.compile_normalized_query = lru_cache(maxsize=1024)(self._compile_normalized_query)
 
-    def query(self, query: str) -> List[Document]:
-        doc_ranking = self.ranking_function(query)
-        docs = self.get_similarity_docs(doc_ranking)
+    def query(self, query: str, k: int = None, offset: int = 0) -> List[Document]:
+        docs = self.search(query, k, offset).documents
 
         # The most similar doc to the query is saved as relevant to the user for the document recommender
-        if len(docs) > 0:
+        if offset == 0 and len(docs) > 0:
             self.document_recommender.add_rating(docs[0].doc_id, 1)
 
         return docs
 
-    def ranking_function(self, query: str) -> List[Tuple[int, float]]:
-        dnf_query = self.query_processor.query_to_dnf(query)
-        string_dnf_query = str(dnf_query)
-        ranking = []
-        for i, doc in enumerate(self.corpus.documents):
-            sim = self.get_dnf_weight(string_dnf_query, i)
-            if sim > 0:
-                ranking.append((doc.doc_id, sim))
-        ranking.sort(key=lambda x: x[1], reverse=True)
-        return ranking
-
-    def get_dnf_weight(self, dnf: str, doc_id: int) -> float:
+    def ranking_function(self, query: str, k: int = None) -> List[Tuple[int, float]]:
+        return self.analyzed_ranking(self.analyze_query(query), k)
+
+    def analyze_query(self, query: str) -> str:
+        return self.query_processor.normalize_query(query)
+
+    def analyzed_ranking(self, normalized_query: str, k: int = None) -> List[Tuple[int, float]]:
+        plan = self.compile_normalized_query(normalized_query, self.corpus.index_version)
+        candidates = self.get_candidate_docs(plan)
+        weights = plan.weights(self.get_term_weights(plan, candidates))
+        doc_ids = self.corpus.doc_ids[candidates].tolist()
+        ranking = [(doc_id, sim) for doc_id, sim in zip(doc_ids, weights.tolist()) if sim > 0]
+        return self.top_k(ranking, k)
+
+    def compile_query(self, query: str) -> PNormQueryPlan:
         """
-        Returns the weight of the disjunctive normal form query for a document,
-        in the extended boolean model the or components are calculated with the formula
-        sqrt(sum(wi^2) / n) where wi is the weight of the conjunctive component and n is the number
-        of conjunctive components
+        Builds the plan of a query with its DNF as arrays, the plans of the last normalized queries are cached.
 
         Args:
-        - dnf (str): the disjunctive normal form query
-        - doc_id (int): the id of the document
+        - query: the query of the user
+
+        Returns:
+        - PNormQueryPlan: the plan to compute the weight of the query for the documents
         """
-        conjunctive_components = dnf.split(' | ')
-        current_is_negated = False
-        weight_dnf = 0
-
-        for cc in conjunctive_components:
-            if cc[0] == '(' and cc[1] =='~':
-                cc = cc[2:]
-                current_is_negated = True
-            cc_weight = self.get_cc_weight(cc, doc_id)
-            if current_is_negated:
-                weight_dnf += 1 if cc_weight == 0 else 0
-            else:
-                weight_dnf += cc_weight ** 2
-            current_is_negated = False
-
-        if len(conjunctive_components) == 1:
-            return weight_dnf
-
-        return math.sqrt(weight_dnf) / math.sqrt(len(conjunctive_components))
-
-    def get_cc_weight(self, cc: str, doc_id: int) -> float:
+        return self.compile_normalized_query(self.analyze_query(query), self.corpus.index_version)
+
+    def _compile_normalized_query(self, normalized_query: str, index_version: int) -> PNormQueryPlan:
+        # the version of the index is part of the key of the cache, the plans depend on the tokens of the corpus
+        clauses = self.query_processor.get_query_clauses(normalized_query)
+        return PNormQueryPlan.compile(clauses, self.corpus)
+
+    def get_candidate_docs(self, plan: PNormQueryPlan) -> np.ndarray:
         """
-        Returns the weight of the conjunctive component for a document,
-        in the extended boolean model the and components are calculated with the formula
-        1 - sqrt(sum((1 - wi)^2) / n) where wi is the weight of the term and n is the number of terms.
+        Gets the documents that can have a positive weight for the query. Without negated terms
+        a document that doesn't contain any term of the query has weight 0, otherwise every
+        document is a candidate.
 
         Args:
-        - cc (str): the conjunctive component
-        - doc_id (int): the id of the document
+        - plan: the plan of the query
 
         Returns:
-        - float: the weight of the conjunctive component for the document
+        - np.array: the ordinals of the candidate documents
         """
-        terms = cc.split(' & ')
-        current_is_negated = False
-        weight_conj_comp = 0
-
-        for term in terms:
-            if term[0] == '(':
-                term = term[1:]
-            if terms[-1] == ')':
-                term = term[:-1]
-            if term[0] == '~':
-                term = term[1:]
-                current_is_negated = True
-            term_weight = self.weight_doc(term, doc_id)
-            if current_is_negated:
-                w_doc = 0 if term_weight == 0 else 1
-            else:
-                w_doc = (1 - term_weight) ** 2
-            weight_conj_comp += w_doc
-            current_is_negated = False
-
-        if len(terms) == 1:
-            return 1 - weight_conj_comp
-
-        return 1 - math.sqrt(weight_conj_comp) / math.sqrt(len(terms))
-
-    def weight_doc(self, token: str, dj: int) -> float:
+        if plan.has_negations:
+            return self.corpus.live_docs
+        return self.corpus.get_candidate_docs(plan.term_ids)
+
+    def get_term_weights(self, plan: PNormQueryPlan, docs: np.ndarray) -> np.ndarray:
         """
-        Returns the weight of a token for a document, it is calculated with the formula
-        tf(ti, dj) / max_tf * idf(ti) / max_idf where ti is the token id, tf is the term frequency,
-        idf is the inverse document frequency, max_tf is the maximum term frequency and max_idf is the maximum
-        inverse document frequency.
+        Gets the weights of the terms of the query in the documents, they are the tf-idf weights divided by
+        the max idf, that is tf(ti, dj) / max_tf * idf(ti) / max_idf, taken from the weights cached by the corpus.
 
         Args:
-        - token (str): the token
-        - dj (int): the id of the document
+        - plan: the plan of the query
+        - docs: the ordinals of the documents
 
         Returns:
-        - float: the weight of the token for the document
+        - np.array: matrix with a row for every document and a column for every term of plan.term_ids
         """
-        try:
-            ti = self.corpus.token2id(token)
-            return tf(self.corpus, ti, dj) * normalized_idf(self.corpus, ti)
-        except KeyError:
-            return 0
+        weights = np.zeros((len(docs), len(plan.term_ids)))
+        if self.corpus.max_idf > 0:
+            for j, ti in enumerate(plan.term_ids.tolist()):
+                if ti >= 0:
+                    weights[:, j] = self.corpus.get_term_weights(ti).at(docs) / self.corpus.max_idf
+        return weights
@@ -1,8 +1,243 @@
+import threading
+from pathlib import Path
+from typing import List, Tuple
+
+from scipy.sparse import csr_matrix
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.decomposition import TruncatedSVD
 from sklearn.metrics.pairwise import cosine_similarity
 import numpy as np
 
+from src.code.corpus import Corpus, CorpusStatistics, Document
+from src.code.corpus.index_format import IndexFormatError, read_index, write_index
+from src.code.models import IRModel
+from src.code.query import QueryProcessor
+
+
+class LSAModel(IRModel):
+    """
+    Latent semantic analysis over the tf-idf matrix of the corpus. The truncated SVD is fitted once and saved
+    with the indexed corpus: the projection of the tokens into the latent space and the normalized latent
+    vectors of the documents, as float32 arrays that are memory mapped when they are loaded. A query is folded
+    into the latent space with the projection and ranked with a dot product against the document vectors.
+
+    When documents are added to the corpus the projection is kept and only the new documents are folded in, with
+    the statistics of the corpus when they are added, which is a sparse product instead of fitting the SVD. The
+    deleted documents keep their vectors and are skipped by the rankings. The new vectors are saved in a
+    background thread, so the queries don't wait for the file. `fit` fits the SVD again with all the documents.
+
+    Attributes:
+    - n_components: the number of dimensions of the latent space
+    - projection: matrix of shape (number of tokens, n_components), the tokens added after fitting are ignored
+    - doc_vectors: matrix of shape (number of documents, n_components) with the normalized document vectors
+    - index_version: the version of the corpus index the document vectors were computed for
+    """
+
+    def __init__(self, corpus: Corpus, n_components=100, random_state=42):
+        """
+        Args:
+        - corpus: the corpus with the documents
+        - n_components: the number of dimensions of the latent space
+        - random_state: the seed of the randomized SVD
+        """
+        super().__init__(corpus)
+        self.n_components = n_components
+        self.random_state = random_state
+        # parameter in the query weights, the same as in the vector model
+        self.a = 0.4
+        self.threshold = 0
+        stemming = self.corpus.stemmer is not None
+        self.query_processor = QueryProcessor(language=self.corpus.language, stemming=stemming)
+        self.projection: np.ndarray = None
+        self.doc_vectors: np.ndarray = None
+        self.index_version = -1
+        self._lock = threading.Lock()
+        self._save_thread: threading.Thread = None
+        self._save_pending = False
+        if not self.load_model():
+            self.fit()
+
+    def _get_model_path(self) -> Path:
+        return self.corpus._get_indexed_corpus_path() / f'lsa_{self.n_components}.bin'
+
+    def fit(self):
+        """Fits the truncated SVD over the tf-idf matrix of the corpus and saves it"""
+        matrix = self.corpus.get_tfidf_matrix('csr')
+        n_components = max(1, min(self.n_components, min(matrix.shape) - 1))
+        svd = TruncatedSVD(n_components=n_components, random_state=self.random_state)
+        svd.fit(matrix)
+        self.projection = np.ascontiguousarray(svd.components_.T, dtype=np.float32)
+        self.doc_vectors = self.fold_documents(matrix)
+        self.index_version = self.corpus.index_version
+        self.save_model()
+
+    def fold_documents(self, matrix) -> np.ndarray:
+        """
+        Projects documents into the latent space
+
+        Args:
+        - matrix: the tf-idf matrix of the documents, of shape (number of documents, number of tokens)
+
+        Returns:
+        - np.array: the normalized latent vectors of the documents, as float32
+        """
+        vectors = np.asarray(matrix[:, :self.projection.shape[0]] @ self.projection, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms > 0)
+
+    def document_matrix(self, ordinals: range, stats: CorpusStatistics) -> csr_matrix:
+        """
+        Gets the rows of the tf-idf matrix of some documents, from their bag of words
+
+        Args:
+        - ordinals: the ordinals of the documents
+        - stats: the statistics of the corpus
+
+        Returns:
+        - scipy.sparse.csr_matrix: the tf-idf vectors of the documents, a row for every one
+        """
+        bows = [self.corpus.doc2bow(dj) for dj in ordinals]
+        indptr = np.cumsum([0] + [len(bow) for bow in bows])
+        term_ids = np.fromiter((ti for bow in bows for ti in bow.keys()), dtype=np.int64, count=indptr[-1])
+        freqs = np.fromiter((freq for bow in bows for freq in bow.values()), dtype=np.float64, count=indptr[-1])
+        max_tf = np.repeat(stats.max_tf[list(ordinals)], np.diff(indptr))
+        weights = freqs / max_tf * stats.idf[term_ids]
+        return csr_matrix((weights, term_ids, indptr), shape=(len(bows), len(stats.idf)))
+
+    def save_model(self):
+        """Saves the projection and the document vectors with the indexed corpus"""
+        with self._lock:
+            projection, doc_vectors, index_version = self.projection, self.doc_vectors, self.index_version
+        path = self._get_model_path()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        sections = {'projection': projection.ravel(), 'doc_vectors': doc_vectors.ravel()}
+        meta = {'num_terms': projection.shape[0], 'num_docs': doc_vectors.shape[0],
+                'n_components': projection.shape[1], 'index_version': index_version}
+        write_index(path, sections, meta)
+
+    def wait_for_save(self):
+        """Waits until the document vectors that are saved in the background are written"""
+        thread = self._save_thread
+        if thread is not None:
+            thread.join()
+
+    def _schedule_save(self):
+        # called with the lock, the thread saves the latest vectors until there are no new ones
+        self._save_pending = True
+        if self._save_thread is None:
+            self._save_thread = threading.Thread(target=self._save_in_background, name='lsa-saver', daemon=True)
+            self._save_thread.start()
+
+    def _save_in_background(self):
+        while True:
+            with self._lock:
+                if not self._save_pending:
+                    self._save_thread = None
+                    return
+                self._save_pending = False
+            self.save_model()
+
+    def load_model(self) -> bool:
+        """
+        Loads the saved projection and document vectors, memory mapped
+
+        Returns:
+        - bool: False if there's no saved model for the corpus
+        """
+        try:
+            sections, meta = read_index(self._get_model_path())
+        except (FileNotFoundError, IndexFormatError):
+            return False
+        if meta['num_docs'] > len(self.corpus.documents) or meta['num_terms'] > len(self.corpus.vocabulary):
+            # it belongs to another version of the corpus that was indexed again
+            return False
+        self.projection = sections['projection'].reshape(meta['num_terms'], meta['n_components'])
+        self.doc_vectors = sections['doc_vectors'].reshape(meta['num_docs'], meta['n_components'])
+        self.index_version = meta['index_version']
+        return True
+
+    def _check_index(self):
+        # the documents keep their ordinals, so only the new ones are folded in
+        if len(self.doc_vectors) == len(self.corpus.documents):
+            return
+        with self._lock:
+            stats = self.corpus.stats
+            start = len(self.doc_vectors)
+            if start >= stats.num_docs:
+                return
+            vectors = self.fold_documents(self.document_matrix(range(start, stats.num_docs), stats))
+            self.doc_vectors = np.concatenate([self.doc_vectors, vectors])
+            self.index_version = self.corpus.index_version
+            self._schedule_save()
+
+    def cache_namespace(self):
+        return type(self).__name__, self.n_components
+
+    def query(self, query: str, k: int = None, offset: int = 0) -> List[Document]:
+        return self.search(query, k, offset).documents
+
+    def analyze_query(self, query: str) -> Tuple[Tuple[int, int], ...]:
+        # the bag of words of the query, as a tuple so it can be a key of the result cache
+        return tuple(sorted(self.query_processor(query, self.corpus.index)))
+
+    def ranking_function(self, query: List[Tuple[int, int]], k: int = None) -> List[Tuple[int, float]]:
+        self._check_index()
+        vector = self.query_vector(query)
+        if vector is None:
+            return []
+        return self.latent_ranking(self.doc_vectors @ vector, k)
+
+    def analyzed_ranking_batch(self, analyzed_queries: List[Tuple[Tuple[int, int], ...]], k: int = None,
+                               chunk_size=256) -> List[List[Tuple[int, float]]]:
+        """
+        Ranks the documents for several queries with a dense product per chunk of queries
+
+        Args:
+        - analyzed_queries: the bags of words of the queries
+        - k: the number of documents of every ranking, if None the rankings have all the similar documents
+        - chunk_size: the number of queries that are scored at once
+
+        Returns:
+        - list with the ranking of every query, as lists of tuples (doc_id, similarity)
+        """
+        self._check_index()
+        rankings = []
+        zero = np.zeros(self.projection.shape[1], dtype=np.float32)
+        for start in range(0, len(analyzed_queries), chunk_size):
+            vectors = [self.query_vector(query) for query in analyzed_queries[start:start + chunk_size]]
+            scores = np.stack([zero if vector is None else vector for vector in vectors]) @ self.doc_vectors.T
+            rankings.extend([] if vector is None else self.latent_ranking(row, k)
+                            for vector, row in zip(vectors, scores))
+        return rankings
+
+    def query_vector(self, query: List[Tuple[int, int]]) -> np.ndarray:
+        """
+        Folds a query into the latent space, its tf-idf weights are projected like the ones of the documents
+
+        Args:
+        - query: the bag of words of the query
+
+        Returns:
+        - np.array: the normalized latent vector of the query, None if none of its tokens are in the projection
+        """
+        query = [(ti, freq) for ti, freq in query if ti < self.projection.shape[0]]
+        if len(query) == 0:
+            return None
+        term_ids = np.array([ti for ti, _ in query], dtype=np.int64)
+        freqs = np.array([freq for _, freq in query], dtype=np.float64)
+        weights = (self.a + (1 - self.a) * freqs / freqs.max()) * self.corpus.stats.idf[term_ids]
+        vector = weights.astype(np.float32) @ self.projection[term_ids]
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else None
+
+    def latent_ranking(self, scores: np.ndarray, k: int = None) -> List[Tuple[int, float]]:
+        """Ranks the documents by their similarities to a query, without the deleted ones"""
+        candidates = np.flatnonzero((scores > self.threshold) & ~self.corpus.deleted[:len(scores)])
+        if k is not None and len(candidates) > k:
+            candidates = candidates[np.argpartition(scores[candidates], -k)[-k:]]
+        doc_ids = self.corpus.doc_ids[candidates].tolist()
+        return self.top_k(zip(doc_ids, scores[candidates].tolist()), k)
+
 
 def latent_query(query: str, documents, doc_ids: list[int]):
     vectorizer = TfidfVectorizer(stop_words='english')
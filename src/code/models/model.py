@@ -1,26 +1,34 @@
 """Module to implement the base method of the IR model"""
+import heapq
+import time
 from abc import ABC, abstractmethod
-from typing import List, Tuple
+from typing import Hashable, List, Optional, Tuple, Iterable, Iterator
 
-from src.code.corpus import Corpus, Document
+from src.code.corpus import Corpus, Document, RawDocument
 from src.code import ClusterManager, DocumentRecommender
+from src.code.instrumentation import metrics
+from .query_cache import QueryResultCache
+from .search_result import SearchResult
 
 
 class IRModel(ABC):
     def __init__(self, corpus: Corpus):
         self.corpus = corpus
-        self.clusterer = ClusterManager(self.corpus)
-        self.clusterer.fit_cluster(4)
+        # cache of the rankings of the queries, it can be shared by several models
+        self.result_cache: Optional[QueryResultCache] = None
+        self.clusterer = ClusterManager.shared(self.corpus)
         self.document_recommender = DocumentRecommender(self.clusterer, self.corpus)
 
     @abstractmethod
-    def query(self, query: str) -> List[Document]:
+    def query(self, query: str, k: int = None, offset: int = 0) -> List[Document]:
         """
         Main function that returns the documents that are most similar
         to the query.
 
         Args:
         - query: the query of the user
+        - k: the number of documents to return, if None all the similar documents are returned
+        - offset: the position in the ranking of the first document to return, to get the next pages
 
         Returns:
         - list of documents
@@ -28,19 +36,223 @@ class IRModel(ABC):
         raise NotImplementedError()
 
     @abstractmethod
-    def ranking_function(self, query) -> List[Tuple[int, float]]:
+    def ranking_function(self, query, k: int = None) -> List[Tuple[int, float]]:
         """
         Returns a sorted ranking of the similarity
         between the corpus and the query.
 
         Args:
         - query: list of tuples (term_id, term_freq)
+        - k: the number of documents of the ranking, if None the ranking has all the similar documents
 
         Returns:
         - list of tuples (doc_id, similarity)
         """
         raise NotImplementedError()
 
+    def analyze_query(self, query: str) -> Hashable:
+        """
+        Transforms the query as the model does before ranking, the queries with the same analysis
+        have the same ranking.
+
+        Args:
+        - query: the query of the user
+
+        Returns:
+        - the analyzed query, it's the key of the query in the result cache
+        """
+        return query
+
+    def analyzed_ranking(self, analyzed_query, k: int = None) -> List[Tuple[int, float]]:
+        """
+        Ranks the documents for an analyzed query
+
+        Args:
+        - analyzed_query: the query as returned by analyze_query
+        - k: the number of documents of the ranking, if None the ranking has all the similar documents
+
+        Returns:
+        - list of tuples (doc_id, similarity)
+        """
+        return self.ranking_function(analyzed_query, k)
+
+    def analyzed_ranking_batch(self, analyzed_queries: List, k: int = None,
+                               chunk_size=256) -> List[List[Tuple[int, float]]]:
+        """
+        Ranks the documents for several analyzed queries. By default every query is ranked on its own,
+        the models that can score many queries at once override it.
+
+        Args:
+        - analyzed_queries: the queries as returned by analyze_query
+        - k: the number of documents of every ranking, if None the rankings have all the similar documents
+        - chunk_size: the number of queries that are scored at once
+
+        Returns:
+        - list with the ranking of every query, as lists of tuples (doc_id, similarity)
+        """
+        return [self.analyzed_ranking(analyzed_query, k) for analyzed_query in analyzed_queries]
+
+    def query_batch(self, queries: List[str], k: int = None, chunk_size=256) -> List[List[Tuple[int, float]]]:
+        """
+        Ranks the documents for several queries, analyzing and scoring them together. It's meant for
+        evaluations and offline jobs, the rankings don't go through the result cache.
+
+        Args:
+        - queries: the queries
+        - k: the number of documents of every ranking, if None the rankings have all the similar documents
+        - chunk_size: the number of queries that are scored at once, it bounds the memory used
+
+        Returns:
+        - list with the ranking of every query, as lists of tuples (doc_id, similarity)
+        """
+        return self.analyzed_ranking_batch([self.analyze_query(query) for query in queries], k, chunk_size)
+
+    def cache_namespace(self) -> Hashable:
+        """
+        Identifies the rankings of the model in a result cache shared by several models, the models
+        or the configurations of a model that rank differently must have different namespaces.
+        """
+        return type(self).__name__
+
+    def rank(self, query: str, k: int = None) -> List[Tuple[int, float]]:
+        """
+        Ranks the documents for the query of the user. If the model has a result cache the ranking is
+        looked up there first, by the namespace of the model, the analyzed query, k and the version of the index.
+
+        Args:
+        - query: the query of the user
+        - k: the number of documents of the ranking, if None the ranking has all the similar documents
+
+        Returns:
+        - list of tuples (doc_id, similarity)
+        """
+        with metrics.timer('analysis'):
+            analyzed_query = self.analyze_query(query)
+        if self.result_cache is None:
+            with metrics.timer('scoring'):
+                return self.analyzed_ranking(analyzed_query, k)
+        index_version = self.corpus.index_version
+        key = (self.cache_namespace(), analyzed_query, k, index_version)
+        ranking = self.result_cache.get(key, index_version)
+        if ranking is None:
+            with metrics.timer('scoring'):
+                ranking = self.analyzed_ranking(analyzed_query, k)
+            self.result_cache.put(key, ranking, index_version)
+        return ranking
+
+    def search(self, query: str, k: int = None, offset: int = 0) -> SearchResult:
+        """
+        Ranks the documents for a query once, the result has the ranking and the documents on demand.
+        The search is timed as a stage and it's the block sampled by the profiler of the instrumentation.
+
+        Args:
+        - query: the query of the user
+        - k: the number of documents to return, if None all the similar documents are returned
+        - offset: the position in the ranking of the first document to return
+
+        Returns:
+        - SearchResult: the ranked ids and scores, the time spent and the documents
+        """
+        metrics.increment('queries')
+        start = time.perf_counter()
+        with metrics.profile(), metrics.timer('search'):
+            ranking = self.ranking_page(query, k, offset)
+        return SearchResult(self.corpus, query, ranking, offset, time.perf_counter() - start)
+
+    def ranking_page(self, query: str, k: int = None, offset: int = 0) -> List[Tuple[int, float]]:
+        """
+        Gets a page of the ranking of a query, only the best offset + k documents are ranked
+
+        Args:
+        - query: the query of the user
+        - k: the number of documents of the page, if None the page has all the similar documents after offset
+        - offset: the position in the ranking of the first document of the page
+
+        Returns:
+        - list of tuples (doc_id, similarity)
+        """
+        return self.rank(query, None if k is None else offset + k)[offset:]
+
+    def iter_query(self, query: str, batch_size=100) -> Iterator[Tuple[int, float]]:
+        """
+        Yields the ranking of a query lazily, the documents can be materialized on demand with corpus.id2doc.
+        The ranking is computed in growing prefixes, first the best batch_size documents and then twice as
+        many every time the previous prefix is exhausted, so stopping early doesn't rank the whole corpus.
+
+        Args:
+        - query: the query of the user
+        - batch_size: the number of documents of the first prefix
+
+        Returns:
+        - iterator of tuples (doc_id, similarity)
+
+        Raises:
+        - ValueError: if batch_size is less than 1
+        """
+        if batch_size < 1:
+            raise ValueError(f'The batch size must be at least 1, got {batch_size}')
+        return self._iter_query(query, batch_size)
+
+    def _iter_query(self, query: str, batch_size: int) -> Iterator[Tuple[int, float]]:
+        k = batch_size
+        position = 0
+        while True:
+            ranking = self.rank(query, k)
+            yield from ranking[position:]
+            if len(ranking) < k:
+                return
+            position = len(ranking)
+            k *= 2
+
+    def add_documents(self, documents: Iterable[RawDocument]):
+        """
+        Adds new documents to the corpus and assigns them to the existing clusters
+
+        Args:
+        - documents: the raw documents (doc_id, title, text)
+        """
+        self.corpus.add_documents(documents)
+        self.clusterer.sync()
+
+    def update_document(self, document: RawDocument):
+        """
+        Replaces a document of the corpus and assigns its new version to a cluster
+
+        Args:
+        - document: the raw document (doc_id, title, text), with the id of the document to replace
+        """
+        self.corpus.update_document(document)
+        self.clusterer.sync()
+
+    def delete_documents(self, doc_ids: Iterable[int]):
+        """
+        Deletes documents from the corpus and from the clusters
+
+        Args:
+        - doc_ids: the ids of the documents
+        """
+        self.corpus.delete_documents(doc_ids)
+        self.clusterer.sync()
+
+    @staticmethod
+    def top_k(ranking: Iterable[Tuple[int, float]], k: int = None) -> List[Tuple[int, float]]:
+        """
+        Sorts a ranking by similarity. If k is given only the best k documents are selected,
+        with a heap bounded to k elements instead of sorting the whole ranking. It's timed as the stage
+        'sorting', which is nested in the stage 'scoring' of the ranking functions.
+
+        Args:
+        - ranking: iterable of tuples (doc_id, similarity)
+        - k: the number of documents to keep
+
+        Returns:
+        - list of tuples (doc_id, similarity) sorted by similarity
+        """
+        with metrics.timer('sorting'):
+            if k is None:
+                return sorted(ranking, key=lambda x: x[1], reverse=True)
+            return heapq.nlargest(k, ranking, key=lambda x: x[1])
+
     def get_similarity_docs(self, ranking: List[Tuple[int, float]]) -> List[Document]:
         """
         Uses the ranking produced by the ranking function
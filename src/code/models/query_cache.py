@@ -0,0 +1,125 @@
+"""Cache of the rankings of the last queries, shared by the models"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Hashable, List, Optional, Tuple
+
+import numpy as np
+
+
+class QueryResultCache:
+    """
+    LRU cache of rankings bounded by the bytes of the rankings. The rankings are stored as arrays of doc ids and
+    scores, so their size is known. The entries expire ttl seconds after they are stored, and all of them are
+    dropped when the version of the index changes, the rankings of an older index are never returned.
+    It's safe to use from several threads.
+
+    Attributes:
+    - max_bytes: the maximum number of bytes of the stored rankings
+    - ttl: the seconds that an entry is valid, None if the entries don't expire
+    - hits, misses: the number of lookups that found and didn't find a valid entry
+    - evictions: the number of entries dropped to make room for others
+    - expirations: the number of entries dropped because they expired
+    - invalidations: the number of times the cache was emptied because the index changed
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, ttl: Optional[float] = 300):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.index_version = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, index_version: int) -> Optional[List[Tuple[int, float]]]:
+        """
+        Looks up the ranking of a query
+
+        Args:
+        - key: the key of the query
+        - index_version: the current version of the index
+
+        Returns:
+        - list of tuples (doc_id, similarity): the ranking, None if it isn't in the cache
+        """
+        with self._lock:
+            self._check_version(index_version)
+            entry = self.entries.get(key)
+            if entry is not None and self.ttl is not None and entry[0] <= time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+        _, _, doc_ids, scores = entry
+        return list(zip(doc_ids.tolist(), scores.tolist()))
+
+    def put(self, key: Hashable, ranking: List[Tuple[int, float]], index_version: int):
+        """
+        Stores the ranking of a query, evicting the least recently used entries if there's no room for it
+
+        Args:
+        - key: the key of the query
+        - ranking: list of tuples (doc_id, similarity)
+        - index_version: the version of the index that produced the ranking
+        """
+        doc_ids = np.fromiter((doc_id for doc_id, _ in ranking), dtype=np.int64, count=len(ranking))
+        scores = np.fromiter((score for _, score in ranking), dtype=np.float64, count=len(ranking))
+        nbytes = doc_ids.nbytes + scores.nbytes
+        if nbytes > self.max_bytes:
+            return
+        expires = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._check_version(index_version)
+            if index_version != self.index_version:
+                return
+            if key in self.entries:
+                self._remove(key)
+            while self.nbytes + nbytes > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+            self.entries[key] = (expires, nbytes, doc_ids, scores)
+            self.nbytes += nbytes
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+            self.nbytes = 0
+
+    def stats(self) -> dict:
+        """Gets the counters and the size of the cache"""
+        with self._lock:
+            return {
+                'entries': len(self.entries),
+                'bytes': self.nbytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+            }
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _check_version(self, index_version: int):
+        # the versions only grow, a ranking computed with an older index than the cached ones is not stored
+        if self.index_version is None or index_version > self.index_version:
+            if len(self.entries) > 0:
+                self.invalidations += 1
+            self.entries.clear()
+            self.nbytes = 0
+            self.index_version = index_version
+
+    def _remove(self, key: Hashable):
+        entry = self.entries.pop(key)
+        self.nbytes -= entry[1]
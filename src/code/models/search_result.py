@@ -0,0 +1,56 @@
+from functools import cached_property
+from typing import List, Tuple
+
+from src.code.corpus import Corpus, Document
+from src.code.instrumentation import metrics
+
+
+class SearchResult:
+    """
+    The result of a query, computed once and shared by the display, the feedback and the recommendations.
+    The documents are only materialized when they are accessed.
+
+    Attributes:
+    - query: the query of the user
+    - ranking: list of tuples (doc_id, similarity) sorted by similarity
+    - offset: the position in the whole ranking of the first document of the result
+    - elapsed: the seconds spent ranking the documents
+    """
+
+    def __init__(self, corpus: Corpus, query: str, ranking: List[Tuple[int, float]], offset=0, elapsed=0.0):
+        self.corpus = corpus
+        self.query = query
+        self.ranking = ranking
+        self.offset = offset
+        self.elapsed = elapsed
+
+    @property
+    def doc_ids(self) -> List[int]:
+        return [doc_id for doc_id, _ in self.ranking]
+
+    @property
+    def scores(self) -> List[float]:
+        return [score for _, score in self.ranking]
+
+    @cached_property
+    def documents(self) -> List[Document]:
+        with metrics.timer('materialization'):
+            return [self.corpus.id2doc(doc_id) for doc_id in self.doc_ids]
+
+    def to_dict(self):
+        return {
+            'query': self.query,
+            'offset': self.offset,
+            'elapsed': self.elapsed,
+            'results': [{'doc_id': doc.doc_id, 'title': doc.doc_title, 'score': score}
+                        for doc, score in zip(self.documents, self.scores)]
+        }
+
+    def __len__(self):
+        return len(self.ranking)
+
+    def __iter__(self):
+        return iter(self.ranking)
+
+    def __repr__(self):
+        return repr(self.to_dict())
@@ -1,47 +1,268 @@
-import spacy
-from sentence_transformers import SentenceTransformer, util
-from sklearn.feature_extraction.text import TfidfVectorizer
+"""
+Dense retrieval: the documents and the queries are encoded as embeddings and ranked by cosine similarity.
+The encoder is pluggable, SentenceTransformerEncoder uses a model of sentence-transformers (an optional
+dependency that is imported when the encoder is created) and HashingEncoder is a deterministic stand-in
+that works offline.
+"""
+import re
+import threading
+import zlib
+from abc import ABC, abstractmethod
+from collections import Counter
+from pathlib import Path
+from typing import List, Tuple
 
-nlp = spacy.load("en_core_web_sm")
-model = SentenceTransformer('all-MiniLM-L6-v2')
+import numpy as np
 
-query = 'impact of renewable energy on environmental sustainability'
+from src.code.corpus import Corpus, Document
+from src.code.corpus.index_format import IndexFormatError, read_index, write_index
+from src.code.models import IRModel
+from .embedding_store import EmbeddingStore, IVFIndex, chunks, normalize
 
-documents = [
-    "Renewable energy sources such as solar and wind power play a crucial role in combating climate change. They help reduce greenhouse gas emissions and provide a cleaner, more sustainable energy future.",
-    "The adoption of renewable energy technologies has been accelerated by global initiatives to address environmental issues. These technologies not only protect the environment but also offer economic benefits by creating jobs in new industries.",
-    "While renewable energy is essential for sustainability, its integration into existing power grids presents challenges. Effective storage solutions and infrastructure improvements are necessary to ensure the reliability of energy supply."
-]
 
-text_total = documents + [query]
+class Encoder(ABC):
+    """
+    Encodes texts as embeddings.
 
-tfidf_vectorizer = TfidfVectorizer()
-tfidf_matrix = tfidf_vectorizer.fit_transform(text_total)
-tfidf_feature_names = tfidf_vectorizer.get_feature_names_out()
+    Attributes:
+    - name: identifies the encoder and its parameters, the embeddings of different encoders are saved apart
+    - dimension: the dimension of the embeddings
+    """
+    name: str
+    dimension: int
 
-query_tokens = [token.text for token in nlp(query)]
+    @abstractmethod
+    def encode(self, texts: List[str]) -> np.ndarray:
+        """
+        Gets the embeddings of texts
 
-sents_documents = [[sent.text for sent in nlp(doc).sents] for doc in documents]
+        Args:
+        - texts: the texts
 
-embeddings_sents_documents = [model.encode(sents_document) for sents_document in sents_documents]
+        Returns:
+        - np.array: matrix of shape (number of texts, dimension)
+        """
+        raise NotImplementedError()
 
-results = [(0, i) for i in range(len(documents))]
 
-for doc_id, embeddings_sents_document in enumerate(embeddings_sents_documents):
-    total_relevance = 0
+class SentenceTransformerEncoder(Encoder):
+    def __init__(self, model_name='all-MiniLM-L6-v2', batch_size=64, device: str = None):
+        """
+        Args:
+        - model_name: the name or the path of a model of sentence-transformers
+        - batch_size: the number of texts of every batch of the model
+        - device: the device of the model, chosen by sentence-transformers if None
+        """
+        from sentence_transformers import SentenceTransformer
 
-    for token in query_tokens:
-        if token in tfidf_feature_names:
-            token_idx = tfidf_vectorizer.vocabulary_.get(token)
-            tfidf = tfidf_matrix[doc_id, token_idx]
+        self.model = SentenceTransformer(model_name, device=device)
+        self.batch_size = batch_size
+        self.name = re.sub(r'\W', '_', model_name)
+        self.dimension = self.model.get_sentence_embedding_dimension()
 
-            embedding_token = model.encode(token)
-            relevance = util.pytorch_cos_sim(embedding_token, embeddings_sents_document).numpy().flatten().sum()
+    def encode(self, texts: List[str]) -> np.ndarray:
+        return self.model.encode(texts, batch_size=self.batch_size, convert_to_numpy=True,
+                                 normalize_embeddings=True)
 
-            relevance_weighted = relevance * tfidf
-            total_relevance += relevance_weighted
 
-    results[doc_id] = (total_relevance, doc_id)
+class HashingEncoder(Encoder):
+    """
+    Deterministic encoder without a model. The words and the pairs of consecutive words of a text are hashed
+    into the dimensions of the embedding with a random sign, weighted by the logarithm of their frequency.
+    The texts that share words are similar, so it works as a stand-in for tests and benchmarks.
+    """
 
-results = sorted(results, reverse=True)
-print(results)
+    def __init__(self, dimension=256):
+        self.dimension = dimension
+        self.name = f'hashing_{dimension}'
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        embeddings = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        for i, text in enumerate(texts):
+            words = re.findall(r'\w+', text.lower())
+            features = Counter(words + [f'{a} {b}' for a, b in zip(words, words[1:])])
+            for feature, count in features.items():
+                code = zlib.crc32(feature.encode('utf-8'))
+                sign = 1 if code & 1 else -1
+                embeddings[i, (code >> 1) % self.dimension] += sign * (1 + np.log(count))
+        return normalize(embeddings)
+
+
+class DenseRetrievalModel(IRModel):
+    """
+    Ranks the documents by the cosine similarity between their embeddings and the embedding of the query.
+    The documents are encoded in chunks when the model is created the first time and their embeddings are
+    saved with the indexed corpus, quantized to float16 or int8, and memory mapped after that. The documents
+    added to the corpus are encoded when the next query arrives, the deleted ones are skipped.
+
+    The embeddings are saved with a checksum of the ids of their documents, so the ones of a corpus that
+    was indexed again with other documents are encoded again. The new documents are added to a copy of the
+    store that replaces it, so the queries that are running keep a consistent store.
+
+    The search is exact by default. With n_lists > 0 an IVF index is trained and only the documents of the
+    nprobe lists nearest to the query are scored, plus the documents added after training it.
+
+    Attributes:
+    - encoder: the encoder of the documents and the queries
+    - store: EmbeddingStore with the embeddings of the documents by ordinal
+    - ivf: the IVFIndex of the store, None if the search is exact
+    - nprobe: the number of lists of the IVF index searched for a query, if None all the documents are scored
+    """
+
+    def __init__(self, corpus: Corpus, encoder: Encoder = None, dtype='float16', n_lists=0, nprobe=8,
+                 chunk_size=256):
+        """
+        Args:
+        - corpus: the corpus with the documents
+        - encoder: the encoder, a SentenceTransformerEncoder with the default model if None
+        - dtype: the type of the saved embeddings, 'float32', 'float16' or 'int8'
+        - n_lists: the number of lists of the IVF index, 0 to search all the documents
+        - nprobe: the number of lists searched for a query
+        - chunk_size: the number of documents encoded at once
+        """
+        super().__init__(corpus)
+        self.encoder = encoder if encoder is not None else SentenceTransformerEncoder()
+        self.dtype = dtype
+        self.n_lists = n_lists
+        self.nprobe = nprobe
+        self.chunk_size = chunk_size
+        self.threshold = 0
+        self.store: EmbeddingStore = None
+        self.ivf: IVFIndex = None
+        self._lock = threading.Lock()
+        if not self.load_index():
+            self.build_index()
+
+    def _get_index_path(self) -> Path:
+        ivf = f'_ivf{self.n_lists}' if self.n_lists > 0 else ''
+        return self.corpus._get_indexed_corpus_path() / f'dense_{self.encoder.name}_{self.dtype}{ivf}.bin'
+
+    def document_text(self, doc: Document) -> str:
+        """
+        Gets the text of a document that is encoded. The corpus only keeps the title and the processed tokens,
+        so the title is processed too, and analyze_query processes the queries the same way.
+        """
+        return ' '.join(self.corpus.preprocess_text(doc.doc_title) + list(doc.doc_tokens))
+
+    def build_index(self):
+        """Encodes all the documents of the corpus, trains the IVF index if it's used and saves them"""
+        documents = self.corpus.documents
+        self.store = EmbeddingStore.build(self.encoder.encode, (self.document_text(doc) for doc in documents),
+                                          len(documents), self.encoder.dimension, self.dtype, self.chunk_size)
+        self.ivf = None
+        if 0 < self.n_lists <= len(self.store):
+            self.ivf = IVFIndex.train(self.store, self.n_lists)
+        self.save_index()
+
+    def save_index(self):
+        sections = self.store.sections()
+        if self.ivf is not None:
+            sections.update(self.ivf.sections())
+        meta = {'num_vectors': len(self.store), 'dimension': self.encoder.dimension,
+                'doc_ids_checksum': self._doc_ids_checksum(len(self.store))}
+        path = self._get_index_path()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        write_index(path, sections, meta)
+
+    def load_index(self) -> bool:
+        """
+        Loads the saved embeddings and IVF index, memory mapped
+
+        Returns:
+        - bool: False if they weren't saved for the documents of the corpus and the encoder
+        """
+        try:
+            sections, meta = read_index(self._get_index_path())
+        except (FileNotFoundError, IndexFormatError):
+            return False
+        if meta['dimension'] != self.encoder.dimension or meta['num_vectors'] > len(self.corpus.documents):
+            return False
+        if meta.get('doc_ids_checksum') != self._doc_ids_checksum(meta['num_vectors']):
+            # the corpus was indexed again with other documents
+            return False
+        self.store = EmbeddingStore.from_sections(sections, meta['num_vectors'], meta['dimension'])
+        self.ivf = IVFIndex.from_sections(sections, meta['dimension']) if 'centroids' in sections else None
+        return True
+
+    def _doc_ids_checksum(self, num_docs: int) -> int:
+        return zlib.crc32(np.ascontiguousarray(self.corpus.doc_ids[:num_docs], dtype=np.int64).tobytes())
+
+    def _check_index(self):
+        # the documents keep their ordinals, so only the new ones are encoded
+        if len(self.store) == len(self.corpus.documents):
+            return
+        with self._lock:
+            store = self.store
+            documents = self.corpus.documents[len(store):]
+            if len(documents) == 0:
+                return
+            for chunk in chunks((self.document_text(doc) for doc in documents), self.chunk_size):
+                store = store.append(self.encoder.encode(chunk))
+            self.store = store
+            self.save_index()
+
+    def cache_namespace(self):
+        return type(self).__name__, self.encoder.name, self.dtype, self.n_lists, self.nprobe
+
+    def query(self, query: str, k: int = None, offset: int = 0) -> List[Document]:
+        return self.search(query, k, offset).documents
+
+    def analyze_query(self, query: str) -> str:
+        # the query is encoded with the same processing as the documents
+        return ' '.join(self.corpus.preprocess_text(query))
+
+    def ranking_function(self, query: str, k: int = None) -> List[Tuple[int, float]]:
+        self._check_index()
+        return self.dense_ranking(normalize(self.encoder.encode([query]))[0], k)
+
+    def analyzed_ranking_batch(self, analyzed_queries: List[str], k: int = None,
+                               chunk_size=256) -> List[List[Tuple[int, float]]]:
+        """
+        Ranks the documents for several queries, encoding them in chunks. The exact search scores every
+        chunk of queries with a single product.
+
+        Args:
+        - analyzed_queries: the queries
+        - k: the number of documents of every ranking, if None the rankings have all the similar documents
+        - chunk_size: the number of queries that are encoded and scored at once
+
+        Returns:
+        - list with the ranking of every query, as lists of tuples (doc_id, similarity)
+        """
+        self._check_index()
+        store = self.store
+        rankings = []
+        for start in range(0, len(analyzed_queries), chunk_size):
+            vectors = normalize(self.encoder.encode(analyzed_queries[start:start + chunk_size]))
+            if self.ivf is not None and self.nprobe is not None:
+                rankings.extend(self.dense_ranking(vector, k) for vector in vectors)
+                continue
+            rows = np.arange(len(store))
+            rankings.extend(self.top_similar(rows, scores, k) for scores in store.scores(vectors))
+        return rankings
+
+    def dense_ranking(self, vector: np.ndarray, k: int = None) -> List[Tuple[int, float]]:
+        """
+        Ranks the documents by their similarity to a query
+
+        Args:
+        - vector: the normalized embedding of the query
+        - k: the number of documents of the ranking, if None the ranking has all the similar documents
+
+        Returns:
+        - list of tuples (doc_id, similarity)
+        """
+        store, ivf = self.store, self.ivf
+        if ivf is None or self.nprobe is None:
+            rows = np.arange(len(store))
+            return self.top_similar(rows, store.scores(vector[None])[0], k)
+        rows = np.concatenate([ivf.candidates(vector, self.nprobe), np.arange(ivf.num_indexed, len(store))])
+        return self.top_similar(rows, store.scores(vector[None], rows)[0], k)
+
+    def top_similar(self, rows: np.ndarray, scores: np.ndarray, k: int = None) -> List[Tuple[int, float]]:
+        """Ranks the documents of some ordinals by their similarities, without the deleted ones"""
+        selected = np.flatnonzero((scores > self.threshold) & ~self.corpus.deleted[rows])
+        if k is not None and len(selected) > k:
+            selected = selected[np.argpartition(scores[selected], -k)[-k:]]
+        doc_ids = self.corpus.doc_ids[rows[selected]].tolist()
+        return self.top_k(zip(doc_ids, scores[selected].tolist()), k)
@@ -1,6 +1,9 @@
 import math
 from typing import List, Tuple, Dict
 
+import numpy as np
+from scipy.sparse import csr_matrix
+
 from src.code.corpus import Corpus, Document
 from src.code.models import IRModel
 from src.code.query import QueryProcessor
@@ -8,45 +11,256 @@ from src.code.utils import tf, idf
 
 
 class VectorModel(IRModel):
-    def __init__(self, corpus: Corpus):
+    def __init__(self, corpus: Corpus, engine: str = 'postings', nprobe: int = None):
+        """
+        Args:
+        - corpus: the corpus with the documents
+        - engine: how the similarities are computed, 'postings' goes term at a time through the
+        inverted index and 'sparse' does a single product of the tf-idf matrix of the corpus by the query
+        - nprobe: if given only the documents of the nprobe clusters whose centroids are the most similar
+        to the query are scored, trading recall for latency. If None all the documents are scored
+        """
         super().__init__(corpus)
+        if engine not in ('postings', 'sparse'):
+            raise ValueError(f'Unknown engine {engine}')
+        self.engine = engine
+        self.nprobe = nprobe
         # parameters in the query weights
         self.a = 0.4  # 0.5
+        # documents with a cosine similarity not greater than the threshold are not retrieved,
+        # the similarity uses the norm of the whole document so it is lower than the old 0.3 cutoff expected
+        self.threshold = 0
         stemming = self.corpus.stemmer is not None
         language = self.corpus.language
         self.query_processor = QueryProcessor(language=language, stemming=stemming)
 
-    def query(self, query: str) -> List[Document]:
-        query_vect = self.query_processor(query, self.corpus.index)
-        doc_ranking = self.ranking_function(query_vect)
-        docs = self.get_similarity_docs(doc_ranking)
-        return docs
+    def query(self, query: str, k: int = None, offset: int = 0) -> List[Document]:
+        return self.search(query, k, offset).documents
+
+    def cache_namespace(self):
+        # the pruned rankings are different from the exhaustive ones
+        return type(self).__name__, self.nprobe
+
+    def analyze_query(self, query: str) -> Tuple[Tuple[int, int], ...]:
+        # the bag of words of the query, as a tuple so it can be a key of the result cache
+        return tuple(sorted(self.query_processor(query, self.corpus.index)))
 
-    def ranking_function(self, query: List[Tuple[int, int]]) -> List[Tuple[int, float]]:
-        ranking = []
+    def ranking_function(self, query: List[Tuple[int, int]], k: int = None) -> List[Tuple[int, float]]:
         query_vect = dict(query)
-        for i, doc in enumerate(self.corpus.documents):
-            num = 0
-            doc_weights_sqr = 0
-            query_weights_sqr = 0
-            for ti in query_vect.keys():
-                w_doc = self.weight_doc(ti, i)
-                w_query = self.weight_query(ti, query_vect)
-                num += w_doc * w_query
-                doc_weights_sqr += w_doc ** 2
-                query_weights_sqr += w_query ** 2
-            try:
-                sim = num / (math.sqrt(doc_weights_sqr) * math.sqrt(query_weights_sqr))
-            except ZeroDivisionError:
-                sim = 0
-            if sim > 0.3:
-                ranking.append((doc.doc_id, sim))
-        ranking.sort(key=lambda x: x[1], reverse=True)
-        return ranking
-
-    def weight_query(self, ti: int, query_vect: Dict[int, int]):
-        freq = query_vect[ti]
+        if len(query_vect) == 0:
+            return []
         max_freq = max(query_vect.values())
+        query_weights = {ti: self.weight_query(ti, query_vect, max_freq) for ti in query_vect.keys()}
+        query_norm = math.sqrt(sum(w ** 2 for w in query_weights.values()))
+
+        if self.nprobe is not None and query_norm > 0:
+            return self.cluster_ranking(query_weights, query_norm, k)
+        if k is not None and self.engine == 'postings' and query_norm > 0:
+            return self.max_score_ranking(query_weights, query_norm, k)
+
+        if self.engine == 'sparse':
+            candidates, scores = self.sparse_scores(query_weights)
+        else:
+            candidates, scores = self.postings_scores(query_weights)
+
+        norms = self.corpus.stats.doc_norms[candidates] * query_norm
+        sims = np.divide(scores, norms, out=np.zeros(len(candidates)), where=norms > 0)
+
+        doc_ids = self.corpus.doc_ids[candidates].tolist()
+        ranking = [(doc_id, sim) for doc_id, sim in zip(doc_ids, sims.tolist()) if sim > self.threshold]
+        return self.top_k(ranking, k)
+
+    def analyzed_ranking_batch(self, analyzed_queries: List[Tuple[Tuple[int, int], ...]], k: int = None,
+                               chunk_size=256) -> List[List[Tuple[int, float]]]:
+        """
+        Ranks the documents for several queries with a single sparse product per chunk of queries. The weights
+        of the queries, divided by their norms, are the rows of a sparse query-term matrix that is multiplied by
+        the transposed tf-idf matrix of the corpus, giving the dot product of every query and document.
+
+        Args:
+        - analyzed_queries: the bags of words of the queries
+        - k: the number of documents of every ranking, if None the rankings have all the similar documents
+        - chunk_size: the number of queries that are scored at once
+
+        Returns:
+        - list with the ranking of every query, as lists of tuples (doc_id, similarity)
+        """
+        if self.nprobe is not None:
+            # every query has its own candidates
+            return super().analyzed_ranking_batch(analyzed_queries, k, chunk_size)
+        # the tf-idf matrix of the documents by columns, so its transpose has the tokens by rows without a copy
+        term_doc_matrix = self.corpus.get_tfidf_matrix('csc').T
+        rankings = []
+        for start in range(0, len(analyzed_queries), chunk_size):
+            query_matrix = self.query_matrix(analyzed_queries[start:start + chunk_size], term_doc_matrix.shape[0])
+            scores = (query_matrix @ term_doc_matrix).tocsr()
+            scores.sort_indices()
+            for i in range(scores.shape[0]):
+                candidates = scores.indices[scores.indptr[i]:scores.indptr[i + 1]]
+                dots = scores.data[scores.indptr[i]:scores.indptr[i + 1]]
+                norms = self.corpus.stats.doc_norms[candidates]
+                sims = np.divide(dots, norms, out=np.zeros(len(candidates)), where=norms > 0)
+                doc_ids = self.corpus.doc_ids[candidates].tolist()
+                ranking = [(doc_id, sim) for doc_id, sim in zip(doc_ids, sims.tolist()) if sim > self.threshold]
+                rankings.append(self.top_k(ranking, k))
+        return rankings
+
+    def query_matrix(self, analyzed_queries: List[Tuple[Tuple[int, int], ...]], num_terms: int) -> csr_matrix:
+        """
+        Builds the sparse matrix with the normalized weights of the queries, a row for every query
+
+        Args:
+        - analyzed_queries: the bags of words of the queries
+        - num_terms: the number of columns of the matrix
+
+        Returns:
+        - scipy.sparse.csr_matrix: matrix of shape (number of queries, num_terms)
+        """
+        lengths = np.array([len(query) for query in analyzed_queries], dtype=np.int64)
+        rows = np.repeat(np.arange(len(analyzed_queries)), lengths)
+        term_ids = np.fromiter((ti for query in analyzed_queries for ti, _ in query), dtype=np.int64,
+                               count=int(lengths.sum()))
+        freqs = np.fromiter((freq for query in analyzed_queries for _, freq in query), dtype=np.float64,
+                            count=int(lengths.sum()))
+        max_freqs = np.zeros(len(analyzed_queries))
+        np.maximum.at(max_freqs, rows, freqs)
+        weights = (self.a + (1 - self.a) * freqs / max_freqs[rows]) * self.corpus.stats.idf[term_ids]
+        norms = np.sqrt(np.bincount(rows, weights ** 2, minlength=len(analyzed_queries)))[rows]
+        weights = np.divide(weights, norms, out=np.zeros(len(weights)), where=norms > 0)
+        indptr = np.concatenate([[0], np.cumsum(lengths)])
+        return csr_matrix((weights, term_ids, indptr), shape=(len(analyzed_queries), num_terms))
+
+    def max_score_ranking(self, query_weights: Dict[int, float], query_norm: float, k: int) -> List[Tuple[int, float]]:
+        """
+        Gets the best k documents using MaxScore dynamic pruning. The query terms are processed from the
+        highest to the lowest upper bound of their contribution to the similarity. Once the upper bounds of
+        the remaining terms can't take a new document over the k-th best similarity found, the remaining
+        terms only look up the documents that are already candidates in their postings, and the candidates
+        that can't reach the k-th best similarity are discarded.
+
+        Args:
+        - query_weights: the weight of every token of the query
+        - query_norm: the norm of the query vector
+        - k: the number of documents to return
+
+        Returns:
+        - list of tuples (doc_id, similarity)
+        """
+        stats = self.corpus.stats
+        bounds = {ti: w / query_norm * stats.max_weights[ti] for ti, w in query_weights.items()}
+        terms = sorted(bounds, key=bounds.get, reverse=True)
+        scores = np.zeros(len(self.corpus.documents))
+        candidates = np.zeros(0, dtype=np.int64)
+        kth_best = 0
+        pruning = False
+
+        for i, ti in enumerate(terms):
+            # upper bound of the similarity that the terms not processed yet can add to a document
+            remaining = sum(bounds[tj] for tj in terms[i + 1:])
+            term_weights = self.corpus.get_term_weights(ti)
+            if pruning:
+                docs, weights = candidates, term_weights.at(candidates)
+            else:
+                docs, weights = term_weights.docs, term_weights.weights
+                candidates = np.union1d(candidates, docs)
+            scores[docs] += self.similarity_contributions(docs, weights, query_weights[ti] / query_norm)
+
+            if len(candidates) >= k:
+                kth_best = np.partition(scores[candidates], -k)[-k]
+            if len(candidates) >= k and remaining <= kth_best:
+                pruning = True
+                candidates = candidates[scores[candidates] + remaining >= kth_best]
+
+        doc_ids = self.corpus.doc_ids[candidates].tolist()
+        ranking = [(doc_id, sim) for doc_id, sim in zip(doc_ids, scores[candidates].tolist()) if sim > self.threshold]
+        return self.top_k(ranking, k)
+
+    def cluster_ranking(self, query_weights: Dict[int, float], query_norm: float, k: int = None) \
+            -> List[Tuple[int, float]]:
+        """
+        Ranks only the documents of the nprobe clusters whose centroids are the most similar to the query,
+        the candidates are read from the inverted lists of the clusters. The weights of a query token are
+        looked up in the candidates, or its postings are filtered by the candidates if they are shorter.
+        The scores are indexed by the position of the candidate, so the cost depends on the size of the
+        clusters and not on the size of the corpus.
+
+        Args:
+        - query_weights: the weight of every token of the query
+        - query_norm: the norm of the query vector
+        - k: the number of documents to return, if None all the similar candidates are returned
+
+        Returns:
+        - list of tuples (doc_id, similarity)
+        """
+        term_ids = np.fromiter(query_weights.keys(), dtype=np.int64, count=len(query_weights))
+        weights = np.fromiter(query_weights.values(), dtype=np.float64, count=len(query_weights))
+        clusters = self.clusterer.nearest_clusters(term_ids, weights, self.nprobe)
+        candidates = self.clusterer.get_cluster_docs(clusters)
+        candidates = candidates[~self.corpus.deleted[candidates]]
+        if len(candidates) == 0:
+            return []
+        scores = np.zeros(len(candidates))
+        for ti, w_query in query_weights.items():
+            term_weights = self.corpus.get_term_weights(ti)
+            if len(term_weights.docs) < len(candidates):
+                # the candidates are sorted, so the postings are found in them with a binary search
+                positions = np.minimum(np.searchsorted(candidates, term_weights.docs), len(candidates) - 1)
+                selected = candidates[positions] == term_weights.docs
+                positions = positions[selected]
+                docs, weights = term_weights.docs[selected], term_weights.weights[selected]
+            else:
+                positions = slice(None)
+                docs, weights = candidates, term_weights.at(candidates)
+            scores[positions] += self.similarity_contributions(docs, weights, w_query / query_norm)
+
+        doc_ids = self.corpus.doc_ids[candidates].tolist()
+        ranking = [(doc_id, sim) for doc_id, sim in zip(doc_ids, scores.tolist()) if sim > self.threshold]
+        return self.top_k(ranking, k)
+
+    def similarity_contributions(self, docs: np.ndarray, weights: np.ndarray, w_query: float) -> np.ndarray:
+        """Gets the contribution of a query token to the cosine similarity of documents given its weights in them"""
+        norms = self.corpus.stats.doc_norms[docs]
+        return np.divide(weights * w_query, norms, out=np.zeros(len(docs)), where=norms > 0)
+
+    def postings_scores(self, query_weights: Dict[int, float]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Computes the dot product between the documents and the query term at a time, the weights of
+        every query term, cached by the corpus, add its contribution to the documents that contain it.
+
+        Args:
+        - query_weights: the weight of every token of the query
+
+        Returns:
+        - tuple of np.array: the ordinals of the documents that contain a query term and their dot products
+        """
+        scores = np.zeros(len(self.corpus.documents))
+        for ti, w_query in query_weights.items():
+            self.corpus.get_term_weights(ti).add_to(scores, w_query)
+        candidates = self.corpus.get_candidate_docs(query_weights.keys())
+        return candidates, scores[candidates]
+
+    def sparse_scores(self, query_weights: Dict[int, float]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Computes the dot product between the documents and the query as the product of the
+        tf-idf matrix of the corpus by the query vector.
+
+        Args:
+        - query_weights: the weight of every token of the query
+
+        Returns:
+        - tuple of np.array: the ordinals of the documents with a positive dot product and their dot products
+        """
+        matrix = self.corpus.get_tfidf_matrix()
+        query_vector = np.zeros(matrix.shape[1])
+        query_vector[list(query_weights.keys())] = list(query_weights.values())
+        scores = matrix @ query_vector
+        candidates = np.flatnonzero(scores)
+        return candidates, scores[candidates]
+
+    def weight_query(self, ti: int, query_vect: Dict[int, int], max_freq: int = None):
+        freq = query_vect[ti]
+        if max_freq is None:
+            max_freq = max(query_vect.values())
         tf = freq / max_freq
         idf = self.idf(ti)
         return (self.a + (1 - self.a) * tf) * idf
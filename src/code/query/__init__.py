@@ -1,2 +1,3 @@
+from .boolean_query_plan import BooleanQueryPlan, PNormQueryPlan
 from .boolean_query_processor import BooleanQueryProcessor, InvalidQueryException
 from .query_processor import QueryProcessor
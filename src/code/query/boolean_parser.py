@@ -0,0 +1,222 @@
+"""Module to parse boolean queries and transform them into normal forms"""
+import re
+from itertools import product
+from typing import List, Tuple, FrozenSet
+
+
+class InvalidQueryException(Exception):
+    pass
+
+
+Literal = Tuple[str, bool]  # (term, negated)
+
+
+class Term:
+    def __init__(self, name: str):
+        self.name = name
+
+    def __repr__(self):
+        return self.name
+
+
+class Not:
+    def __init__(self, child):
+        self.child = child
+
+    def __repr__(self):
+        return f'~{self.child!r}'
+
+
+class And:
+    def __init__(self, children: list):
+        self.children = children
+
+    def __repr__(self):
+        return '(' + ' & '.join(repr(child) for child in self.children) + ')'
+
+
+class Or:
+    def __init__(self, children: list):
+        self.children = children
+
+    def __repr__(self):
+        return '(' + ' | '.join(repr(child) for child in self.children) + ')'
+
+
+class NormalForm:
+    """
+    A boolean query in disjunctive or conjunctive normal form.
+
+    Attributes:
+    - clauses: list of clauses, every clause is a list of (term, negated) literals. In a DNF the clauses are
+    conjunctive components joined by or, in a CNF they are disjunctive components joined by and
+    - kind: 'dnf' or 'cnf'
+    """
+
+    def __init__(self, clauses: List[List[Literal]], kind='dnf'):
+        self.clauses = clauses
+        self.kind = kind
+
+    def __str__(self):
+        inner, outer = (' & ', ' | ') if self.kind == 'dnf' else (' | ', ' & ')
+        components = []
+        for clause in self.clauses:
+            literals = [('~' if negated else '') + term for term, negated in clause]
+            component = inner.join(literals)
+            components.append(f'({component})' if len(literals) > 1 and len(self.clauses) > 1 else component)
+        return outer.join(components)
+
+    def __repr__(self):
+        return f'NormalForm({str(self)!r}, kind={self.kind!r})'
+
+
+class TokenStream:
+    """Tokens of a query and the position of the parser in them"""
+
+    def __init__(self, tokens: List[str]):
+        self.tokens = tokens
+        self.position = 0
+
+    def peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else None
+
+    def next(self):
+        token = self.peek()
+        if token is None:
+            raise InvalidQueryException('Invalid query, unexpected end of the query')
+        self.position += 1
+        return token
+
+
+class BooleanParser:
+    """
+    Recursive descent parser of boolean queries made of terms and the operators & (and), | (or),
+    ~ (not) and parentheses. Two terms without an operator between them are joined with &.
+
+    The grammar, from the lowest to the highest precedence, is:
+        expr     := and_expr ('|' and_expr)*
+        and_expr := not_expr ('&'? not_expr)*
+        not_expr := '~' not_expr | atom
+        atom     := '(' expr ')' | term
+    """
+    token_pattern = re.compile(r'[()&|~]|[^\s()&|~]+')
+    operators = {'&', '|', '~', '(', ')'}
+
+    def __init__(self, max_clauses: int = 256):
+        """
+        Args:
+        - max_clauses: the maximum number of clauses of a normal form, the queries
+        that exceed it when they are transformed raise an InvalidQueryException
+        """
+        self.max_clauses = max_clauses
+
+    def tokenize(self, query: str) -> List[str]:
+        """Splits the query into terms, operators and parentheses"""
+        return self.token_pattern.findall(query)
+
+    def parse(self, query: str):
+        """
+        Parses the query into its syntax tree.
+
+        Args:
+        - query: the query, with the operators already transformed into symbols
+
+        Returns:
+        - the root node of the syntax tree, or None if the query is empty
+        """
+        stream = TokenStream(self.tokenize(query))
+        if stream.peek() is None:
+            return None
+        node = self._parse_expr(stream)
+        if stream.peek() is not None:
+            raise InvalidQueryException(f'Invalid query, unexpected {stream.peek()!r}')
+        return node
+
+    def to_dnf(self, node) -> NormalForm:
+        """Transforms the syntax tree into its simplified disjunctive normal form"""
+        if node is None:
+            return NormalForm([], 'dnf')
+        return NormalForm(self._simplify(self._dnf(node, False)), 'dnf')
+
+    def to_cnf(self, node) -> NormalForm:
+        """
+        Transforms the syntax tree into its simplified conjunctive normal form, as the negation
+        of the literals of the disjunctive normal form of the negated query
+        """
+        if node is None:
+            return NormalForm([], 'cnf')
+        clauses = self._simplify(self._dnf(node, True))
+        return NormalForm([[(term, not negated) for term, negated in clause] for clause in clauses], 'cnf')
+
+    def _parse_expr(self, stream: TokenStream):
+        children = [self._parse_and(stream)]
+        while stream.peek() == '|':
+            stream.next()
+            children.append(self._parse_and(stream))
+        return children[0] if len(children) == 1 else Or(children)
+
+    def _parse_and(self, stream: TokenStream):
+        children = [self._parse_not(stream)]
+        while stream.peek() is not None and stream.peek() not in {'|', ')'}:
+            if stream.peek() == '&':
+                stream.next()
+            children.append(self._parse_not(stream))
+        return children[0] if len(children) == 1 else And(children)
+
+    def _parse_not(self, stream: TokenStream):
+        if stream.peek() == '~':
+            stream.next()
+            return Not(self._parse_not(stream))
+        return self._parse_atom(stream)
+
+    def _parse_atom(self, stream: TokenStream):
+        token = stream.next()
+        if token == '(':
+            node = self._parse_expr(stream)
+            if stream.next() != ')':
+                raise InvalidQueryException('Invalid query, unbalanced parentheses')
+            return node
+        if token in self.operators:
+            raise InvalidQueryException(f'Invalid query, unexpected {token!r}')
+        return Term(token)
+
+    def _dnf(self, node, negated: bool) -> List[FrozenSet[Literal]]:
+        """
+        Gets the conjunctive components of the node, the negations are pushed to the terms
+        with De Morgan's laws and the and nodes distribute over the or nodes of their children.
+        """
+        if isinstance(node, Term):
+            return [frozenset([(node.name, negated)])]
+        if isinstance(node, Not):
+            return self._dnf(node.child, not negated)
+
+        children = [self._dnf(child, negated) for child in node.children]
+        # under a negation an and becomes an or and vice versa
+        if isinstance(node, Or) != negated:
+            clauses = [clause for child in children for clause in child]
+        else:
+            size = 1
+            for child in children:
+                size *= len(child)
+            if size > self.max_clauses:
+                raise InvalidQueryException(f'Invalid query, it has more than {self.max_clauses} clauses')
+            clauses = [frozenset().union(*combination) for combination in product(*children)]
+        clauses = [clause for clause in dict.fromkeys(clauses) if not self._is_contradiction(clause)]
+        if len(clauses) > self.max_clauses:
+            raise InvalidQueryException(f'Invalid query, it has more than {self.max_clauses} clauses')
+        return clauses
+
+    @staticmethod
+    def _is_contradiction(clause: FrozenSet[Literal]) -> bool:
+        """A conjunctive component with a term and its negation can't be satisfied"""
+        return any((term, not negated) in clause for term, negated in clause)
+
+    @staticmethod
+    def _simplify(clauses: List[FrozenSet[Literal]]) -> List[List[Literal]]:
+        """Removes the repeated and absorbed clauses"""
+        clauses = set(clauses)
+        # a clause that contains another one is redundant, (a & b) | a == a
+        clauses = [clause for clause in clauses if not any(other < clause for other in clauses)]
+        # the terms go before the negated terms, the string form read by the extended boolean model expects it
+        clauses = [sorted(clause, key=lambda literal: (literal[1], literal[0])) for clause in clauses]
+        return sorted(clauses, key=lambda clause: (len(clause), [(negated, term) for term, negated in clause]))
@@ -0,0 +1,153 @@
+"""Module to evaluate boolean queries with set operations over the inverted index"""
+from typing import List, Tuple
+
+import numpy as np
+
+
+class BooleanQueryPlan:
+    """
+    Execution plan of a boolean query in disjunctive normal form. Every conjunctive component is
+    evaluated as the intersection of the postings of its terms, starting with the shortest list,
+    minus the postings of its negated terms. The result of the query is the union of its components.
+
+    Attributes:
+    - clauses: for each conjunctive component, the ids of its terms sorted by document frequency
+    and the ids of its negated terms
+    """
+
+    def __init__(self, clauses: List[Tuple[List[int], List[int]]]):
+        self.clauses = clauses
+
+    @classmethod
+    def compile(cls, dnf_clauses: List[List[Tuple[str, bool]]], corpus: "Corpus") -> "BooleanQueryPlan":
+        """
+        Builds the plan of a query.
+
+        Args:
+        - dnf_clauses: the conjunctive components of the query, as returned by BooleanQueryProcessor.get_dnf_clauses
+        - corpus: the corpus where the query is evaluated
+
+        Returns:
+        - BooleanQueryPlan: the plan of the query
+        """
+        clauses = []
+        for clause in dnf_clauses:
+            # the terms that aren't in the corpus have empty postings
+            positive = {corpus.index.token2id.get(term, -1) for term, negated in clause if not negated}
+            negative = {corpus.index.token2id.get(term, -1) for term, negated in clause if negated}
+            if positive & negative:
+                # a component with a term and its negation can't be satisfied
+                continue
+            positive = sorted(positive, key=corpus.postings.doc_freq)
+            negative = sorted(ti for ti in negative if corpus.postings.doc_freq(ti) > 0)
+            clauses.append((positive, negative))
+        return cls(clauses)
+
+    def execute(self, corpus: "Corpus") -> np.ndarray:
+        """
+        Evaluates the plan over the inverted index of the corpus.
+
+        Args:
+        - corpus: the corpus where the query is evaluated
+
+        Returns:
+        - np.array: the sorted ordinals of the documents that satisfy the query
+        """
+        results = []
+        for positive, negative in self.clauses:
+            docs = self._execute_clause(corpus, positive, negative)
+            if len(docs) == len(corpus.live_docs):
+                return docs
+            results.append(docs)
+
+        if len(results) == 0:
+            return np.zeros(0, dtype=np.int64)
+        return np.unique(np.concatenate(results))
+
+    @staticmethod
+    def _execute_clause(corpus: "Corpus", positive: List[int], negative: List[int]) -> np.ndarray:
+        if len(positive) == 0:
+            # only negated terms, the complement is taken from the documents that aren't deleted
+            docs = corpus.live_docs
+        else:
+            docs = corpus.get_postings(positive[0])[0]
+            for ti in positive[1:]:
+                if len(docs) == 0:
+                    return docs
+                docs = np.intersect1d(docs, corpus.get_postings(ti)[0], assume_unique=True)
+        for ti in negative:
+            if len(docs) == 0:
+                break
+            docs = np.setdiff1d(docs, corpus.get_postings(ti)[0], assume_unique=True)
+        return docs
+
+
+class PNormQueryPlan:
+    """
+    Plan of a boolean query in disjunctive normal form for the extended boolean model. The query is
+    stored as arrays, with the literals of every conjunctive component in consecutive positions:
+    - term_ids: the ids of the different terms of the query (-1 for the terms that aren't in the corpus)
+    - columns: for each literal, the position of its term in term_ids
+    - negated: for each literal, if the term is negated
+    - clause_starts: the position of the first literal of every conjunctive component
+    - clause_sizes: the number of literals of every conjunctive component
+    """
+
+    def __init__(self, term_ids: np.ndarray, columns: np.ndarray, negated: np.ndarray, clause_starts: np.ndarray):
+        self.term_ids = term_ids
+        self.columns = columns
+        self.negated = negated
+        self.clause_starts = clause_starts
+        self.clause_sizes = np.diff(np.append(clause_starts, len(columns)))
+
+    @classmethod
+    def compile(cls, dnf_clauses: List[List[Tuple[str, bool]]], corpus: "Corpus") -> "PNormQueryPlan":
+        """
+        Builds the plan of a query.
+
+        Args:
+        - dnf_clauses: the conjunctive components of the query, as returned by BooleanQueryProcessor.get_dnf_clauses
+        - corpus: the corpus where the query is evaluated
+
+        Returns:
+        - PNormQueryPlan: the plan of the query
+        """
+        positions = {}
+        columns, negated, clause_starts = [], [], []
+        for clause in dnf_clauses:
+            if len(clause) == 0:
+                continue
+            clause_starts.append(len(columns))
+            for term, is_negated in clause:
+                ti = corpus.index.token2id.get(term, -1)
+                columns.append(positions.setdefault(ti, len(positions)))
+                negated.append(is_negated)
+        term_ids = np.array(list(positions.keys()), dtype=np.int64)
+        return cls(term_ids, np.array(columns, dtype=np.int64), np.array(negated, dtype=bool),
+                   np.array(clause_starts, dtype=np.int64))
+
+    @property
+    def has_negations(self) -> bool:
+        return bool(self.negated.any())
+
+    def weights(self, term_weights: np.ndarray) -> np.ndarray:
+        """
+        Computes the weight of the query for many documents with the p-norm formulas (p = 2). A conjunctive
+        component weights 1 - sqrt(sum((1 - wi)^2) / n) and the query sqrt(sum(wc^2) / m), where wi are the
+        weights of the n terms of the component and wc the weights of the m components. A negated term
+        weights 1 if the document doesn't contain it and 0 otherwise.
+
+        Args:
+        - term_weights: matrix with the normalized weight of every term of term_ids (columns) in every document (rows)
+
+        Returns:
+        - np.array: the weight of the query for every document
+        """
+        num_docs = term_weights.shape[0]
+        if len(self.clause_starts) == 0:
+            return np.zeros(num_docs)
+        literal_weights = term_weights[:, self.columns]
+        literal_weights = np.where(self.negated, literal_weights == 0, literal_weights)
+        clause_weights = 1 - np.sqrt(np.add.reduceat((1 - literal_weights) ** 2, self.clause_starts, axis=1)
+                                     / self.clause_sizes)
+        return np.sqrt(np.sum(clause_weights ** 2, axis=1) / len(self.clause_starts))
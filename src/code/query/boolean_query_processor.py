@@ -1,41 +1,105 @@
-from sympy import sympify, to_dnf, SympifyError
+from functools import lru_cache
+from typing import List, Tuple
 
+from src.code.instrumentation import metrics
 from src.code.utils import to_lower, tokenize, remove_punctuation_without_parenthesis
+from .boolean_parser import BooleanParser, InvalidQueryException, NormalForm
 from .query_processor import QueryProcessor
 
 
-class InvalidQueryException(Exception):
-    pass
-
-
 class BooleanQueryProcessor(QueryProcessor):
-    def __init__(self, language: str = "english", stemming=False):
+    def __init__(self, language: str = "english", stemming=False, max_clauses=256, cache_size=1024):
+        """
+        Args:
+        - language: the language of the queries
+        - stemming: if True, the terms of the queries are stemmed
+        - max_clauses: the maximum number of conjunctive components of the DNF of a query
+        - cache_size: the number of normalized queries whose DNF is kept in the LRU cache
+        """
         super().__init__(language, stemming)
         self.operators = {'&', '|', '~', '(', ')'}
-        # TODO fill reserved words for handle exceptions
-        self.reserved_words = []  # words that raise errors when call the sympify function
+        self.parser = BooleanParser(max_clauses)
+        self.normalized_query_to_dnf = lru_cache(maxsize=cache_size)(self._normalized_query_to_dnf)
+
+    def query_to_dnf(self, query: str) -> NormalForm:
+        """
+        First clean the query and then transforms it into a DNF expression, parsing it and distributing
+        the and operators over the or operators. The DNF of the last normalized queries are cached.
+
+        Args:
+        - query: the query of the user
 
-    def query_to_dnf(self, query: str):
+        Returns:
+        - NormalForm: the DNF expression
+        """
+        return self.normalized_query_to_dnf(self.normalize_query(query))
+
+    def query_to_cnf(self, query: str) -> NormalForm:
         """
-        First clean the query and then transforms it into a DNF expression, using sympify and to_dnf functions from sympy.
+        First clean the query and then transforms it into a CNF expression.
 
         Args:
         - query: the query of the user
 
         Returns:
-        - sympy expression: the DNF expression
+        - NormalForm: the CNF expression
+        """
+        return self.parser.to_cnf(self._parse(self.normalize_query(query)))
+
+    def normalize_query(self, query: str) -> str:
+        """
+        Cleans and tokenizes the query, the result is used as the key of the cache of the query.
+
+        Args:
+        - query: the query of the user
+
+        Returns:
+        - str: the processed tokens of the query separated by spaces
         """
         clear_query = self.clean_query(query)
         tokens = self.tokenize_boolean_query(clear_query)
-        processed_query = ''.join(tokens)
-        if processed_query == "":
-            return ""
+        return ' '.join(tokens)
+
+    def _normalized_query_to_dnf(self, normalized_query: str) -> NormalForm:
+        node = self._parse(normalized_query)
+        with metrics.timer('dnf'):
+            return self.parser.to_dnf(node)
+
+    def _parse(self, normalized_query: str):
         try:
-            query_expr = sympify(processed_query, evaluate=False)
-            query_dnf = to_dnf(query_expr, simplify=True, force=True)
-        except (TypeError, SympifyError):
-            raise InvalidQueryException(f'Invalid query, due to sympify function')
-        return query_dnf
+            with metrics.timer('parse'):
+                return self.parser.parse(normalized_query)
+        except RecursionError:
+            raise InvalidQueryException('Invalid query, it is too nested')
+
+    @staticmethod
+    def get_dnf_clauses(dnf_query: NormalForm) -> List[List[Tuple[str, bool]]]:
+        """
+        Splits a DNF expression into its conjunctive components. The components are copied, the DNF is shared
+        by the cache of the queries and changing it would change the plan of the later queries.
+
+        Args:
+        - dnf_query: the DNF expression returned by query_to_dnf
+
+        Returns:
+        - list of list of (str, bool): for each conjunctive component, its terms and if they are negated
+        """
+        return [list(clause) for clause in dnf_query.clauses]
+
+    def get_query_clauses(self, normalized_query: str) -> List[List[Tuple[str, bool]]]:
+        """
+        Gets the conjunctive components of the DNF of a normalized query without the stopwords,
+        they are not indexed so they are removed from the query instead of never matching.
+
+        Args:
+        - normalized_query: the query returned by normalize_query
+
+        Returns:
+        - list of list of (str, bool): for each conjunctive component, its terms and if they are negated
+        """
+        dnf_query = self.normalized_query_to_dnf(normalized_query)
+        return [[(term, negated) for term, negated in clause if term not in self.stopwords]
+                for clause in self.get_dnf_clauses(dnf_query)]
 
     @staticmethod
     def clean_query(query: str):
@@ -50,7 +114,7 @@ class BooleanQueryProcessor(QueryProcessor):
 
     def tokenize_boolean_query(self, query: str):
         """
-        Tokenize the query, removing the reserved words and adding the & boolean operator to the tokens if needed.
+        Tokenize the query, adding the & boolean operator to the tokens if needed.
 
         Args:
         - query: the query of the user
@@ -64,8 +128,6 @@ class BooleanQueryProcessor(QueryProcessor):
         if self.stemmer is not None:
             tokens = self.stemming(tokens)
 
-        tokens = [token for token in tokens if token not in self.reserved_words]
-
         for i in range(len(tokens) - 1):
             if tokens[i] not in self.operators and (tokens[i + 1] not in self.operators or tokens[i + 1] == '~'):
                 tokens[i] = tokens[i] + ' &'
@@ -4,6 +4,7 @@ from typing import List
 import nltk
 from gensim.corpora import Dictionary
 
+from src.code.instrumentation import metrics
 from src.code.utils import to_lower, remove_punctuation, tokenize
 
 
@@ -27,14 +28,15 @@ class QueryProcessor:
         Returns:
         - list of str: the tokens of the text
         """
-        if remove_puncts:
-            text = remove_punctuation(text)
-        text = to_lower(text)
-        tokens = tokenize(text)
-        tokens = [tok for tok in tokens if tok not in stopwords]
-        if self.stemmer is not None:
-            tokens = self.stemming(tokens)
-        return tokens
+        with metrics.timer('parse'):
+            if remove_puncts:
+                text = remove_punctuation(text)
+            text = to_lower(text)
+            tokens = tokenize(text)
+            tokens = [tok for tok in tokens if tok not in stopwords]
+            if self.stemmer is not None:
+                tokens = self.stemming(tokens)
+            return tokens
 
     def stemming(self, tokens: List[str]) -> List[str]:
         return [self.stemmer.stem(tok) for tok in tokens]
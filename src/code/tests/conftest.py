@@ -0,0 +1,91 @@
+"""
+Fixtures of the tests. The modules save their data in ../../data relative to the working directory, so the
+tests that build corpora or models run in a temporary tree with the same layout.
+"""
+import shutil
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import pytest
+
+from corpus import Corpus, TestCorpus
+
+
+@pytest.fixture
+def workdir(tmp_path: Path, monkeypatch) -> Path:
+    """Changes the working directory to tmp_path/src/code, with the data folders in tmp_path/data"""
+    for folder in ('indexed_corpus', 'cluster', 'ratings', 'corpus'):
+        (tmp_path / 'data' / folder).mkdir(parents=True)
+    code = tmp_path / 'src' / 'code'
+    code.mkdir(parents=True)
+    monkeypatch.chdir(code)
+    return code
+
+
+TEXTS = [
+    'the boundary layer of the flow over a flat plate',
+    'heat transfer in the laminar boundary layer',
+    'supersonic flow around a wing at high mach number',
+    'the pressure distribution over a slender wing',
+    'buckling of thin cylindrical shells under pressure',
+    'vibration of plates and shells with heat',
+    'turbulent flow in a pipe with heat transfer',
+    'the shock wave in front of a blunt body at high mach number',
+    'stability of the laminar flow between plates',
+    'aerodynamic heating of a blunt body in supersonic flow',
+    'the stress of shells under thermal load',
+    'the lift of a slender wing in subsonic flow',
+]
+
+
+@pytest.fixture
+def make_corpus(workdir: Path):
+    """
+    Gets a function that writes texts as the files of a test corpus and indexes them, the ids of the documents
+    are their positions starting at 1. The corpus is loaded from the saved index when it's called again.
+    """
+    path = workdir.parent.parent / 'data' / 'corpus' / 'test'
+
+    def make(texts=TEXTS, **kwargs) -> TestCorpus:
+        if not path.exists():
+            path.mkdir()
+            for i, text in enumerate(texts):
+                (path / f'{i:04d}.txt').write_text(text)
+        return TestCorpus(path, **kwargs)
+
+    return make
+
+
+@pytest.fixture
+def synthetic_corpus(workdir: Path) -> TestCorpus:
+    """Indexes a corpus of 400 synthetic documents generated by the benchmarks, with the words of a Zipf law"""
+    from benchmark import SyntheticCorpus
+
+    path = workdir.parent.parent / 'data' / 'corpus' / 'test'
+    SyntheticCorpus(num_docs=400, doc_length=60, vocab_size=800).write(path)
+    return TestCorpus(path, workers=1)
+
+
+class IdentifiedCorpus(TestCorpus):
+    """Test corpus whose files start with the id and the title of their document, as write_documents writes them"""
+
+    def parse_documents(self, path):
+        Corpus.parse_documents(self, path)
+
+    @staticmethod
+    def parse_source(file):
+        doc_id, title, text = file.read_text().split(' ', 2)
+        yield int(doc_id), title, text
+
+
+def write_documents(path: Path, documents: Dict[int, Tuple[str, str]]):
+    """Replaces the files of a corpus with the documents by id, every title is a single word"""
+    shutil.rmtree(path, ignore_errors=True)
+    path.mkdir()
+    for doc_id, (title, text) in documents.items():
+        (path / f'{doc_id:04d}.txt').write_text(f'{doc_id} {title} {text}')
+
+
+def write_corpus(path: Path, texts: List[str], first_id=1):
+    """Replaces the files of a corpus with the texts, numbered from first_id"""
+    write_documents(path, {first_id + i: (f'{i:04d}', text) for i, text in enumerate(texts)})
@@ -0,0 +1,44 @@
+import time
+
+import pytest
+
+from benchmark import Benchmark, compare
+
+
+def report(**measures):
+    return {'benchmarks': {name: {'min': low, 'median': median} for name, (low, median) in measures.items()}}
+
+
+@pytest.mark.parametrize('measures, regressed', [
+    ((0.010, 0.012), False),
+    # a single slow measure moves the median but not the min
+    ((0.010, 0.020), False),
+    # the min is slower but most measures aren't
+    ((0.020, 0.012), False),
+    ((0.020, 0.024), True),
+])
+def test_compare_needs_the_min_and_the_median(measures, regressed):
+    regressions = compare(report(rank=measures), report(rank=(0.010, 0.012)), threshold=0.2)
+    assert ('rank' in regressions) == regressed
+    if regressed:
+        assert regressions['rank'] == pytest.approx(2.0)
+
+
+def test_compare_skips_the_benchmarks_without_baseline():
+    assert compare(report(rank=(1.0, 1.0), new=(1.0, 1.0)), report(rank=(1.0, 1.0)), threshold=0.2) == {}
+
+
+def test_fast_runs_are_looped_to_the_min_time():
+    calls = []
+    benchmark = Benchmark('sleep', lambda: time.sleep(0.001), setup=lambda: calls.append(1))
+    measures = benchmark.measure(warmup=1, repeat=3, min_time=0.02)
+    assert measures['loops'] >= 5
+    assert measures['repeat'] == 3
+    assert len(calls) == 1 + 3 * measures['loops'] + 1
+    assert 0.001 <= measures['min'] <= measures['median'] < 0.02
+
+
+def test_slow_runs_are_not_looped():
+    benchmark = Benchmark('sleep', lambda: time.sleep(0.01))
+    measures = benchmark.measure(warmup=0, repeat=2, min_time=0.005)
+    assert measures['loops'] == 1
@@ -0,0 +1,126 @@
+from itertools import product
+
+import pytest
+
+from models import BooleanModel, ExtendedBooleanModel
+from query import BooleanQueryProcessor, InvalidQueryException
+from query.boolean_parser import BooleanParser
+
+# the DNF of every query with the sympy pipeline that the parser replaced
+BASELINE = {
+    'flow': 'flow',
+    'flow wing': 'flow & wing',
+    'flow and wing': 'flow & wing',
+    'flow or wing': 'flow | wing',
+    'not flow': '~flow',
+    'flow and not wing': 'flow & ~wing',
+    'not (flow or heat)': '~flow & ~heat',
+    'not (flow and heat)': '~flow | ~heat',
+    '(flow or heat) and (wing or plate)': '(flow & plate) | (flow & wing) | (heat & plate) | (heat & wing)',
+    '(flow or heat) and not (wing or plate)': '(flow & ~plate & ~wing) | (heat & ~plate & ~wing)',
+    'flow and (wing or not heat)': '(flow & wing) | (flow & ~heat)',
+    'flow or (wing and heat) or (flow and plate)': 'flow | (heat & wing)',
+    'flow and not flow': 'flow & ~flow',
+    'flow or not flow': 'flow | ~flow',
+    '(flow and wing) or (flow and not wing)': 'flow',
+    'boundary layer or (shock and not wave)': '(boundary & layer) | (shock & ~wave)',
+    '((flow))': 'flow',
+    'heat transfer and not (laminar or turbulent)': 'heat & transfer & ~laminar & ~turbulent',
+    'mach and (number or body) and not (blunt and shock)':
+        '(body & mach & ~blunt) | (body & mach & ~shock) | (mach & number & ~blunt) | (mach & number & ~shock)',
+    '(a or b) and (c or d) and (e or f)':
+        '(a & c & e) | (a & c & f) | (a & d & e) | (a & d & f) | (b & c & e) | (b & c & f) | (b & d & e) | '
+        '(b & d & f)',
+}
+# sympy also removed the contradictions and merged the clauses that differ in a negation, the DNF is equivalent
+SIMPLIFIED_BY_SYMPY = {'flow and not flow', '(flow and wing) or (flow and not wing)'}
+
+
+def satisfies(clauses, terms, kind='dnf'):
+    def literal(term, negated):
+        return (term in terms) != negated
+
+    if kind == 'dnf':
+        return any(all(literal(*lit) for lit in clause) for clause in clauses)
+    return all(any(literal(*lit) for lit in clause) for clause in clauses)
+
+
+def baseline_clauses(query):
+    return BooleanParser().to_dnf(BooleanParser().parse(BASELINE[query])).clauses
+
+
+def variables(*forms):
+    return sorted({term for clauses in forms for clause in clauses for term, _ in clause})
+
+
+@pytest.mark.parametrize('query', BASELINE)
+def test_dnf_matches_the_baseline(query):
+    dnf = BooleanQueryProcessor().query_to_dnf(query)
+    if query not in SIMPLIFIED_BY_SYMPY:
+        assert str(dnf) == BASELINE[query]
+    expected = baseline_clauses(query)
+    terms = variables(dnf.clauses, expected)
+    for values in product([False, True], repeat=len(terms)):
+        present = {term for term, value in zip(terms, values) if value}
+        assert satisfies(dnf.clauses, present) == satisfies(expected, present)
+
+
+@pytest.mark.parametrize('query', BASELINE)
+def test_cnf_is_equivalent_to_the_dnf(query):
+    processor = BooleanQueryProcessor()
+    dnf, cnf = processor.query_to_dnf(query), processor.query_to_cnf(query)
+    terms = variables(dnf.clauses, cnf.clauses)
+    for values in product([False, True], repeat=len(terms)):
+        present = {term for term, value in zip(terms, values) if value}
+        assert satisfies(dnf.clauses, present) == satisfies(cnf.clauses, present, 'cnf')
+
+
+@pytest.mark.parametrize('query', ['(flow', 'flow)', 'or flow', '()', 'flow and (wing or'])
+def test_invalid_queries(query):
+    with pytest.raises(InvalidQueryException):
+        BooleanQueryProcessor().query_to_dnf(query)
+
+
+def test_too_many_clauses():
+    query = ' and '.join(f'(a{i} or b{i})' for i in range(9))
+    with pytest.raises(InvalidQueryException):
+        BooleanQueryProcessor(max_clauses=256).query_to_dnf(query)
+    assert len(BooleanQueryProcessor(max_clauses=512).query_to_dnf(query).clauses) == 512
+
+
+def test_empty_query():
+    assert BooleanQueryProcessor().query_to_dnf('').clauses == []
+    assert str(BooleanQueryProcessor().query_to_dnf('  ')) == ''
+
+
+def test_boolean_model_matches_the_baseline(make_corpus):
+    corpus = make_corpus()
+    model = BooleanModel(corpus)
+    processor = model.query_processor
+    documents = {doc.doc_id: set(doc.doc_tokens) for doc in corpus.documents}
+    for query in BASELINE:
+        # the stopwords aren't indexed, the baseline ignored them as well
+        expected = [[(term, negated) for term, negated in clause if term not in processor.stopwords]
+                    for clause in baseline_clauses(query)]
+        matches = {doc_id for doc_id, terms in documents.items() if satisfies(expected, terms)}
+        assert set(model.search(query).doc_ids) == matches, query
+
+
+def test_extended_boolean_model_ranks_the_matches_first(make_corpus):
+    corpus = make_corpus()
+    model = ExtendedBooleanModel(corpus)
+    query = '(flow or heat) and not (wing or plate)'
+    expected = baseline_clauses(query)
+    matches = {doc.doc_id for doc in corpus.documents if satisfies(expected, set(doc.doc_tokens))}
+    ranking = model.search(query).doc_ids
+    assert matches and set(ranking[:len(matches)]) == matches
+
+
+def test_changing_the_clauses_keeps_the_cached_dnf():
+    processor = BooleanQueryProcessor()
+    dnf = processor.query_to_dnf('flow and (wing or heat)')
+    expected = str(dnf)
+    clauses = processor.get_dnf_clauses(dnf)
+    clauses[0].append(('plate', True))
+    clauses.append([('shock', False)])
+    assert str(processor.query_to_dnf('flow and (wing or heat)')) == expected == '(flow & heat) | (flow & wing)'
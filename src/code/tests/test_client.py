@@ -0,0 +1,61 @@
+import pytest
+
+from client import SearchService, create_app
+from models import BooleanModel, ExtendedBooleanModel, VectorModel
+
+
+@pytest.fixture
+def service(make_corpus):
+    corpus = make_corpus()
+    models = {'extended': ExtendedBooleanModel(corpus), 'boolean': BooleanModel(corpus), 'vector': VectorModel(corpus)}
+    return SearchService(corpus, models, max_k=20)
+
+
+@pytest.fixture
+def client(service):
+    return create_app(service, instrumentation=False).test_client()
+
+
+def test_search(client, service):
+    response = client.get('/search', query_string={'q': 'flow', 'model': 'vector', 'k': 3})
+    assert response.status_code == 200
+    expected = service.models['vector'].rank('flow', 3)
+    assert [result['doc_id'] for result in response.json['results']] == [doc_id for doc_id, _ in expected]
+
+
+def test_search_titles_rank_only_the_page(client, service, monkeypatch):
+    model = service.models['extended']
+    ks = []
+    rank = model.rank
+    monkeypatch.setattr(model, 'rank', lambda query, k=None: ks.append(k) or rank(query, k))
+    response = client.get('/search/flow or heat', query_string={'k': 2})
+    assert response.status_code == 200
+    expected = [service.corpus.id2doc(doc_id).doc_title for doc_id, _ in rank('flow or heat', 2)]
+    assert response.json['results'] == expected
+    assert ks == [2]
+
+    client.get('/search/flow or heat')
+    assert ks == [2, 10]
+
+
+@pytest.mark.parametrize('k', [0, 21])
+def test_search_titles_bound_k(client, k):
+    response = client.get('/search/flow', query_string={'k': k})
+    assert response.status_code == 400
+    assert response.json['error'] == 'k must be between 1 and 20'
+
+
+@pytest.mark.parametrize('path', ['/search/(flow and wing', '/search?q=(flow and wing'])
+def test_invalid_queries_are_bad_requests(client, path):
+    response = client.get(path)
+    assert response.status_code == 400
+    assert response.json['error'] == 'invalid query'
+
+
+def test_searches_dont_save_ratings(client, service, workdir):
+    ratings = workdir.parent.parent / 'data' / 'ratings'
+    before = sorted(ratings.iterdir())
+    for path in ['/search/flow', '/search/heat and not wing', '/search?q=flow&model=extended']:
+        assert client.get(path).status_code == 200
+    assert sorted(ratings.iterdir()) == before
+    assert all(len(model.document_recommender.ratings) == 0 for model in service.models.values())
@@ -0,0 +1,87 @@
+import numpy as np
+
+from models import BooleanModel, VectorModel
+
+
+def clustered_docs(clusterer):
+    return clusterer.get_cluster_docs(range(len(clusterer.cluster_offsets) - 1)).tolist()
+
+
+def test_models_share_the_clusterer(make_corpus):
+    corpus = make_corpus()
+    assert VectorModel(corpus).clusterer is BooleanModel(corpus).clusterer
+
+
+def test_clusters_follow_the_corpus(make_corpus):
+    corpus = make_corpus()
+    vector = VectorModel(corpus, nprobe=len(corpus.documents))
+    boolean = BooleanModel(corpus)
+    clusterer = vector.clusterer
+    assert clustered_docs(clusterer) == corpus.live_docs.tolist()
+
+    boolean.add_documents([(100, 'a', 'flow over a cone')])
+    corpus.add_documents([(101, 'b', 'heat of a cone')])
+    corpus.update_document((2, 'c', 'the cone of a wing'))
+    corpus.delete_documents([3])
+    assert clustered_docs(clusterer) == corpus.live_docs.tolist()
+    assert clusterer.X.shape[0] == len(corpus.documents)
+    assert {100, 101, 2} <= {doc.doc_id for doc in vector.query('cone')}
+
+
+def test_clusters_saved_before_the_corpus(make_corpus):
+    corpus = make_corpus()
+    clusterer = VectorModel(corpus).clusterer
+    corpus.add_documents([(100, 'a', 'flow over a cone')])
+    corpus.delete_documents([1])
+    clusterer.sync()
+    clusterer.save_model()
+
+    # the corpus didn't save its changes, the clusters are updated to the saved corpus
+    reopened = make_corpus()
+    clusterer = VectorModel(reopened).clusterer
+    assert clustered_docs(clusterer) == reopened.live_docs.tolist()
+    reopened.add_documents([(200, 'b', 'heat of a cone')])
+    assert clustered_docs(clusterer) == reopened.live_docs.tolist()
+    assert clusterer.X.shape[0] == len(reopened.documents)
+    np.testing.assert_allclose(clusterer.X[-1].toarray(), clusterer.get_doc_vectors([len(reopened.documents) - 1])
+                               [:, :clusterer.X.shape[1]].toarray())
+
+
+def test_changes_are_saved_every_flush_size_documents(make_corpus, monkeypatch):
+    corpus = make_corpus(flush_size=3)
+    clusterer = VectorModel(corpus).clusterer
+    saves = []
+    monkeypatch.setattr(type(clusterer), 'save_model', lambda self: saves.append(len(self.cluster_map)))
+    clusterer._unsaved_changes = 0
+    corpus.add_documents([(100, 'a', 'flow over a cone')])
+    clusterer.sync()
+    corpus.delete_documents([1])
+    clusterer.sync()
+    assert saves == []
+    corpus.add_documents([(101, 'b', 'heat of a cone')])
+    clusterer.sync()
+    assert saves == [len(corpus.live_docs)]
+
+
+def test_elbow_samples_the_sparse_vectors(make_corpus, monkeypatch):
+    import clustering
+
+    fitted = []
+
+    class Visualizer:
+        elbow_value_ = 4
+
+        def __init__(self, model, k, metric):
+            pass
+
+        def fit(self, X):
+            fitted.append(X.shape)
+
+        def show(self):
+            pass
+
+    monkeypatch.setattr(clustering, 'KElbowVisualizer', Visualizer)
+    corpus = make_corpus()
+    clusterer = clustering.ClusterManager(corpus)
+    assert clusterer.elbow_method(sample_size=5) == 4
+    assert fitted == [(5, clusterer.X.shape[1])]
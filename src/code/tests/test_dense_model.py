@@ -0,0 +1,68 @@
+import shutil
+import threading
+
+import numpy as np
+import pytest
+
+from conftest import IdentifiedCorpus, write_corpus
+from models import DenseRetrievalModel, EmbeddingStore, HashingEncoder
+
+
+def test_embeddings_of_another_corpus_are_not_reused(workdir):
+    path = workdir.parent.parent / 'data' / 'corpus' / 'test'
+    indexed = workdir.parent.parent / 'data' / 'indexed_corpus'
+    texts = ['flow over a wing', 'heat of a plate', 'shells under pressure', 'a blunt body', 'a slender cone']
+    write_corpus(path, texts, 1)
+    DenseRetrievalModel(IdentifiedCorpus(path, workers=1), HashingEncoder(64))
+
+    shutil.rmtree(indexed / 'test')
+    write_corpus(path, texts[1:] + texts[:1], 10)
+    corpus = IdentifiedCorpus(path, workers=1)
+    model = DenseRetrievalModel(corpus, HashingEncoder(64))
+    assert model.search('wing flow').doc_ids[0] == 14
+
+    # the same corpus loads the saved embeddings
+    loaded = DenseRetrievalModel(corpus, HashingEncoder(64))
+    np.testing.assert_array_equal(loaded.store.vectors, model.store.vectors)
+
+
+def test_new_documents_are_encoded(make_corpus):
+    corpus = make_corpus()
+    model = DenseRetrievalModel(corpus, HashingEncoder(64), dtype='int8')
+    store = model.store
+    corpus.add_documents([(100, 'cone', 'supersonic cone')])
+    assert model.search('supersonic cone').doc_ids[0] == 100
+    assert len(model.store) == len(store) + 1
+    assert len(model.store.scales) == len(model.store)
+
+
+@pytest.mark.parametrize('dtype', ['float32', 'float16', 'int8'])
+def test_append_makes_a_new_store(dtype):
+    rng = np.random.default_rng(0)
+    store = EmbeddingStore.empty(8, dtype).append(rng.normal(size=(5, 8)))
+    vectors, scales = store.vectors, store.scales
+    appended = store.append(rng.normal(size=(3, 8)))
+    assert store.vectors is vectors and store.scales is scales
+    assert len(store) == 5 and len(appended) == 8
+    np.testing.assert_allclose(appended.dequantize(slice(0, 5)), store.dequantize(), atol=1e-6)
+
+
+def test_queries_during_appends(make_corpus):
+    corpus = make_corpus()
+    model = DenseRetrievalModel(corpus, HashingEncoder(64), dtype='int8')
+    errors = []
+
+    def search():
+        try:
+            for _ in range(200):
+                model.dense_ranking(np.ones(64, dtype=np.float32) / 8, 3)
+        except Exception as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=search)
+    thread.start()
+    for i in range(20):
+        corpus.add_documents([(100 + i, 'new', f'cone number {i}')])
+        model._check_index()
+    thread.join()
+    assert errors == []
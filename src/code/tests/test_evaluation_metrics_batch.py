@@ -0,0 +1,76 @@
+import random
+
+import numpy as np
+import pytest
+
+import evaluation_metrics as em
+import evaluation_metrics_batch as emb
+
+
+def random_batch(seed: int, num_queries=30, num_documents=60):
+    rng = random.Random(seed)
+    runs, relevant = [], []
+    for _ in range(num_queries):
+        runs.append(rng.sample(range(1, num_documents + 1), rng.randint(0, 25)))
+        relevant.append(rng.sample(range(1, num_documents + 1), rng.randint(1, 15)))
+    return runs, relevant
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_per_query_matches_evaluation_metrics(seed):
+    runs, relevant = random_batch(seed)
+    r = 5
+    for run, rel, metrics in zip(runs, relevant, emb.per_query(runs, relevant, 60, r)):
+        assert metrics['precision'] == pytest.approx(em.precision(run, rel))
+        assert metrics['recall'] == pytest.approx(em.recall(run, rel))
+        assert metrics['f1'] == pytest.approx(em.f1(run, rel))
+        assert metrics['fallout'] == pytest.approx(em.fallout(run, rel, 60))
+        assert metrics['r_precision'] == pytest.approx(em.r_precision(run, rel, r))
+        assert metrics['r_recall'] == pytest.approx(em.r_recall(run, rel, r))
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_ranking_metrics_match_definitions(seed):
+    runs, relevant = random_batch(seed)
+    matrix = emb.RelevanceMatrix.from_runs(runs, relevant, 60)
+    for i, (run, rel) in enumerate(zip(runs, relevant)):
+        hits = [rank for rank, doc in enumerate(run, start=1) if doc in rel]
+        expected_ap = sum((j + 1) / rank for j, rank in enumerate(hits)) / len(rel)
+        assert emb.average_precision(matrix)[i] == pytest.approx(expected_ap)
+        assert emb.reciprocal_rank(matrix)[i] == pytest.approx(1 / hits[0] if hits else 0)
+        dcg = sum(1 / np.log2(rank + 1) for rank in hits if rank <= 5)
+        idcg = sum(1 / np.log2(rank + 1) for rank in range(1, min(len(rel), 5) + 1))
+        assert emb.ndcg(matrix, (5,))[i, 0] == pytest.approx(dcg / idcg)
+
+
+def test_graded_relevance():
+    class Qrel:
+        def __init__(self, doc_id, relevance):
+            self.doc_id = doc_id
+            self.relevance = relevance
+
+    matrix = emb.RelevanceMatrix.from_runs([['b', 'x', 'a']], [[Qrel('a', 3), Qrel('b', 1)]], 10)
+    dcg = 1 + 7 / np.log2(4)
+    idcg = 7 + 1 / np.log2(3)
+    assert emb.ndcg(matrix)[0, 0] == pytest.approx(dcg / idcg)
+
+
+def test_empty_runs():
+    runs, relevant = [[], []], [['1'], ['2']]
+    results = emb.evaluate(runs, relevant, 10)
+    assert all(value == 0 for value in results.values())
+    for metrics in emb.per_query(runs, relevant, 10):
+        assert all(value == 0 for value in metrics.values())
+
+
+def test_empty_and_non_empty_runs():
+    metrics = emb.per_query([[], ['2', '1']], [['1'], ['1']], 10)
+    assert metrics[0]['reciprocal_rank'] == 0
+    assert metrics[0]['average_precision'] == 0
+    assert metrics[1]['reciprocal_rank'] == 0.5
+    assert metrics[1]['average_precision'] == 0.5
+
+
+def test_empty_batch():
+    assert emb.per_query([], [], 10) == []
+    assert emb.evaluate([], [], 10)['mrr'] == 0
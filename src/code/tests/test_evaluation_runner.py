@@ -0,0 +1,36 @@
+from collections import namedtuple
+
+import pytest
+
+from evaluation_runner import EvaluationRunner
+from models import BooleanModel, VectorModel
+
+Query = namedtuple('Query', ['query_id', 'text'])
+Qrel = namedtuple('Qrel', ['query_id', 'doc_id', 'relevance'])
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_queries_without_results(make_corpus, workers):
+    corpus = make_corpus()
+    queries = [Query(str(i), f'{term} and not {term}') for i, term in enumerate(['flow', 'wing', 'heat'] * 7)]
+    qrels = [Qrel(query.query_id, '1', 1) for query in queries]
+    report = EvaluationRunner(corpus, {'boolean': BooleanModel(corpus)}, queries, qrels, workers=workers).run()
+
+    result = report['models']['boolean']
+    assert result['evaluated'] == len(queries)
+    assert result['failed'] == 0
+    assert result['quality']['precision'] == 0
+    assert result['quality']['mrr'] == 0
+
+
+def test_metrics_of_the_runs(make_corpus):
+    corpus = make_corpus()
+    queries = [Query('1', 'boundary layer'), Query('2', 'shells'), Query('3', 'nothing matches this')]
+    qrels = [Qrel('1', '1', 2), Qrel('1', '2', 1), Qrel('2', '6', 1), Qrel('3', '3', 1)]
+    runner = EvaluationRunner(corpus, {'vector': VectorModel(corpus)}, queries, qrels, workers=1, r=2)
+    result = runner.run()['models']['vector']
+
+    assert result['evaluated'] == 3
+    # the relevant documents of the first two queries are their best documents, the third one retrieves nothing
+    assert result['quality']['r_recall'] == pytest.approx(2 / 3)
+    assert result['quality']['mrr'] == pytest.approx(2 / 3)
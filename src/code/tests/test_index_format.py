@@ -0,0 +1,143 @@
+import struct
+
+import numpy as np
+import pytest
+
+from corpus.index_format import ALIGNMENT, FORMAT_VERSION, IndexFormatError, StringArray, read_index, write_index
+
+SECTIONS = {
+    'doc_ids': np.array([3, 1, 2], dtype=np.int64),
+    'weights': np.array([0.5, 1.25, -2.0], dtype=np.float64),
+    'norms': np.array([1.5, 2.5], dtype=np.float32),
+    'codes': np.array([-3, 0, 7, 127], dtype=np.int8),
+    'deleted': np.array([True, False, True]),
+    'empty': np.zeros(0, dtype=np.int32),
+}
+META = {'vocab_start': 4, 'segments': ['_0', '_1'], 'name': 'índice'}
+
+
+def set_version(path, version):
+    data = bytearray(path.read_bytes())
+    data[8:12] = struct.pack('<I', version)
+    path.write_bytes(bytes(data))
+
+
+def test_round_trip(tmp_path):
+    path = tmp_path / 'index.bin'
+    write_index(path, SECTIONS, META)
+    sections, meta = read_index(path)
+    assert meta == META
+    assert sections.keys() == SECTIONS.keys()
+    for name, array in SECTIONS.items():
+        assert sections[name].dtype == array.dtype
+        np.testing.assert_array_equal(sections[name], array)
+        # the sections are read only views of the file
+        assert not sections[name].flags.writeable
+    assert not tmp_path.joinpath('index.bin.tmp').exists()
+
+
+def test_round_trip_without_meta(tmp_path):
+    path = tmp_path / 'index.bin'
+    write_index(path, {'values': np.arange(10, dtype=np.uint32)[::2]})
+    sections, meta = read_index(path)
+    assert meta == {}
+    np.testing.assert_array_equal(sections['values'], [0, 2, 4, 6, 8])
+
+
+def test_sections_are_aligned(tmp_path):
+    path = tmp_path / 'index.bin'
+    write_index(path, SECTIONS, META)
+    data = path.read_bytes()
+    for name, array in SECTIONS.items():
+        if len(array):
+            start = data.index(array.tobytes(), 1)
+            assert start % ALIGNMENT == 0, name
+    assert len(data) % ALIGNMENT == 0
+
+
+def test_overwrite_keeps_the_readers_of_the_old_file(tmp_path):
+    path = tmp_path / 'index.bin'
+    write_index(path, {'values': np.arange(4)})
+    old, _ = read_index(path)
+    write_index(path, {'values': np.arange(4) * 10})
+    new, _ = read_index(path)
+    np.testing.assert_array_equal(old['values'], [0, 1, 2, 3])
+    np.testing.assert_array_equal(new['values'], [0, 10, 20, 30])
+
+
+@pytest.mark.parametrize('version', [0, FORMAT_VERSION + 1])
+def test_version_mismatch(tmp_path, version):
+    path = tmp_path / 'index.bin'
+    write_index(path, SECTIONS, META)
+    set_version(path, version)
+    with pytest.raises(IndexFormatError, match=f'version {version} of the format, expected {FORMAT_VERSION}'):
+        read_index(path)
+
+
+def test_not_an_index(tmp_path):
+    path = tmp_path / 'index.bin'
+    path.write_bytes(b'\x80\x04pickled' + bytes(64))
+    with pytest.raises(IndexFormatError, match='not an index file'):
+        read_index(path)
+
+
+def test_truncated_files(tmp_path):
+    path = tmp_path / 'index.bin'
+    write_index(path, SECTIONS, META)
+    data = path.read_bytes()
+    path.write_bytes(data[:10])
+    with pytest.raises(IndexFormatError, match='truncated'):
+        read_index(path)
+    # the meta is the last section, so cutting the file removes part of it
+    path.write_bytes(data[:len(data) - ALIGNMENT])
+    with pytest.raises(IndexFormatError, match='truncated'):
+        read_index(path)
+
+
+def test_missing_file(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        read_index(tmp_path / 'index.bin')
+
+
+def test_string_array():
+    strings = ['flow', '', 'mach', 'número', 'ß']
+    array = StringArray.encode(strings)
+    assert len(array) == len(strings)
+    assert list(array) == strings
+    assert array[-1] == 'ß'
+    assert array[1:4] == strings[1:4]
+    with pytest.raises(IndexError):
+        array[len(strings)]
+    joined = StringArray.concatenate([array, StringArray.encode([]), StringArray.encode(['wing'])])
+    assert list(joined) == strings + ['wing']
+
+
+def test_string_array_round_trip(tmp_path):
+    path = tmp_path / 'index.bin'
+    array = StringArray.encode(['boundary', 'layer', 'número'])
+    write_index(path, {'vocab_offsets': array.offsets, 'vocab': array.blob})
+    sections, _ = read_index(path)
+    assert list(StringArray(sections['vocab_offsets'], sections['vocab'])) == ['boundary', 'layer', 'número']
+
+
+def test_corpus_is_indexed_again_after_a_version_change(make_corpus, workdir):
+    corpus = make_corpus()
+    expected = corpus.doc_ids.tolist(), list(corpus.vocabulary), corpus.stats.idf.tolist()
+    del corpus
+    folder = workdir.parent.parent / 'data' / 'indexed_corpus' / 'test'
+    for path in folder.glob('*.bin'):
+        set_version(path, FORMAT_VERSION + 1)
+
+    corpus = make_corpus()
+    assert (corpus.doc_ids.tolist(), list(corpus.vocabulary), corpus.stats.idf.tolist()) == expected
+    for path in folder.glob('*.bin'):
+        read_index(path)
+
+
+def test_long_section_names_are_rejected(tmp_path):
+    path = tmp_path / 'index.bin'
+    write_index(path, {'n' * 32: np.arange(3)})
+    assert list(read_index(path)[0]) == ['n' * 32]
+    with pytest.raises(ValueError, match='more than 32 bytes'):
+        write_index(path, {'n' * 33: np.arange(3)})
+    assert list(read_index(path)[0]) == ['n' * 32]
@@ -0,0 +1,178 @@
+import threading
+
+import pytest
+
+from src.code.instrumentation import BUCKETS, Histogram, Instrumentation, metrics
+from models import VectorModel
+
+
+def test_disabled_registry_records_nothing():
+    registry = Instrumentation()
+    with registry.timer('scoring'):
+        pass
+    registry.increment('queries')
+    assert registry.stages == {} and registry.counters == {}
+
+
+def test_timers_and_counters():
+    registry = Instrumentation(enabled=True)
+    for _ in range(3):
+        with registry.timer('scoring'):
+            pass
+    registry.observe('sorting', 0.003)
+    registry.increment('queries')
+    registry.increment('queries', 2)
+    assert registry.stages['scoring'].count == 3
+    assert registry.stages['sorting'].total == pytest.approx(0.003)
+    assert registry.counters == {'queries': 3}
+    registry.reset()
+    assert registry.stages == {} and registry.counters == {}
+
+
+def test_histogram_buckets():
+    histogram = Histogram()
+    for value in (0.00005, 0.0001, 0.0002, 3, 100):
+        histogram.observe(value)
+    counts = histogram.cumulative_counts()
+    # the bounds are inclusive, like the le label of Prometheus
+    assert counts[BUCKETS.index(0.0001)] == 2
+    assert counts[BUCKETS.index(0.00025)] == 3
+    assert counts[BUCKETS.index(5)] == 4
+    assert counts[-1] == histogram.count == 5
+    assert histogram.total == pytest.approx(103.0003)
+
+
+def test_prometheus_rendering():
+    registry = Instrumentation(enabled=True)
+    registry.observe('scoring', 0.002)
+    registry.observe('scoring', 20)
+    registry.increment('queries', 2)
+    text = registry.render_prometheus({'live_documents': 12}, prefix='ir')
+    lines = text.splitlines()
+    assert text.endswith('\n')
+    assert '# TYPE ir_stage_duration_seconds histogram' in lines
+    assert 'ir_stage_duration_seconds_bucket{stage="scoring",le="0.001"} 0' in lines
+    assert 'ir_stage_duration_seconds_bucket{stage="scoring",le="0.0025"} 1' in lines
+    assert 'ir_stage_duration_seconds_bucket{stage="scoring",le="10"} 1' in lines
+    assert 'ir_stage_duration_seconds_bucket{stage="scoring",le="+Inf"} 2' in lines
+    assert 'ir_stage_duration_seconds_sum{stage="scoring"} 20.002' in lines
+    assert 'ir_stage_duration_seconds_count{stage="scoring"} 2' in lines
+    assert lines[lines.index('# TYPE ir_queries_total counter') + 1] == 'ir_queries_total 2'
+    assert lines[lines.index('# TYPE ir_live_documents gauge') + 1] == 'ir_live_documents 12'
+
+
+def test_trace_records_the_stages_of_its_thread_when_disabled():
+    registry = Instrumentation()
+    other = []
+
+    def run_other():
+        with registry.trace() as spans:
+            with registry.timer('other'):
+                pass
+        other.extend(spans)
+
+    with registry.trace() as spans:
+        with registry.timer('search'):
+            with registry.timer('scoring'):
+                thread = threading.Thread(target=run_other)
+                thread.start()
+                thread.join()
+    assert [stage for stage, _ in spans] == ['scoring', 'search']
+    assert spans[0][1] <= spans[1][1]
+    assert [stage for stage, _ in other] == ['other']
+    assert registry.stages == {}
+    # without traces the timers do nothing again
+    with registry.timer('search'):
+        pass
+    assert registry._active_traces == 0
+
+
+def test_nested_traces():
+    registry = Instrumentation()
+    with registry.trace() as outer:
+        with registry.timer('analysis'):
+            pass
+        with registry.trace() as inner:
+            with registry.timer('scoring'):
+                pass
+        with registry.timer('sorting'):
+            pass
+    assert [stage for stage, _ in outer] == ['analysis', 'sorting']
+    assert [stage for stage, _ in inner] == ['scoring']
+
+
+def test_search_stages_nest(make_corpus):
+    model = VectorModel(make_corpus())
+    with metrics.trace() as spans:
+        model.search('flow heat')
+    durations = dict(spans)
+    assert {'analysis', 'scoring', 'sorting', 'search'} <= durations.keys()
+    assert durations['sorting'] <= durations['scoring'] <= durations['search']
+
+
+def test_profiler_samples_the_blocks():
+    registry = Instrumentation()
+    profiles = []
+    registry.set_profiler(3, profiles.append)
+    for _ in range(7):
+        with registry.profile():
+            sum(range(100))
+    assert len(profiles) == 2
+    registry.set_profiler(0)
+    with registry.profile():
+        pass
+    assert len(profiles) == 2
+
+
+def test_only_one_block_is_profiled_at_a_time():
+    registry = Instrumentation()
+    profiles = []
+    registry.set_profiler(1, profiles.append)
+    started, release = threading.Event(), threading.Event()
+    errors = []
+
+    def profiled():
+        try:
+            with registry.profile():
+                started.set()
+                release.wait(5)
+        except Exception as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=profiled)
+    thread.start()
+    started.wait(5)
+    # the blocks sampled while the other thread is profiled run without profiler
+    for _ in range(3):
+        with registry.profile():
+            pass
+    release.set()
+    thread.join()
+    assert errors == [] and len(profiles) == 1
+    with registry.profile():
+        pass
+    assert len(profiles) == 2
+
+
+def test_concurrent_sampled_blocks():
+    registry = Instrumentation()
+    profiles = []
+    registry.set_profiler(1, profiles.append)
+    errors = []
+
+    def run():
+        try:
+            for _ in range(50):
+                with registry.profile():
+                    sum(range(1000))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert registry._profiled_calls == 200
+    assert 1 <= len(profiles) <= 200
@@ -0,0 +1,49 @@
+import threading
+
+import numpy as np
+
+from models import LSAModel, latent_semantic_analysis
+
+
+def test_only_the_new_documents_are_folded_in(make_corpus):
+    corpus = make_corpus()
+    model = LSAModel(corpus, n_components=4)
+    vectors = model.doc_vectors
+    corpus.add_documents([(100, 'cone', 'supersonic flow over a cone')])
+    assert 100 in model.search('supersonic cone').doc_ids
+    assert len(model.doc_vectors) == len(vectors) + 1
+    np.testing.assert_array_equal(model.doc_vectors[:len(vectors)], vectors)
+
+    # the new document is folded in with the statistics of the corpus
+    expected = model.fold_documents(corpus.get_tfidf_matrix('csr'))[-1]
+    np.testing.assert_allclose(model.doc_vectors[-1], expected, atol=1e-6)
+    model.wait_for_save()
+
+
+def test_deleted_documents_are_skipped(make_corpus):
+    corpus = make_corpus()
+    model = LSAModel(corpus, n_components=4)
+    doc_id = model.search('slender wing').doc_ids[0]
+    vectors = model.doc_vectors
+    corpus.delete_documents([doc_id])
+    assert doc_id not in model.search('slender wing').doc_ids
+    assert model.doc_vectors is vectors
+
+
+def test_new_vectors_are_saved_in_the_background(make_corpus, monkeypatch):
+    corpus = make_corpus()
+    model = LSAModel(corpus, n_components=4)
+    release = threading.Event()
+    write_index = latent_semantic_analysis.write_index
+    monkeypatch.setattr(latent_semantic_analysis, 'write_index',
+                        lambda *args: release.wait(5) and write_index(*args))
+    corpus.add_documents([(100, 'cone', 'supersonic flow over a cone')])
+    # the query doesn't wait for the file
+    assert 100 in model.search('supersonic cone').doc_ids
+    corpus.add_documents([(101, 'wing', 'heat transfer on a wing')])
+    assert 101 in model.search('wing heat').doc_ids
+    release.set()
+    model.wait_for_save()
+
+    loaded = LSAModel(corpus, n_components=4)
+    np.testing.assert_array_equal(loaded.doc_vectors, model.doc_vectors)
@@ -0,0 +1,28 @@
+import pytest
+
+from models import VectorModel
+
+
+def test_iter_query_yields_the_whole_ranking(make_corpus):
+    model = VectorModel(make_corpus())
+    expected = model.rank('flow heat wing')
+    for batch_size in (1, 2, 3, 100):
+        ranking = list(model.iter_query('flow heat wing', batch_size))
+        assert [doc_id for doc_id, _ in ranking] == [doc_id for doc_id, _ in expected]
+        assert [score for _, score in ranking] == pytest.approx([score for _, score in expected])
+
+
+def test_iter_query_stops_early(make_corpus):
+    model = VectorModel(make_corpus())
+    ranked = []
+    model.rank = lambda query, k=None: ranked.append(k) or VectorModel.rank(model, query, k)
+    iterator = model.iter_query('flow', batch_size=2)
+    assert len([next(iterator) for _ in range(3)]) == 3
+    assert ranked == [2, 4]
+
+
+@pytest.mark.parametrize('batch_size', [0, -1])
+def test_iter_query_rejects_empty_batches(make_corpus, batch_size):
+    model = VectorModel(make_corpus())
+    with pytest.raises(ValueError):
+        model.iter_query('flow', batch_size)
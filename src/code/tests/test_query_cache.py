@@ -0,0 +1,102 @@
+import pytest
+
+from models import QueryResultCache, VectorModel, query_cache
+
+
+def ranking(n, start=0):
+    # every document of a ranking takes 16 bytes, the id and the score
+    return [(doc_id, 1.0 / (doc_id + 1)) for doc_id in range(start, start + n)]
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(query_cache.time, 'monotonic', lambda: now[0])
+    return now
+
+
+def test_get_returns_the_stored_ranking():
+    cache = QueryResultCache()
+    assert cache.get('flow', 0) is None
+    cache.put('flow', ranking(3), 0)
+    assert cache.get('flow', 0) == ranking(3)
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 1
+
+
+def test_least_recently_used_entries_are_evicted_under_max_bytes():
+    cache = QueryResultCache(max_bytes=16 * 10)
+    cache.put('a', ranking(4), 0)
+    cache.put('b', ranking(4), 0)
+    assert cache.get('a', 0) is not None
+    cache.put('c', ranking(4), 0)
+    assert cache.get('b', 0) is None
+    assert cache.get('a', 0) == ranking(4)
+    assert cache.get('c', 0) == ranking(4)
+    assert cache.nbytes == 16 * 8 <= cache.max_bytes
+    assert cache.stats()['evictions'] == 1
+
+    cache.put('d', ranking(10), 0)
+    assert len(cache) == 1 and cache.nbytes == 16 * 10
+    assert cache.stats()['evictions'] == 3
+
+
+def test_rankings_bigger_than_the_cache_are_not_stored():
+    cache = QueryResultCache(max_bytes=16 * 10)
+    cache.put('a', ranking(4), 0)
+    cache.put('b', ranking(11), 0)
+    assert cache.get('b', 0) is None
+    assert cache.get('a', 0) == ranking(4)
+
+
+def test_replacing_an_entry_updates_the_size():
+    cache = QueryResultCache(max_bytes=16 * 10)
+    cache.put('a', ranking(8), 0)
+    cache.put('a', ranking(2, start=5), 0)
+    assert cache.nbytes == 16 * 2
+    assert cache.get('a', 0) == ranking(2, start=5)
+
+
+def test_expired_entries_are_dropped(clock):
+    cache = QueryResultCache(ttl=10)
+    cache.put('a', ranking(3), 0)
+    clock[0] += 9.5
+    assert cache.get('a', 0) == ranking(3)
+    clock[0] += 1
+    assert cache.get('a', 0) is None
+    assert len(cache) == 0 and cache.nbytes == 0
+    assert cache.stats()['expirations'] == 1
+
+
+def test_entries_without_ttl_never_expire(clock):
+    cache = QueryResultCache(ttl=None)
+    cache.put('a', ranking(3), 0)
+    clock[0] += 10 ** 6
+    assert cache.get('a', 0) == ranking(3)
+
+
+def test_a_new_index_version_invalidates_the_cache():
+    cache = QueryResultCache()
+    cache.put('a', ranking(3), 1)
+    cache.put('b', ranking(3), 1)
+    assert cache.get('a', 2) is None
+    assert cache.get('b', 1) is None
+    assert len(cache) == 0 and cache.nbytes == 0
+    assert cache.stats()['invalidations'] == 1
+    # the rankings of an older index aren't stored
+    cache.put('a', ranking(3), 1)
+    assert cache.get('a', 2) is None
+    cache.put('a', ranking(2), 2)
+    assert cache.get('a', 2) == ranking(2)
+
+
+def test_model_rankings_follow_the_changes_of_the_corpus(make_corpus):
+    model = VectorModel(make_corpus())
+    model.result_cache = QueryResultCache()
+    first = model.rank('cone flow', 3)
+    assert model.rank('cone flow', 3) == first
+    assert model.result_cache.stats()['hits'] == 1
+
+    model.add_documents([(None, 'cone', 'flow over a cone at a cone angle')])
+    ranking = model.rank('cone flow', 3)
+    assert ranking[0][0] == 13 and ranking != first
+    assert model.result_cache.stats()['invalidations'] == 1
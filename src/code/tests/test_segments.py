@@ -0,0 +1,182 @@
+import shutil
+
+import numpy as np
+import pytest
+
+from conftest import TEXTS, IdentifiedCorpus, write_documents
+from corpus import CorpusStatistics, MergePolicy
+from corpus.document import DocumentStore
+from models import VectorModel
+
+
+class FakeSegment:
+    def __init__(self, num_docs):
+        self.num_docs = num_docs
+
+
+def find_merge(policy, sizes):
+    return policy.find_merge([FakeSegment(num_docs) for num_docs in sizes])
+
+
+@pytest.mark.parametrize('sizes, expected', [
+    ([10, 10, 10, 10], slice(0, 4)),
+    ([1400, 10, 10, 10], None),
+    ([3900, 10, 10, 10], None),
+    ([1400, 10, 10, 10, 10], slice(1, 5)),
+    ([1400, 1100, 1100, 1100], slice(0, 4)),
+    ([5000, 1400, 1100, 1100, 1100], slice(1, 5)),
+    ([10, 10, 10], None),
+])
+def test_merge_policy(sizes, expected):
+    assert find_merge(MergePolicy(merge_factor=4, min_docs=1000), sizes) == expected
+
+
+def test_merges_keep_the_number_of_segments_logarithmic():
+    policy = MergePolicy(merge_factor=4, min_docs=10)
+    sizes = [1400]
+    for _ in range(500):
+        sizes.append(1)
+        while (positions := find_merge(policy, sizes)) is not None:
+            sizes[positions] = [sum(sizes[positions])]
+    assert sum(sizes) == 1900
+    assert sizes[0] == 1400
+    assert len(sizes) <= 12
+
+
+def test_changes_are_buffered_until_flush_size(make_corpus):
+    corpus = make_corpus(flush_size=3)
+    num_docs = len(corpus.live_docs)
+    corpus.add_documents([(None, 'a', 'flow over a cone')])
+    corpus.delete_documents([1])
+    assert make_corpus().live_docs.size == num_docs
+    assert len(corpus.segments) == 1
+
+    corpus.update_document((2, 'b', 'heat of a cone'))
+    reopened = make_corpus()
+    assert len(reopened.live_docs) == num_docs
+    assert 1 not in reopened.mapping
+    assert reopened.id2doc(2).doc_title == 'b'
+
+
+def test_explicit_save(make_corpus):
+    corpus = make_corpus()
+    corpus.add_documents([(None, 'a', 'flow over a cone')], save=True)
+    assert len(make_corpus().live_docs) == len(corpus.live_docs)
+    corpus.delete_documents([3])
+    corpus.save_indexed_corpus()
+    assert 3 not in make_corpus().mapping
+
+
+def test_changes_update_the_statistics_once_per_batch(make_corpus, monkeypatch):
+    corpus = make_corpus()
+    corpus.add_documents([(None, 'a', 'flow over a cone')], save=True)
+    assert len(corpus.segments) == 2
+    parts = corpus.postings.parts()
+
+    calls = []
+    norms = CorpusStatistics.norms
+    monkeypatch.setattr(CorpusStatistics, 'norms', staticmethod(lambda *args: calls.append(args) or norms(*args)))
+    corpus.delete_documents([1])
+    corpus.add_documents([(None, 'b', 'heat of a cone')])
+    corpus.delete_documents([2])
+    assert calls == []
+    stats = corpus.stats
+    assert stats.doc_norms is stats.doc_norms
+    assert len(calls) == 1
+
+    # only the first segment has new tombstones
+    new_parts = corpus.postings.parts()
+    assert new_parts[0][0] is not parts[0][0]
+    assert new_parts[1][0] is parts[1][0]
+
+    expected = corpus.create_statistics()
+    assert np.array_equal(stats.max_tf, expected.max_tf)
+    for name in ('idf', 'doc_norms', 'max_weights'):
+        np.testing.assert_allclose(getattr(stats, name), getattr(expected, name), err_msg=name)
+
+
+def test_the_live_segment_is_built_once_per_batch(make_corpus, monkeypatch):
+    corpus = make_corpus()
+    built = []
+    from_documents = DocumentStore.from_documents
+    monkeypatch.setattr(DocumentStore, 'from_documents',
+                        classmethod(lambda cls, documents, *args: built.append(len(documents)) or
+                                    from_documents(documents, *args)))
+    corpus.add_documents([(None, 'a', 'flow over a cone')])
+    corpus.add_documents([(None, 'b', 'heat of a cone')])
+    snapshot = corpus.snapshot
+    corpus.add_documents([(None, 'c', 'pressure on a cone')])
+    assert built == []
+
+    # the old snapshot doesn't see the documents added after it
+    cone = corpus.token2id('cone')
+    old_docs, _ = snapshot.postings.postings(cone)
+    docs, _ = corpus.get_postings(cone)
+    assert built == [2, 3]
+    assert docs.tolist() == old_docs.tolist() + [len(corpus.deleted) - 1]
+    assert corpus.doc2bow(int(docs[-1])) == dict(corpus.index.doc2bow(corpus.documents[int(docs[-1])].doc_tokens))
+
+    VectorModel(corpus).search('cone')
+    corpus.save_indexed_corpus()
+    assert built == [2, 3]
+    assert len(make_corpus().live_docs) == len(corpus.live_docs)
+
+
+def describe(corpus):
+    """Gets the index of the corpus by doc id and token, which doesn't depend on the ordinals and the token ids"""
+    stats = corpus.stats
+    matrix = corpus.get_tfidf_matrix()
+    documents = {}
+    for ordinal in corpus.live_docs.tolist():
+        doc = corpus.documents[ordinal]
+        bow = {corpus.vocabulary[tok_id]: freq for tok_id, freq in corpus.doc2bow(ordinal).items()}
+        row = matrix.getrow(ordinal)
+        weights = {corpus.vocabulary[tok_id]: round(weight, 9) for tok_id, weight in zip(row.indices, row.data)}
+        documents[doc.doc_id] = (doc.doc_title, bow, weights, int(stats.max_tf[ordinal]),
+                                 round(float(stats.doc_norms[ordinal]), 9))
+    tokens = {token for _, bow, *_ in documents.values() for token in bow}
+    idf = {token: round(float(stats.idf[corpus.token2id(token)]), 9) for token in tokens}
+    return documents, idf
+
+
+def ranking(model, query):
+    return sorted((doc_id, round(score, 9)) for doc_id, score in model.search(query).ranking)
+
+
+def test_changes_match_a_full_rebuild(workdir):
+    path = workdir.parent.parent / 'data' / 'corpus' / 'test'
+    documents = {i: (f't{i}', text) for i, text in enumerate(TEXTS, start=1)}
+    write_documents(path, documents)
+    policy = MergePolicy(merge_factor=2, min_docs=1)
+    corpus = IdentifiedCorpus(path, workers=1, merge_policy=policy)
+
+    added = {13: ('t13', 'flow over a slender cone'), 14: ('t14', 'cooling of the blunt body by the flow')}
+    corpus.add_documents([(doc_id, *doc) for doc_id, doc in added.items()], save=True)
+    corpus.delete_documents([1, 5])
+    corpus.update_document((3, 'u3', 'transition of the boundary layer on a cone'))
+    corpus.add_documents([(15, 't15', 'panel flutter at supersonic mach number')])
+    corpus.update_document((13, 'u13', 'heat transfer on a cone'))
+    corpus.delete_documents([14])
+    corpus.save_indexed_corpus()
+    corpus.wait_for_merges()
+
+    documents.update(added)
+    documents.update({3: ('u3', 'transition of the boundary layer on a cone'),
+                      15: ('t15', 'panel flutter at supersonic mach number'),
+                      13: ('u13', 'heat transfer on a cone')})
+    for doc_id in (1, 5, 14):
+        del documents[doc_id]
+
+    reopened = IdentifiedCorpus(path, workers=1)
+    assert len(reopened.segments) > 1
+    shutil.rmtree(workdir.parent.parent / 'data' / 'indexed_corpus' / 'test')
+    write_documents(path, documents)
+    rebuilt = IdentifiedCorpus(path, workers=1)
+    assert len(rebuilt.segments) == 1
+
+    expected = describe(rebuilt)
+    assert sorted(expected[0]) == sorted(documents)
+    assert describe(reopened) == expected
+    assert describe(corpus) == expected
+    for query in ['flow', 'heat transfer cone', 'boundary layer', 'supersonic mach number', 'pressure shells']:
+        assert ranking(VectorModel(reopened), query) == ranking(VectorModel(rebuilt), query), query
@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+
+
+def expected_weights(corpus, ti):
+    docs, freqs = corpus.postings.postings(ti)
+    return docs, freqs / corpus.stats.max_tf[docs] * corpus.stats.idf[ti]
+
+
+def test_cached_weights_follow_the_corpus(make_corpus):
+    corpus = make_corpus()
+    ti = corpus.token2id('flow')
+    corpus.get_term_weights(ti)
+    corpus.get_term_weights(ti)
+    assert corpus.term_weights.stats()['hits'] == 1
+
+    ordinal = int(corpus.add_documents([(None, 'new', 'flow over a cone')], save=False)[0])
+    weights = corpus.get_term_weights(ti)
+    docs, expected = expected_weights(corpus, ti)
+    assert ordinal in weights.docs.tolist()
+    np.testing.assert_array_equal(weights.docs, docs)
+    np.testing.assert_allclose(weights.weights, expected)
+
+
+def test_snapshot_pairs_postings_and_statistics(make_corpus):
+    corpus = make_corpus()
+    snapshot = corpus.snapshot
+    corpus.delete_documents([1], save=False)
+    assert corpus.snapshot is not snapshot
+    assert corpus.snapshot.stats.num_docs == len(corpus.deleted)
+    assert corpus.snapshot.stats is not snapshot.stats
+    ti = corpus.token2id('boundary')
+    docs, expected = expected_weights(corpus, ti)
+    assert 0 not in docs.tolist()
+    np.testing.assert_allclose(corpus.get_term_weights(ti).weights, expected)
+
+
+def test_tfidf_matrix_is_kept_until_the_statistics_change(make_corpus):
+    corpus = make_corpus()
+    matrix = corpus.get_tfidf_matrix('csr')
+    corpus.flush()
+    assert corpus.get_tfidf_matrix('csr') is matrix
+    corpus.add_documents([(None, 'new', 'heat of a cone')], save=False)
+    assert corpus.get_tfidf_matrix('csr').shape[0] == matrix.shape[0] + 1
+    with pytest.raises(ValueError):
+        corpus.get_tfidf_matrix('coo')
@@ -0,0 +1,62 @@
+import pytest
+
+from benchmark import SyntheticCorpus
+from models import VectorModel
+
+QUERIES = SyntheticCorpus(num_docs=400, doc_length=60, vocab_size=800).queries(n=30)
+
+
+def assert_same_ranking(ranking, expected):
+    assert [doc_id for doc_id, _ in ranking] == [doc_id for doc_id, _ in expected]
+    assert [score for _, score in ranking] == pytest.approx([score for _, score in expected])
+
+
+def test_pruning_with_all_the_clusters_gives_the_exhaustive_ranking(synthetic_corpus):
+    exhaustive = VectorModel(synthetic_corpus)
+    pruned = VectorModel(synthetic_corpus, nprobe=exhaustive.clusterer.model.n_clusters)
+    for query in QUERIES:
+        assert_same_ranking(pruned.rank(query), exhaustive.rank(query))
+        assert_same_ranking(pruned.rank(query, 10), exhaustive.rank(query)[:10])
+
+
+def test_pruning_scores_the_documents_of_the_nearest_clusters(synthetic_corpus):
+    exhaustive = VectorModel(synthetic_corpus)
+    pruned = VectorModel(synthetic_corpus, nprobe=1)
+    scores = dict(exhaustive.rank(QUERIES[0]))
+    ranking = pruned.rank(QUERIES[0])
+    assert 0 < len(ranking) < len(scores)
+    assert [score for _, score in ranking] == pytest.approx([scores[doc_id] for doc_id, _ in ranking])
+
+
+def test_pruning_skips_the_deleted_documents(synthetic_corpus):
+    exhaustive = VectorModel(synthetic_corpus)
+    pruned = VectorModel(synthetic_corpus, nprobe=exhaustive.clusterer.model.n_clusters)
+    best = pruned.rank(QUERIES[0], 3)[0][0]
+    pruned.delete_documents([best])
+    assert best not in [doc_id for doc_id, _ in pruned.rank(QUERIES[0])]
+    assert_same_ranking(pruned.rank(QUERIES[0]), exhaustive.rank(QUERIES[0]))
+
+
+@pytest.mark.parametrize('k', [1, 5, 20])
+def test_max_score_gives_the_best_k_of_the_exhaustive_ranking(synthetic_corpus, k):
+    model = VectorModel(synthetic_corpus)
+    for query in QUERIES:
+        assert_same_ranking(model.rank(query, k), model.rank(query)[:k])
+
+
+def test_sparse_engine_gives_the_same_scores(synthetic_corpus):
+    postings = VectorModel(synthetic_corpus)
+    sparse = VectorModel(synthetic_corpus, engine='sparse')
+    for query in QUERIES:
+        assert_same_ranking(sparse.rank(query), postings.rank(query))
+        assert_same_ranking(sparse.rank(query, 10), postings.rank(query, 10))
+
+
+@pytest.mark.parametrize('k, chunk_size', [(None, 256), (10, 256), (10, 7)])
+def test_batch_rankings_match_the_rankings_of_every_query(synthetic_corpus, k, chunk_size):
+    model = VectorModel(synthetic_corpus)
+    queries = QUERIES + ['', 'the of and']
+    rankings = model.query_batch(queries, k, chunk_size)
+    assert len(rankings) == len(queries)
+    for ranking, query in zip(rankings, queries):
+        assert_same_ranking(ranking, model.rank(query, k))
@@ -1,4 +1,3 @@
-import math
 import os
 from typing import Dict
 
@@ -30,7 +29,7 @@ def tokenize(string: str):
 def tf(corpus: "Corpus", ti: int, dj: int) -> float:
     """Returns the normalized term frequency of a term in a document"""
     freq = corpus.get_frequency(ti, dj)
-    max_freq_tok, max_freq = corpus.get_max_frequency(dj)
+    max_freq = corpus.stats.max_tf[dj]
 
     if max_freq == 0:
         return 0
@@ -40,17 +39,12 @@ def tf(corpus: "Corpus", ti: int, dj: int) -> float:
 
 def idf(corpus: "Corpus", ti: int) -> float:
     """Returns the inverse document frequency of a term"""
-    N = len(corpus.documents)
-    ni = corpus.index.dfs[ti]
-    return math.log2(N / ni)
+    return corpus.stats.idf[ti]
 
 
 def normalized_idf(corpus: "Corpus", ti: int) -> float:
     """Returns the normalized inverse document frequency of a term"""
-    N = len(corpus.documents)
-    ni = corpus.index.dfs[ti]
-    max_idf = corpus.max_idf
-    return math.log2(N / ni) / max_idf if max_idf > 0 else 0
+    return corpus.stats.normalized_idf[ti]
 
 
 def download_cran_corpus_if_not_exist():